@@ -1,59 +1,145 @@
 import json
 import os
 import sys
-import subprocess
-from typing import List, Dict, Any
+import hashlib
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, List, Dict, Any, Optional, Tuple
 import base64
 
 # Add the scripts directory to the path for importing cost_tracker
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from cost_tracker import CostTracker
+from cost_tracker import get_cost_tracker
+from http_client import CancelToken, HttpResult, get_http_client
+from comment_parser import IncrementalCommentParser, parse_review
+from token_budget import (REVIEW_OUTPUT_TOKENS, estimate_tokens, plan_review_budget,
+                          truncate_to_tokens)
+from review_cache import get_review_cache, hunk_cache_key
+from handoff import HandoffError, load_architecture_context, load_diff
+from llm_retry import ProviderResponse, ReviewUnavailable, call_with_retries, parse_retry_after, should_retry_status
+from diff_parser import (DiffFile, DiffHunk, DiffLine, count_changed_lines, parse_diff,
+                         record_lines)
 
+# Provider endpoints; the base URLs can point at a local stand-in server
+ANTHROPIC_API_URL = os.environ.get('ANTHROPIC_BASE_URL', 'https://api.anthropic.com') + '/v1/messages'
+OPENAI_API_URL = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com') + '/v1/chat/completions'
 
-def read_architecture_context() -> str:
-    """Read the architecture summary file for context."""
-    file_path = "architecture_summary.txt"  # Use relative path
+# Bump when the review prompt changes so cached hunk reviews are invalidated
+PROMPT_VERSION = '1'
+
+# Chunked reviews run on at most REVIEW_MAX_WORKERS concurrent workers
+DEFAULT_MAX_WORKERS = 4
+
+CLAUDE_MODEL = "claude-sonnet-4-20250514"
+OPENAI_MODEL = "o3-mini"
+# With REVIEW_HEDGE, the other provider gets the same prompt after
+# REVIEW_HEDGE_DELAY seconds or a retryable error; the first valid review wins
+HEDGE_MODELS = {CLAUDE_MODEL: OPENAI_MODEL, OPENAI_MODEL: CLAUDE_MODEL}
+DEFAULT_HEDGE_DELAY = 30.0
+# Provider error types that mean "try again later" whatever the status
+RETRYABLE_ERROR_TYPES = {'overloaded_error', 'rate_limit_error', 'api_error'}
+# Status to retry with when a stream fails after its 200 response
+STREAM_ERROR_STATUS = {'overloaded_error': 529, 'rate_limit_error': 429, 'api_error': 500,
+                       'server_error': 500, 'rate_limit_exceeded': 429}
+
+
+def is_retryable_failure(status: int, error_type: str = '') -> bool:
+    return status == 408 or should_retry_status(status) or error_type in RETRYABLE_ERROR_TYPES
+
+
+def read_architecture_context(max_tokens: Optional[int] = None, model: Optional[str] = None) -> str:
+    """Read the architecture summary file for context, cut to max_tokens if given."""
+    context = _read_architecture_context()
+    if max_tokens is not None:
+        context = truncate_to_tokens(context, max_tokens, model,
+                                     marker="\n... (truncated for brevity)")
+    return context
+
+
+# Context handed over in-process by run_pipeline.py, or loaded once from the handoff file
+_architecture_context_data: Optional[Dict[str, Any]] = None
+
+
+def set_architecture_context(context_data: Optional[Dict[str, Any]]):
+    """Use an already fetched architecture context instead of the environment."""
+    global _architecture_context_data
+    _architecture_context_data = context_data
+
+
+_comment_sink: Optional[Callable[[Dict[str, Any]], None]] = None
+
+
+def set_comment_sink(sink: Optional[Callable[[Dict[str, Any]], None]]):
+    """Hand every review comment to sink as soon as it is known (used by run_pipeline)."""
+    global _comment_sink
+    _comment_sink = sink
+
+
+def emit_comment(comment: Dict[str, Any]):
+    sink = _comment_sink
+    if sink is None:
+        return
+    try:
+        sink(comment)
+    except Exception as e:
+        print(f"Warning: Comment sink failed: {e}", file=sys.stderr)
 
-    if not os.environ.get('ARCHITECTURE_CONTEXT_B64'):
-        if not os.path.exists(file_path):
-            return "No existing architecture summary available."
 
+def streaming_enabled() -> bool:
+    return os.environ.get('REVIEW_STREAM', 'false').lower() == 'true'
+
+
+def format_architecture_context(architecture_context: Dict[str, Any]) -> str:
+    """Render the fetched architecture context as prompt text."""
+    # The fallback context has architecture_summary set to None
+    architecture_summary = (architecture_context.get(
+        'architecture_summary') or {}).get('summary', '')
+    recent_changes_context = ""
+    recent_changes = architecture_context.get('recent_changes', [])[
+        :3]  # Limit to 3 most recent
+    for change in recent_changes:
+        recent_changes_context += f"Recent PR #{change.get('pr_number', 'Unknown')}: {change.get('metadata', {}).get('pr_title', 'No title')}\n"
+    return f"{architecture_summary}\n\n{recent_changes_context}"
+
+
+def _read_architecture_context() -> str:
+    file_path = "architecture_summary.txt"  # Use relative path
+
+    if _architecture_context_data is None and (os.environ.get('ARCHITECTURE_CONTEXT_PATH') or
+                                               os.environ.get('ARCHITECTURE_CONTEXT_B64')):
+        # Decoded on first use and kept for the chunks that follow
         try:
-            with open(file_path, 'r') as f:
-                content = f.read()
-                # Limit context to avoid token limits
-                words = content.split()
-                if len(words) > 1500:  # Limit to ~1500 words
-                    content = ' '.join(words[:1500]) + \
-                        "\n... (truncated for brevity)"
-                return content
+            set_architecture_context(load_architecture_context())
         except Exception as e:
-            print(f'Error reading architecture summary: {e}', file=sys.stderr)
-            return "Error reading architecture summary."
-    else:
+            print(
+                f"Warning: Could not decode architecture context: {e}", file=sys.stderr)
+            return "Error decoding architecture context."
+
+    if _architecture_context_data is not None:
         try:
-            context_json = base64.b64decode(
-                os.environ['ARCHITECTURE_CONTEXT_B64']).decode('utf-8')
-            architecture_context = json.loads(context_json)
-            architecture_summary = architecture_context.get(
-                'architecture_summary', {}).get('summary', '')
-            recent_changes_context = ""
-            recent_changes = architecture_context.get('recent_changes', [])[
-                :3]  # Limit to 3 most recent
-            for change in recent_changes:
-                recent_changes_context += f"Recent PR #{change.get('pr_number', 'Unknown')}: {change.get('metadata', {}).get('pr_title', 'No title')}\n"
-            return f"{architecture_summary}\n\n{recent_changes_context}"
+            return format_architecture_context(_architecture_context_data)
         except Exception as e:
             print(
                 f"Warning: Could not decode architecture context: {e}", file=sys.stderr)
             return "Error decoding architecture context."
 
+    if not os.path.exists(file_path):
+        return "No existing architecture summary available."
+
+    try:
+        with open(file_path, 'r') as f:
+            return f.read()
+    except Exception as e:
+        print(f'Error reading architecture summary: {e}', file=sys.stderr)
+        return "Error reading architecture summary."
+
 
 def create_claude_payload(model: str, prompt: str) -> Dict[str, Any]:
     """Create payload for Claude API."""
     return {
         "model": model,
-        "max_tokens": 10000,
+        "max_tokens": REVIEW_OUTPUT_TOKENS,
         "messages": [
             {
                 "role": "user",
@@ -77,141 +163,312 @@ def create_openai_payload(model: str, prompt: str) -> Dict[str, Any]:
 
     # Use max_completion_tokens for o3-mini, max_tokens for other models
     if model == "o3-mini":
-        payload["max_completion_tokens"] = 10000
+        payload["max_completion_tokens"] = REVIEW_OUTPUT_TOKENS
     else:
-        payload["max_tokens"] = 10000
+        payload["max_tokens"] = REVIEW_OUTPUT_TOKENS
 
     return payload
 
 
-def call_claude_api(api_key: str, payload: Dict[str, Any]) -> str:
-    """Call Claude API and return the response content."""
-    # Log minimal payload details
-    payload_size = len(json.dumps(payload))
-    prompt_length = len(payload.get('messages', [{}])[0].get('content', ''))
+class ReviewProvider(ABC):
+    """What differs between the review APIs: endpoint, credentials, payload and response shapes."""
+    name = ''
+    # Key of the provider's circuit breaker in llm_retry
+    breaker = ''
+    api_key_env = ''
+    default_model = ''
+
+    @property
+    @abstractmethod
+    def url(self) -> str:
+        """Endpoint, read from the module constant at call time."""
+
+    @abstractmethod
+    def headers(self, api_key: str) -> Dict[str, str]:
+        """Authentication and version headers."""
+
+    @abstractmethod
+    def create_payload(self, model: str, prompt: str) -> Dict[str, Any]:
+        """Request body for a review prompt."""
+
+    def stream_payload(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(payload, stream=True)
+
+    def error_info(self, data: Dict[str, Any]) -> Tuple[str, str]:
+        """(type, message) of an error response body."""
+        error = data.get('error')
+        if not isinstance(error, dict):
+            return '', str(error or '')
+        return error.get('type') or '', error.get('message') or ''
+
+    @abstractmethod
+    def response_text(self, data: Dict[str, Any]) -> str:
+        """Review text of a complete response body."""
+
+    @abstractmethod
+    def read_event(self, event: str, message: Dict[str, Any]
+                   ) -> Tuple[Optional[str], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """(text, usage, error) carried by one streamed event; each may be None."""
+
+
+class ClaudeProvider(ReviewProvider):
+    """Anthropic Messages API; streamed usage comes from message_start and message_delta."""
+    name = 'Claude'
+    breaker = 'anthropic'
+    api_key_env = 'ANTHROPIC_API_KEY'
+    default_model = CLAUDE_MODEL
+
+    @property
+    def url(self) -> str:
+        return ANTHROPIC_API_URL
+
+    def headers(self, api_key: str) -> Dict[str, str]:
+        return {
+            'x-api-key': api_key,
+            'anthropic-version': '2023-06-01'
+        }
+
+    def create_payload(self, model: str, prompt: str) -> Dict[str, Any]:
+        return create_claude_payload(model, prompt)
+
+    def response_text(self, data: Dict[str, Any]) -> str:
+        if 'content' in data and isinstance(data['content'], list) and len(data['content']) > 0:
+            return data['content'][0].get('text', '[]')
+        return data.get('text', '[]')
+
+    def read_event(self, event, message):
+        kind = message.get('type', event)
+        if kind == 'message_start':
+            return None, (message.get('message') or {}).get('usage'), None
+        if kind == 'content_block_delta':
+            return (message.get('delta') or {}).get('text'), None, None
+        if kind == 'message_delta':
+            return None, message.get('usage'), None
+        if kind == 'error':
+            return None, None, message.get('error') or {'type': 'unknown'}
+        return None, None, None
+
+
+class OpenAIProvider(ReviewProvider):
+    """OpenAI Chat Completions API; streamed usage only comes with stream_options.include_usage."""
+    name = 'OpenAI'
+    breaker = 'openai'
+    api_key_env = 'OPENAI_API_KEY'
+    default_model = OPENAI_MODEL
+
+    @property
+    def url(self) -> str:
+        return OPENAI_API_URL
+
+    def headers(self, api_key: str) -> Dict[str, str]:
+        return {
+            'Authorization': f'Bearer {api_key}'
+        }
+
+    def create_payload(self, model: str, prompt: str) -> Dict[str, Any]:
+        return create_openai_payload(model, prompt)
+
+    def stream_payload(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(payload, stream=True, stream_options={'include_usage': True})
+
+    def response_text(self, data: Dict[str, Any]) -> str:
+        return data.get('choices', [{}])[0].get('message', {}).get('content', '[]')
 
-    print(f"Claude API call - Model: {payload.get('model', 'unknown')}", file=sys.stderr)
-    
-    # Log warning if payload is very large
-    if payload_size > 100000:  # 100k bytes
-        print(f"WARNING: Large payload detected ({payload_size:,} bytes)", file=sys.stderr)
+    def read_event(self, event, message):
+        if isinstance(message.get('error'), dict):
+            return None, None, message['error']
+        text = ''.join((choice.get('delta') or {}).get('content') or ''
+                       for choice in message.get('choices') or [])
+        return text or None, message.get('usage') or None, None
 
-    if prompt_length > 5000:  # 5k characters
-        print(f"WARNING: Very long prompt detected ({prompt_length:,} characters)", file=sys.stderr)
 
-    with open('/tmp/claude_payload.json', 'w') as f:
-        json.dump(payload, f)
+PROVIDERS = {CLAUDE_MODEL: ClaudeProvider(), OPENAI_MODEL: OpenAIProvider()}
 
-    result = subprocess.run([
-        'curl', '-s', 'https://api.anthropic.com/v1/messages',
-        '-H', f'x-api-key: {api_key}',
-        '-H', 'anthropic-version: 2023-06-01',
-        '-H', 'Content-Type: application/json',
-        '-d', '@/tmp/claude_payload.json'
-    ], capture_output=True, text=True)
 
-    if result.returncode != 0:
-        print(f'Claude API call failed: {result.stderr}', file=sys.stderr)
-        return '[]'
+def get_provider(model: str) -> ReviewProvider:
+    """The provider serving model; every model other than Claude goes to OpenAI."""
+    return PROVIDERS[CLAUDE_MODEL] if model == CLAUDE_MODEL else PROVIDERS[OPENAI_MODEL]
 
-    print(f"Claude API response status: success", file=sys.stderr)
 
-    try:
-        data = json.loads(result.stdout)
-        if 'error' in data:
-            error_info = data['error']
-            error_type = error_info.get('type', 'unknown')
-            error_message = error_info.get('message', 'unknown error')
-            print(
-                f'Claude API Error - Type: {error_type}, Message: {error_message}', file=sys.stderr)
+def provider_failure(provider: ReviewProvider, result: HttpResult) -> Optional[ProviderResponse]:
+    """The ProviderResponse for a failed request, or None if it succeeded."""
+    if result.error_type == 'cancelled':
+        return ProviderResponse(cancelled=True, in_flight=True)
+    if result.error_type in ('timeout', 'connection', 'decode'):
+        print(f'{provider.name} API call failed ({result.error_type}): {result.error_message}', file=sys.stderr)
+        return ProviderResponse(retryable=result.error_type != 'decode', status=result.status,
+                                error=f"{provider.name} API {result.error_type}: {result.error_message}")
 
-            # Check for common payload size related errors
-            if 'too_large' in error_message.lower() or 'limit' in error_message.lower():
-                print(f'ERROR: Payload may be too large for Claude API',
-                      file=sys.stderr)
+    print(f"{provider.name} API response status: {result.status} in {result.elapsed:.2f}s", file=sys.stderr)
 
-            return '[]'
+    data = result.data if isinstance(result.data, dict) else {}
+    if 'error' in data or not result.ok:
+        error_type, error_message = provider.error_info(data)
+        error_type = error_type or 'unknown'
+        error_message = error_message or result.error_message or 'unknown error'
+        print(f'{provider.name} API Error - Type: {error_type}, Message: {error_message}', file=sys.stderr)
 
-        # Track cost before returning
-        try:
-            cost_tracker = CostTracker()
-            cost_tracker.track_api_call(
-                model=payload.get('model', 'claude-sonnet-4-20250514'),
-                response_data=data,
-                call_type="review",
-                context="Code review analysis"
-            )
-        except Exception as e:
-            print(f"Warning: Cost tracking failed: {e}", file=sys.stderr)
+        # Check for common payload size related errors
+        if 'too_large' in error_message.lower() or 'limit' in error_message.lower():
+            print(f'ERROR: Payload may be too large for {provider.name} API', file=sys.stderr)
 
-        if 'content' in data and isinstance(data['content'], list) and len(data['content']) > 0:
-            return data['content'][0].get('text', '[]')
-        else:
-            return data.get('text', '[]')
+        return ProviderResponse(retryable=is_retryable_failure(result.status, error_type),
+                                status=result.status, retry_after=parse_retry_after(result.headers),
+                                error=f"{provider.name} API {error_type} (HTTP {result.status}): {error_message}")
+    return None
+
+
+def track_review_usage(model: str, usage: Dict[str, Any], call_type: str, context: str):
+    try:
+        get_cost_tracker().track_api_call(model=model, response_data={'usage': usage},
+                                          call_type=call_type, context=context)
     except Exception as e:
-        print(f'Error parsing Claude response: {e}', file=sys.stderr)
-        return '[]'
+        print(f"Warning: Cost tracking failed: {e}", file=sys.stderr)
 
 
-def call_openai_api(api_key: str, payload: Dict[str, Any]) -> str:
-    """Call OpenAI API and return the response content."""
+def send_provider_review(provider: ReviewProvider, api_key: str, payload: Dict[str, Any],
+                         call_type: str = "review", cancel: Optional[CancelToken] = None,
+                         on_comment: Optional[Callable[[Dict[str, Any]], None]] = None) -> ProviderResponse:
+    """Call the provider's API once and return the response content with the failure kind.
+
+    With REVIEW_STREAM the response is streamed and on_comment gets each
+    comment as soon as it is complete.
+    """
     # Log minimal payload details
-    print(f"OpenAI API call - Model: {payload.get('model', 'unknown')}", file=sys.stderr)
-    
-    with open('/tmp/openai_payload.json', 'w') as f:
-        json.dump(payload, f)
-
-    result = subprocess.run([
-        'curl', '-s', 'https://api.openai.com/v1/chat/completions',
-        '-H', f'Authorization: Bearer {api_key}',
-        '-H', 'Content-Type: application/json',
-        '-d', '@/tmp/openai_payload.json'
-    ], capture_output=True, text=True)
-
-    if result.returncode != 0:
-        print(f'OpenAI API call failed: {result.stderr}', file=sys.stderr)
-        return '[]'
+    payload_size = len(json.dumps(payload))
+    prompt_length = len(payload.get('messages', [{}])[0].get('content', ''))
 
-    try:
-        data = json.loads(result.stdout)
-        if 'error' in data:
-            print(f'OpenAI API Error: {data["error"]}', file=sys.stderr)
-            return '[]'
+    print(f"{provider.name} API call - Model: {payload.get('model', 'unknown')}", file=sys.stderr)
 
-        # Track cost before returning
-        try:
-            cost_tracker = CostTracker()
-            cost_tracker.track_api_call(
-                model=payload.get('model', 'o3-mini'),
-                response_data=data,
-                call_type="review",
-                context="Code review analysis"
-            )
-        except Exception as e:
-            print(f"Warning: Cost tracking failed: {e}", file=sys.stderr)
+    # Log warning if payload is very large
+    if payload_size > 100000:  # 100k bytes
+        print(f"WARNING: Large payload detected ({payload_size:,} bytes)", file=sys.stderr)
 
-        return data.get('choices', [{}])[0].get('message', {}).get('content', '[]')
-    except Exception as e:
-        print(f'Error parsing OpenAI response: {e}', file=sys.stderr)
-        return '[]'
+    if prompt_length > 5000:  # 5k characters
+        print(f"WARNING: Very long prompt detected ({prompt_length:,} characters)", file=sys.stderr)
 
+    headers = provider.headers(api_key)
+    if streaming_enabled():
+        response, result = stream_provider_review(provider, headers, payload, call_type, cancel, on_comment)
+        if response is not None:
+            return response
+    else:
+        result = get_http_client().post_json(provider.url, payload, headers=headers, cancel=cancel)
 
-def create_review_prompt(diff: str) -> str:
-    """Create the review prompt for the AI model."""
-    architecture_context = read_architecture_context()
+    try:
+        failure = provider_failure(provider, result)
+        if failure is not None:
+            return failure
+        data = result.data or {}
+        track_review_usage(payload.get('model', provider.default_model), data.get('usage') or {},
+                           call_type, "Code review analysis")
+        return ProviderResponse(content=provider.response_text(data))
+    except Exception as e:
+        print(f'Error parsing {provider.name} response: {e}', file=sys.stderr)
+        return ProviderResponse(status=result.status, error=f"Unreadable {provider.name} response: {e}")
+
+
+def stream_provider_review(provider: ReviewProvider, headers: Dict[str, str], payload: Dict[str, Any],
+                           call_type: str, cancel: Optional[CancelToken],
+                           on_comment: Optional[Callable[[Dict[str, Any]], None]]
+                           ) -> Tuple[Optional[ProviderResponse], HttpResult]:
+    """Stream a review, passing on comments as they complete.
+
+    Returns no response, only the result, when the API answered with a
+    plain message instead of a stream; the caller reads it as usual.
+    Streamed usage is recorded even when the stream breaks off, since
+    those tokens are billed.
+    """
+    parser = IncrementalCommentParser()
+    text_parts: List[str] = []
+    usage: Dict[str, Any] = {}
+    stream_error: Dict[str, Any] = {}
+    start = time.monotonic()
+    first_comment: List[float] = []
+
+    def on_event(event: str, data: str):
+        try:
+            message = json.loads(data)
+        except ValueError:
+            # Includes OpenAI's closing [DONE]
+            return
+        if not isinstance(message, dict):
+            return
+        text, event_usage, error = provider.read_event(event, message)
+        if event_usage:
+            usage.update(event_usage)
+        if error:
+            stream_error.update(error)
+        if text:
+            text_parts.append(text)
+            comments = parser.feed(text)
+            if comments and not first_comment:
+                first_comment.append(time.monotonic() - start)
+            if on_comment is not None:
+                for comment in comments:
+                    on_comment(comment)
+
+    result = get_http_client().post_sse(provider.url, provider.stream_payload(payload), on_event,
+                                        headers=headers, cancel=cancel)
+    if usage:
+        track_review_usage(payload.get('model', provider.default_model), usage, call_type,
+                           "Code review analysis (streamed)")
+    if result.ok and result.data is not None:
+        return None, result
+    failure = provider_failure(provider, result)
+    if failure is not None:
+        return failure, result
+    if first_comment:
+        print(f"{provider.name} stream: first comment after {first_comment[0]:.2f}s", file=sys.stderr)
+    if stream_error:
+        error_type = stream_error.get('type') or 'unknown'
+        print(f"{provider.name} stream error - Type: {error_type}, Message: {stream_error.get('message')}",
+              file=sys.stderr)
+        status = STREAM_ERROR_STATUS.get(error_type, 0)
+        return ProviderResponse(retryable=is_retryable_failure(status, error_type), status=status,
+                                error=f"{provider.name} API {error_type} during stream: "
+                                      f"{stream_error.get('message')}"), result
+    return ProviderResponse(content=''.join(text_parts) or '[]'), result
+
+
+def create_review_prompt(diff: str, max_diff_tokens: Optional[int] = None,
+                         architecture_context: Optional[str] = None,
+                         model: Optional[str] = None) -> str:
+    """Create the review prompt for the AI model.
+
+    The diff is cut to max_diff_tokens when given; chunked diffs are already
+    sized to the budget and pass None.
+    """
+    if architecture_context is None:
+        architecture_context = read_architecture_context()
 
     # Log minimal diff details
     diff_lines = diff.count('\n')
     diff_length = len(diff)
     print(f"Diff size: {diff_lines:,} lines, {diff_length:,} characters", file=sys.stderr)
 
-    # Truncate diff if it's too large to avoid API limits
-    max_diff_length = 5000  # Conservative limit for diff content
-    if diff_length > max_diff_length:
-        print(
-            f"WARNING: Diff is very large ({diff_length:,} chars), truncating to {max_diff_length:,} chars", file=sys.stderr)
-        diff = diff[:max_diff_length] + "\n... (diff truncated due to size)"
+    # Truncate diff if it doesn't fit the token budget
+    if max_diff_tokens is not None:
+        diff = truncate_diff(diff, max_diff_tokens, model)
+
+    return format_review_prompt(architecture_context, diff)
 
+
+DIFF_TRUNCATION_MARKER = "\n... (diff truncated due to size)"
+
+
+def truncate_diff(diff: str, max_diff_tokens: int, model: Optional[str] = None) -> str:
+    """Cut the diff to max_diff_tokens, ending it with DIFF_TRUNCATION_MARKER if anything was cut."""
+    diff_tokens = estimate_tokens(diff, model)
+    if diff_tokens <= max_diff_tokens:
+        return diff
+    print(
+        f"WARNING: Diff is very large (~{diff_tokens:,} tokens), truncating to {max_diff_tokens:,} tokens", file=sys.stderr)
+    return truncate_to_tokens(diff, max_diff_tokens, model, marker=DIFF_TRUNCATION_MARKER)
+
+
+def format_review_prompt(architecture_context: str, diff: str) -> str:
+    """Fill the review prompt template."""
     return f"""You are a helpful and diligent code assistant. Review the following unified diff and provide line-by-line feedback for specific issues.
 
     TASK
@@ -257,9 +514,7 @@ def should_use_claude(diff: str, has_important_label: bool, line_threshold: int
         return True
 
     # Use Claude if the diff is large (over threshold)
-    diff_lines = diff.count('\n')
-    added_removed_lines = len(
-        [line for line in diff.split('\n') if line.startswith(('+', '-'))])
+    added_removed_lines = count_changed_lines(diff)
 
     if added_removed_lines > line_threshold:
         print(
@@ -271,86 +526,521 @@ def should_use_claude(diff: str, has_important_label: bool, line_threshold: int
     return False
 
 
-def get_ai_review(model: str, diff: str) -> str:
-    """Get AI review for the given diff using specified model."""
-    prompt = create_review_prompt(diff)
+def send_review(model: str, prompt: str, call_type: str = "review",
+                cancel: Optional[CancelToken] = None,
+                on_retry: Optional[Callable[[ProviderResponse], None]] = None,
+                on_comment: Optional[Callable[[Dict[str, Any]], None]] = None) -> ProviderResponse:
+    """Send a review prompt to the provider for the model, with retries and its circuit breaker.
+
+    on_comment receives comments as they stream in (REVIEW_STREAM only).
+    """
+    provider = get_provider(model)
+    api_key = os.environ.get(provider.api_key_env, '')
+    if not api_key:
+        print(f'{provider.api_key_env} not found', file=sys.stderr)
+        return ProviderResponse(error=f'{provider.api_key_env} not set')
+
+    payload = provider.create_payload(model, prompt)
+    return call_with_retries(provider.breaker,
+                             lambda: send_provider_review(provider, api_key, payload, call_type, cancel, on_comment),
+                             cancel, on_retry)
+
 
-    if model == "claude-sonnet-4-20250514":
-        api_key = os.environ.get('ANTHROPIC_API_KEY', '')
-        if not api_key:
-            print('ANTHROPIC_API_KEY not found', file=sys.stderr)
-            return '[]'
+def has_api_key(model: str) -> bool:
+    return bool(os.environ.get(get_provider(model).api_key_env))
 
-        payload = create_claude_payload(model, prompt)
-        return call_claude_api(api_key, payload)
+
+def is_valid_review(content: Optional[str]) -> bool:
+    """True if the response holds a complete JSON array of comments."""
+    if content is None:
+        return False
+    result = parse_review(content)
+    return result.found_array and not result.truncated
+
+
+def request_review(model: str, prompt: str) -> str:
+    """Send a review prompt to the provider for the model.
+
+    Raises ReviewUnavailable when no provider returned a review, so a failed
+    call is never mistaken for a review without comments. Streamed comments
+    go to the comment sink as they arrive, except in hedged reviews, where
+    only the winner's comments count; those are posted with the final review.
+    """
+    if os.environ.get('REVIEW_HEDGE', 'false').lower() == 'true':
+        response = request_hedged_review(model, prompt)
     else:
-        api_key = os.environ.get('OPENAI_API_KEY', '')
-        if not api_key:
-            print('OPENAI_API_KEY not found', file=sys.stderr)
-            return '[]'
+        response = send_review(model, prompt, on_comment=emit_comment)
+    if response.content is None:
+        raise ReviewUnavailable(response.error or f"No response from {model}")
+    return response.content
+
+
+def request_hedged_review(model: str, prompt: str) -> ProviderResponse:
+    """Race the model against the other provider and return the first valid review.
+
+    The other provider is only asked once the primary has not answered within
+    REVIEW_HEDGE_DELAY seconds or failed with a retryable error. The losing
+    request is cancelled; both calls are recorded in CostTracker, the
+    cancelled one with its estimated input tokens.
+    """
+    hedge_model = HEDGE_MODELS.get(model)
+    if hedge_model is None or not has_api_key(hedge_model):
+        return send_review(model, prompt)
+    delay = float(os.environ.get('REVIEW_HEDGE_DELAY', DEFAULT_HEDGE_DELAY))
+
+    tokens = {model: CancelToken(), hedge_model: CancelToken()}
+    start = time.monotonic()
+    winner: Optional[str] = None
+    fallback: Optional[ProviderResponse] = None
+    # Completed by the primary's first retryable failure, so the wait below wakes up
+    retry_signal: Future = Future()
+
+    def signal_retry(response: ProviderResponse):
+        if not retry_signal.done():
+            retry_signal.set_result(response)
+
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='hedge')
+    pending = {executor.submit(send_review, model, prompt, "review", tokens[model], signal_retry): model}
+    finished: Dict[str, ProviderResponse] = {}
+
+    def start_hedge(reason: str):
+        print(f"Hedging review with {hedge_model}: {reason}", file=sys.stderr)
+        pending[executor.submit(send_review, hedge_model, prompt, "review_hedge",
+                                tokens[hedge_model])] = hedge_model
 
-        payload = create_openai_payload(model, prompt)
-        return call_openai_api(api_key, payload)
+    try:
+        while pending and winner is None:
+            hedged = hedge_model in pending.values() or hedge_model in finished
+            timeout = None if hedged else max(0.0, delay - (time.monotonic() - start))
+            waiting = set(pending) if hedged else set(pending) | {retry_signal}
+            done, _ = wait(waiting, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                start_hedge(f"no response from {model} after {delay:.1f}s")
+                continue
+            if retry_signal in done and not hedged:
+                start_hedge(f"{model} is retrying: {retry_signal.result().error}")
+                hedged = True
+            for future in done & set(pending):
+                name = pending.pop(future)
+                response = finished[name] = future.result()
+                if is_valid_review(response.content):
+                    winner = name
+                    break
+                if fallback is None or fallback.content is None:
+                    fallback = response
+                print(f"{name} returned no valid review", file=sys.stderr)
+                if name == model and not hedged and response.retryable:
+                    start_hedge(f"retryable error from {model}")
+                    hedged = True
+    finally:
+        for name in pending.values():
+            tokens[name].cancel()
+        executor.shutdown(wait=True)
+
+    for future, name in pending.items():
+        response = future.result()
+        if response.cancelled and response.in_flight:
+            track_cancelled_review(name, prompt, "review" if name == model else "review_hedge")
+
+    if winner is None:
+        print(f"No valid review from {model} or {hedge_model} after "
+              f"{time.monotonic() - start:.2f}s", file=sys.stderr)
+        return fallback or ProviderResponse(error=f"No response from {model} or {hedge_model}")
+    print(f"Hedged review won by {winner} after {time.monotonic() - start:.2f}s", file=sys.stderr)
+    return finished[winner]
+
+
+def track_cancelled_review(model: str, prompt: str, call_type: str):
+    """Record a cancelled call with its estimated input tokens; the provider may bill them."""
+    input_tokens = estimate_tokens(prompt, model)
+    usage = {'input_tokens': input_tokens} if model == CLAUDE_MODEL else {'prompt_tokens': input_tokens}
+    try:
+        get_cost_tracker().track_api_call(model=model, response_data={'usage': usage},
+                                          call_type=call_type,
+                                          context="Cancelled after losing hedge (input tokens estimated)")
+    except Exception as e:
+        print(f"Warning: Cost tracking failed: {e}", file=sys.stderr)
+
+
+def split_diff_into_hunks(diff: str) -> List[Dict[str, Any]]:
+    """Split a diff into single-hunk units, each carrying its file header."""
+    units: List[Dict[str, Any]] = []
+    for record in parse_diff(diff):
+        if isinstance(record, DiffFile):
+            units.append({'file': record, 'hunk': None, 'lines': []})
+        elif isinstance(record, DiffHunk):
+            units.append({'file': record.file, 'hunk': record, 'lines': []})
+        elif units:
+            units[-1]['lines'].append(record.text)
+    # Header-only entries are kept only for files without hunks (binary, renames)
+    files_with_hunks = {id(unit['file']) for unit in units if unit['hunk'] is not None}
+    return [unit for unit in units
+            if unit['hunk'] is not None or id(unit['file']) not in files_with_hunks]
+
+
+def plan_review(model: str, architecture_context: str, diff: str,
+                report: bool = True) -> Dict[str, Any]:
+    """Split the request token budget for a review and report it to CostTracker."""
+    budget = plan_review_budget(
+        model,
+        prompt_overhead_tokens=estimate_tokens(format_review_prompt('', ''), model),
+        architecture_tokens=estimate_tokens(architecture_context, model),
+        diff_tokens=estimate_tokens(diff, model))
+    if report:
+        try:
+            get_cost_tracker().track_budget(budget, context="Code review request")
+        except Exception as e:
+            print(f"Warning: Budget tracking failed: {e}", file=sys.stderr)
+    return budget
+
+
+def report_sent_diff(model: str, architecture_context: str, diff: str, truncate: bool):
+    """Record the budget of a request about to be sent, warning if an untruncated diff is over it."""
+    budget = plan_review(model, architecture_context, diff)
+    if not truncate and budget['requested_diff_tokens'] > budget['diff_tokens']:
+        print(f"WARNING: Diff exceeds the diff budget (~{budget['requested_diff_tokens']:,} of "
+              f"{budget['diff_tokens']:,} tokens) and is sent whole", file=sys.stderr)
+
+
+def get_ai_review(model: str, diff: str, truncate: bool = True) -> str:
+    """Get AI review for the given diff using specified model.
+
+    Raises ReviewUnavailable if the providers gave no review.
+
+    The architecture context and, unless truncate is False, the diff are cut
+    to the token budget planned for the model. With the review cache enabled,
+    hunks reviewed before with the same model, prompt and architecture context
+    replay their cached comments and only the remaining hunks are sent.
+    """
+    from post_comments import parse_review_comments
+
+    architecture_context = read_architecture_context()
+    # Reported once the diff actually sent is known; cached hunks cost nothing
+    budget = plan_review(model, architecture_context, diff, report=False)
+    architecture_context = truncate_to_tokens(
+        architecture_context, budget['architecture_tokens'], model,
+        marker="\n... (truncated for brevity)")
+    max_diff_tokens = budget['diff_tokens'] if truncate else None
+
+    cache = get_review_cache()
+    if cache is None:
+        report_sent_diff(model, architecture_context, diff, truncate)
+        prompt = create_review_prompt(diff, max_diff_tokens, architecture_context, model)
+        return request_review(model, prompt)
+
+    context_version = hashlib.sha256(architecture_context.encode('utf-8')).hexdigest()[:16]
+    cached_comments: List[Dict[str, Any]] = []
+    missed = []
+    for unit in split_diff_into_hunks(diff):
+        hunk = unit['hunk']
+        if hunk is None:
+            missed.append(unit)
+            continue
+        path = unit['file'].path or ''
+        unit['key'] = hunk_cache_key(path, unit['lines'], model, PROMPT_VERSION, context_version)
+        comments = cache.get(unit['key'])
+        if comments is None:
+            missed.append(unit)
+            continue
+        for comment in comments:
+            replayed = {k: v for k, v in comment.items() if k != 'offset'}
+            replayed['path'] = path
+            replayed['line'] = hunk.new_start + comment['offset']
+            cached_comments.append(replayed)
+
+    for comment in cached_comments:
+        emit_comment(comment)
+
+    if not any(unit['hunk'] is not None for unit in missed):
+        print(f"All hunks served from review cache ({len(cached_comments)} comments)",
+              file=sys.stderr)
+        return json.dumps(cached_comments)
+
+    # Rebuild a diff containing only the hunks that missed the cache,
+    # noting where each hunk ends in it
+    miss_lines: List[str] = []
+    miss_length = 0
+    last_file = None
+    for unit in missed:
+        added = []
+        if unit['file'] is not last_file:
+            added.extend(unit['file'].header_lines)
+            last_file = unit['file']
+        if unit['hunk'] is not None:
+            added.append(unit['hunk'].header)
+            added.extend(unit['lines'])
+        miss_lines.extend(added)
+        miss_length += sum(len(line) + 1 for line in added)
+        unit['end'] = miss_length - 1
+    miss_diff = '\n'.join(miss_lines)
+
+    # Only hunks sent in full are cached; ones cut by truncation were never reviewed
+    sent_diff = miss_diff
+    if max_diff_tokens is not None:
+        sent_diff = truncate_diff(miss_diff, max_diff_tokens, model)
+    sent_length = len(miss_diff) if sent_diff is miss_diff else len(sent_diff) - len(DIFF_TRUNCATION_MARKER)
+    sent_units = [unit for unit in missed if unit['hunk'] is not None and unit['end'] <= sent_length]
+    print(f"Review cache: {len(cached_comments)} cached comments replayed, "
+          f"{len(sent_units)} hunks sent to the model", file=sys.stderr)
+
+    report_sent_diff(model, architecture_context, sent_diff, truncate)
+    prompt = create_review_prompt(sent_diff, None, architecture_context, model)
+    try:
+        review = request_review(model, prompt)
+    except ReviewUnavailable as e:
+        # Don't cache failures; still report what the cache already knew
+        e.review = json.dumps(cached_comments)
+        raise
+
+    new_comments = parse_review_comments(review)
+    result = json.dumps(cached_comments + new_comments)
+    # A cut-off or non-JSON answer would replay as "no issues" on later pushes
+    if not is_valid_review(review):
+        print("Review response is not a complete comment array, not caching it", file=sys.stderr)
+        return result
+
+    per_hunk: Dict[str, List[Dict[str, Any]]] = {unit['key']: [] for unit in sent_units}
+    unplaced = 0
+    for comment in new_comments:
+        for unit in sent_units:
+            hunk = unit['hunk']
+            if (comment.get('path') == unit['file'].path
+                    and hunk.new_start <= comment['line'] < hunk.new_start + max(hunk.new_count, 1)):
+                stored = {k: v for k, v in comment.items() if k not in ('path', 'line')}
+                stored['offset'] = comment['line'] - hunk.new_start
+                per_hunk[unit['key']].append(stored)
+                break
+        else:
+            unplaced += 1
+    # A comment outside every hunk would be lost on replay, so the hunks stay uncached
+    if unplaced:
+        print(f"{unplaced} comments fall outside the reviewed hunks, not caching this review",
+              file=sys.stderr)
+        return result
+    for key, comments in per_hunk.items():
+        cache.put(key, comments)
+
+    return result
 
 
 def filter_github_files_from_diff(diff: str) -> str:
     """Filter out .github files from the diff content."""
-    lines = diff.split('\n')
     filtered_lines = []
     skip_file = False
 
-    for line in lines:
-        if line.startswith('diff --git'):
+    for record in parse_diff(diff):
+        if isinstance(record, DiffFile):
             # Check if this is a .github file
-            parts = line.split()
-            if len(parts) >= 4:
-                file_path = parts[3][2:]  # Remove "b/" prefix
-                if file_path.startswith('.github/'):
-                    skip_file = True
-                    print(
-                        f"Filtering out .github file from AI review: {file_path}", file=sys.stderr)
-                    continue
-                else:
-                    skip_file = False
+            skip_file = bool(record.path and record.path.startswith('.github/'))
+            if skip_file:
+                print(
+                    f"Filtering out .github file from AI review: {record.path}", file=sys.stderr)
 
         if not skip_file:
-            filtered_lines.append(line)
+            filtered_lines.extend(record_lines(record))
 
     return '\n'.join(filtered_lines)
 
 
-if __name__ == "__main__":
-    # Get environment variables
-    diff_b64 = os.environ.get('DIFF_B64', '')
-    model = os.environ.get('MODEL', '')
-    has_important_label = os.environ.get(
-        'HAS_IMPORTANT_LABEL', 'false').lower() == 'true'
-    line_threshold = int(os.environ.get('LINE_THRESHOLD', '0'))
+def has_reviewable_files(diff: str) -> bool:
+    """Check whether the diff still touches at least one file."""
+    return any(isinstance(record, DiffFile) and record.path for record in parse_diff(diff))
 
-    if not diff_b64:
-        print('Missing required environment variable: DIFF_B64', file=sys.stderr)
-        sys.exit(1)
 
-    # Decode diff
-    diff = base64.b64decode(diff_b64).decode('utf-8')
+def split_hunk(hunk: DiffHunk, lines: List[DiffLine], max_tokens: int,
+               model: Optional[str] = None) -> List[List[str]]:
+    """Split an oversized hunk into smaller hunks with recomputed headers.
+
+    Each piece, including its own hunk header, fits in max_tokens unless a single line does not.
+    """
+    texts = [line.text for line in lines]
+    if estimate_tokens('\n'.join([hunk.header] + texts), model) <= max_tokens:
+        return [[hunk.header] + texts]
+
+    # Every piece repeats a hunk header; budget for the longest one it can get
+    header_tokens = estimate_tokens(
+        f"@@ -{hunk.old_start + hunk.old_count},{hunk.old_count} "
+        f"+{hunk.new_start + hunk.new_count},{hunk.new_count} @@{hunk.section}", model) + 1
+
+    old_line, new_line = hunk.old_start, hunk.new_start
+    pieces = []
+    body: List[str] = []
+    body_tokens = header_tokens
+    piece_old_start, piece_new_start = old_line, new_line
+    piece_old_count = piece_new_count = 0
+
+    def flush():
+        header = (f"@@ -{piece_old_start},{piece_old_count} "
+                  f"+{piece_new_start},{piece_new_count} @@{hunk.section}")
+        pieces.append([header] + body)
+
+    for line in lines:
+        line_tokens = estimate_tokens(line.text, model) + 1
+        if body and body_tokens + line_tokens > max_tokens:
+            flush()
+            body = []
+            body_tokens = header_tokens
+            piece_old_start, piece_new_start = old_line, new_line
+            piece_old_count = piece_new_count = 0
+
+        body.append(line.text)
+        body_tokens += line_tokens
+        if line.old_lineno is not None:
+            old_line += 1
+            piece_old_count += 1
+        if line.new_lineno is not None:
+            new_line += 1
+            piece_new_count += 1
+
+    if body:
+        flush()
+    return pieces
+
+
+def split_diff_into_chunks(diff: str, max_tokens: int, model: Optional[str] = None) -> List[str]:
+    """Split a unified diff into chunks along file and hunk boundaries.
+
+    Every line of the input ends up in exactly one chunk. File headers are
+    repeated in each chunk that contains hunks from that file, and hunks
+    larger than the budget are split with recomputed hunk headers; the
+    repeated headers count against the budget.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    header: List[str] = []
+    header_tokens = 0
+    header_in_chunk = False
+    file_has_hunks = True
+    pending_hunk: Optional[DiffHunk] = None
+    pending_lines: List[DiffLine] = []
+
+    def close_chunk():
+        nonlocal current, current_tokens, header_in_chunk
+        if current:
+            chunks.append('\n'.join(current))
+        current = []
+        current_tokens = 0
+        header_in_chunk = False
+
+    def add_lines(lines: List[str], tokens: int, needs_header: bool):
+        nonlocal current_tokens, header_in_chunk
+        needed = tokens + (header_tokens if needs_header and not header_in_chunk else 0)
+        if current and current_tokens + needed > max_tokens:
+            close_chunk()
+        if needs_header and not header_in_chunk:
+            current.extend(header)
+            current_tokens += header_tokens
+            header_in_chunk = True
+        current.extend(lines)
+        current_tokens += tokens
+
+    def flush_hunk():
+        nonlocal pending_hunk, pending_lines
+        if pending_hunk is not None:
+            for piece in split_hunk(pending_hunk, pending_lines, max(max_tokens - header_tokens, 1), model):
+                add_lines(piece, estimate_tokens('\n'.join(piece), model), needs_header=True)
+        pending_hunk = None
+        pending_lines = []
+
+    def flush_file():
+        # Binary files, pure renames and mode changes have no hunks
+        flush_hunk()
+        if not file_has_hunks:
+            add_lines(header, header_tokens, needs_header=False)
+
+    for record in parse_diff(diff):
+        if isinstance(record, DiffFile):
+            flush_file()
+            header = record.header_lines
+            header_tokens = estimate_tokens('\n'.join(header), model)
+            header_in_chunk = False
+            file_has_hunks = False
+        elif isinstance(record, DiffHunk):
+            flush_hunk()
+            pending_hunk = record
+            file_has_hunks = True
+        else:
+            pending_lines.append(record)
+
+    flush_file()
+    close_chunk()
+    return chunks
+
 
+def get_chunked_ai_review(model: str, diff: str, max_chunk_tokens: Optional[int] = None,
+                          max_workers: int = DEFAULT_MAX_WORKERS) -> str:
+    """Review a diff in token-sized chunks concurrently and merge the results.
+
+    Chunks are sized to the diff share of the request token budget, capped
+    at max_chunk_tokens when given. If any chunk gets no review,
+    ReviewUnavailable is raised carrying the merged comments of the others.
+    """
+    from post_comments import parse_review_comments
+
+    diff_budget = plan_review(model, read_architecture_context(), diff, report=False)['diff_tokens']
+    if max_chunk_tokens is None or max_chunk_tokens > diff_budget:
+        max_chunk_tokens = diff_budget
+
+    chunks = split_diff_into_chunks(diff, max_chunk_tokens, model)
+    print(f"Reviewing diff in {len(chunks)} chunk(s) with up to {max_workers} workers",
+          file=sys.stderr)
+
+    if len(chunks) == 1:
+        return get_ai_review(model, chunks[0], truncate=False)
+
+    def review_chunk(chunk: str):
+        try:
+            return get_ai_review(model, chunk, truncate=False), None
+        except ReviewUnavailable as e:
+            return e.review, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+        results = list(executor.map(review_chunk, chunks))
+
+    merged: List[Dict[str, Any]] = []
+    seen = set()
+    failures = [error for _, error in results if error is not None]
+    for index, (review, error) in enumerate(results, 1):
+        if error is not None:
+            print(f"Chunk {index}/{len(chunks)}: review unavailable ({error.reason})", file=sys.stderr)
+        comments = parse_review_comments(review)
+        print(f"Chunk {index}/{len(chunks)}: {len(comments)} comments", file=sys.stderr)
+        for comment in comments:
+            key = json.dumps(comment, sort_keys=True)
+            if key not in seen:
+                seen.add(key)
+                merged.append(comment)
+
+    if failures:
+        raise ReviewUnavailable(failures[0].reason, json.dumps(merged), len(failures), len(chunks))
+    return json.dumps(merged)
+
+
+def run_review(diff: str, model: str = '', has_important_label: bool = False,
+               line_threshold: int = 0, chunked_review: bool = True,
+               chunk_tokens: Optional[int] = None, max_workers: int = DEFAULT_MAX_WORKERS,
+               incremental_review: bool = False) -> Dict[str, str]:
+    """Review a PR diff and return the step outputs (review_b64, model_used, ...).
+
+    review_status is 'complete', 'partial' (some chunks got no review) or
+    'unavailable' (no provider answered); review_error says why.
+    """
     # Filter out .github files from diff
     diff = filter_github_files_from_diff(diff)
 
+    # Only review what changed since the last reviewed push
+    review_scope = 'full'
+    if incremental_review:
+        from delta_review import narrow_to_last_review
+        diff, review_scope = narrow_to_last_review(diff)
+
     # Check if there's any meaningful diff left after filtering
-    if not diff.strip() or not any(line.startswith('diff --git') for line in diff.split('\n')):
+    if not diff.strip() or not has_reviewable_files(diff):
         print(
-            "No significant files to analyze after filtering .github files", file=sys.stderr)
-        review_b64 = base64.b64encode("[]".encode('utf-8')).decode('utf-8')
-        
-        # Write output to GitHub Actions output file
-        if 'GITHUB_OUTPUT' in os.environ:
-            with open(os.environ['GITHUB_OUTPUT'], 'a') as fh:
-                fh.write(f"review_b64={review_b64}\n")
-        else:
-            # Fallback for local testing
-            print(f"review_b64={review_b64}", file=sys.stderr)
-        sys.exit(0)
+            f"No significant files to analyze after filtering ({review_scope} review)", file=sys.stderr)
+        return {'review_b64': base64.b64encode("[]".encode('utf-8')).decode('utf-8'),
+                'review_status': 'complete'}
 
     # Determine which model to use based on labels and diff size
     if should_use_claude(diff, has_important_label, line_threshold):
@@ -368,19 +1058,66 @@ if __name__ == "__main__":
     print(f"Selected model: {selected_model}", file=sys.stderr)
 
     # Get review
-    review = get_ai_review(selected_model, diff)
+    review_status = 'complete'
+    review_error = ''
+    try:
+        if chunked_review:
+            review = get_chunked_ai_review(selected_model, diff, chunk_tokens, max_workers)
+        else:
+            review = get_ai_review(selected_model, diff)
+    except ReviewUnavailable as e:
+        review = e.review
+        review_status = 'partial' if e.failed < e.total else 'unavailable'
+        review_error = ' '.join(e.reason.split())
+        print(f"Review {review_status}: {e.failed}/{e.total} request(s) failed: {review_error}",
+              file=sys.stderr)
+
+    review_cache = get_review_cache()
+    if review_cache is not None:
+        review_cache.save()
 
     # Output base64 encoded review and model info
-    review_b64 = base64.b64encode(review.encode('utf-8')).decode('utf-8')
-    
-    # Write output to GitHub Actions output file
+    return {
+        'review_b64': base64.b64encode(review.encode('utf-8')).decode('utf-8'),
+        'model_used': selected_model,
+        'model_comment': model_comment,
+        'review_scope': review_scope,
+        'review_status': review_status,
+        'review_error': review_error
+    }
+
+
+def write_outputs(outputs: Dict[str, str]):
+    """Append step outputs to the GitHub Actions output file."""
     if 'GITHUB_OUTPUT' in os.environ:
         with open(os.environ['GITHUB_OUTPUT'], 'a') as fh:
-            fh.write(f"review_b64={review_b64}\n")
-            fh.write(f"model_used={selected_model}\n")
-            fh.write(f"model_comment={model_comment}\n")
+            for key, value in outputs.items():
+                fh.write(f"{key}={value}\n")
     else:
         # Fallback for local testing
-        print(f"review_b64={review_b64}", file=sys.stderr)
-        print(f"model_used={selected_model}", file=sys.stderr)
-        print(f"model_comment={model_comment}", file=sys.stderr)
+        for key, value in outputs.items():
+            print(f"{key}={value}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    # Get environment variables
+    model = os.environ.get('MODEL', '')
+    has_important_label = os.environ.get(
+        'HAS_IMPORTANT_LABEL', 'false').lower() == 'true'
+    line_threshold = int(os.environ.get('LINE_THRESHOLD', '0'))
+    chunked_review = os.environ.get('REVIEW_CHUNKED', 'true').lower() == 'true'
+    chunk_tokens = int(os.environ['REVIEW_CHUNK_TOKENS']) if os.environ.get('REVIEW_CHUNK_TOKENS') else None
+    max_workers = int(os.environ.get('REVIEW_MAX_WORKERS', DEFAULT_MAX_WORKERS))
+    incremental_review = os.environ.get('INCREMENTAL_REVIEW', 'false').lower() == 'true'
+
+    try:
+        diff = load_diff()
+    except HandoffError as e:
+        print(f'Could not read diff: {e}', file=sys.stderr)
+        sys.exit(1)
+    if not diff:
+        print('Missing required environment variable: DIFF_PATH or DIFF_B64', file=sys.stderr)
+        sys.exit(1)
+
+    write_outputs(run_review(diff, model, has_important_label, line_threshold,
+                             chunked_review, chunk_tokens, max_workers, incremental_review))
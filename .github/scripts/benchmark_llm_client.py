@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark provider call latency against the local mock LLM server.
+Compares the pooled in-process client with one curl process per call:
+
+    python3 benchmark_llm_client.py --calls 50 --latency-ms 20
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+# Add the scripts directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from http_client import PooledHttpClient
+from mock_llm_server import start_mock_server
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+    print(f"{name:<16} calls={len(timings):<4} "
+          f"mean={statistics.mean(timings) * 1000:8.2f}ms "
+          f"p50={statistics.median(timings) * 1000:8.2f}ms "
+          f"p95={p95 * 1000:8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark provider call latency offline.')
+    parser.add_argument('--calls', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--prompt-chars', type=int, default=20000)
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(latency=args.latency_ms / 1000)
+    url = f"{base_url}/v1/messages"
+    payload = {
+        'model': 'claude-sonnet-4-20250514',
+        'max_tokens': 10000,
+        'messages': [{'role': 'user', 'content': 'x' * args.prompt_chars}]
+    }
+
+    client = PooledHttpClient()
+    timings = []
+    for _ in range(args.calls):
+        start = time.perf_counter()
+        result = client.post_json(url, payload)
+        timings.append(time.perf_counter() - start)
+        if not result.ok:
+            print(f"Pooled call failed: {result.error_message}", file=sys.stderr)
+            sys.exit(1)
+    report('pooled client', timings)
+    client.close()
+
+    if shutil.which('curl'):
+        body = json.dumps(payload)
+        timings = []
+        for _ in range(args.calls):
+            start = time.perf_counter()
+            subprocess.run(['curl', '-s', url, '-H', 'Content-Type: application/json', '-d', '@-'],
+                           input=body, capture_output=True, text=True)
+            timings.append(time.perf_counter() - start)
+        report('curl subprocess', timings)
+    else:
+        print("curl not found, skipping subprocess baseline", file=sys.stderr)
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Benchmark cold-start import and initialization time of the review scripts.
+Each sample is a fresh interpreter, so nothing is shared between runs:
+
+    python3 benchmark_startup.py --runs 10
+    python3 benchmark_startup.py --runs 20 --modules ai_review summarize_architecture --json /tmp/startup.json
+
+Initialization uses offline settings (SQLite storage and caches in a
+temporary directory), so no credentials or network access are needed.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Every script the workflow runs, with the shared modules they build on
+MODULES = [
+    'run_pipeline', 'ai_review', 'post_comments', 'fetch_macros', 'fetch_firebase_context',
+    'track_architecture', 'summarize_architecture', 'display_costs', 'delta_review',
+    'firebase_client', 'storage_backend', 'cost_tracker', 'http_client', 'review_cache',
+    'codebase_collector', 'diff_parser', 'token_budget', 'handoff', 'llm_retry', 'comment_parser'
+]
+
+# Work done after import on the module's normal entry path
+INIT_SNIPPETS = {
+    'cost_tracker': 'mod.get_cost_tracker()',
+    'display_costs': 'mod.get_cost_tracker().get_summary(include_calls=False)',
+    'http_client': 'mod.get_http_client()',
+    'review_cache': 'mod.get_review_cache()',
+    'storage_backend': 'mod.get_storage_backend()',
+    'fetch_macros': 'mod.get_macros()',
+    'firebase_client': 'mod.get_firebase_client()',
+}
+
+SAMPLE_CODE = """
+import importlib, json, sys, time
+sys.path.insert(0, {scripts_dir!r})
+start = time.perf_counter()
+mod = importlib.import_module({module!r})
+imported = time.perf_counter()
+{init}
+done = time.perf_counter()
+print(json.dumps({{'import': imported - start, 'init': done - imported}}))
+"""
+
+
+def parse_importtime(stderr, module, top):
+    """Return the slowest imports (cumulative microseconds) from -X importtime output."""
+    entries = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        if name != module:
+            entries[name] = max(entries.get(name, 0), int(cumulative))
+    return sorted(entries.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def run_sample(module, env, importtime=False):
+    """Time one fresh interpreter importing and initializing module."""
+    code = SAMPLE_CODE.format(scripts_dir=SCRIPTS_DIR, module=module,
+                              init=INIT_SNIPPETS.get(module, 'pass'))
+    cmd = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+    start = time.perf_counter()
+    result = subprocess.run(cmd, capture_output=True, text=True, env=env)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed')
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['wall'] = wall
+    return timings, result.stderr
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[max(0, int(round(len(values) * fraction)) - 1)]
+
+
+def offline_env(work_dir):
+    """Environment for initialization without credentials, network or shared state."""
+    env = dict(os.environ)
+    env.update({
+        'STORAGE_BACKEND': 'sqlite',
+        'STORAGE_SQLITE_PATH': os.path.join(work_dir, 'storage.sqlite3'),
+        'REVIEW_CACHE_DIR': os.path.join(work_dir, 'cache'),
+    })
+    env.pop('FIREBASE_SNAPSHOT_FILE', None)
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cold-start import and init time of the review scripts.')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--modules', nargs='+', default=MODULES)
+    parser.add_argument('--top', type=int, default=3, help='slowest imports to list per module')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = offline_env(work_dir)
+
+        # Interpreter startup alone, subtracted mentally from every wall time
+        baseline = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', 'pass'], env=env, check=True)
+            baseline.append(time.perf_counter() - start)
+        print(f"{'python -c pass':<24} wall p50={statistics.median(baseline) * 1000:7.1f}ms")
+
+        for module in args.modules:
+            # Warm the bytecode cache once so every run measures the same thing
+            try:
+                _, importtime_log = run_sample(module, env, importtime=True)
+                samples = [run_sample(module, env)[0] for _ in range(args.runs)]
+            except Exception as e:
+                print(f"{module:<24} failed: {e}", file=sys.stderr)
+                results[module] = {'error': str(e)}
+                continue
+
+            stats = {}
+            for key in ('wall', 'import', 'init'):
+                values = [sample[key] for sample in samples]
+                stats[key] = {'p50': statistics.median(values), 'p95': percentile(values, 0.95), 'min': min(values)}
+            stats['slowest_imports'] = parse_importtime(importtime_log, module, args.top)
+            results[module] = stats
+
+            slowest = ', '.join(f"{name} {us / 1000:.1f}ms" for name, us in stats['slowest_imports'])
+            print(f"{module:<24} wall p50={stats['wall']['p50'] * 1000:7.1f}ms "
+                  f"p95={stats['wall']['p95'] * 1000:7.1f}ms "
+                  f"import p50={stats['import']['p50'] * 1000:7.1f}ms "
+                  f"init p50={stats['init']['p50'] * 1000:6.1f}ms  [{slowest}]")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'runs': args.runs,
+                       'baseline_wall_p50': statistics.median(baseline), 'modules': results}, f, indent=2)
+        print(f"Results written to {args.json}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
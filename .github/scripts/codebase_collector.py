@@ -0,0 +1,197 @@
+import hashlib
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from token_budget import truncate_to_tokens
+
+# File extensions worth reading for an architecture summary
+CODE_EXTENSIONS = {
+    '.py', '.js', '.ts', '.jsx', '.tsx', '.java', '.c', '.cpp', '.h', '.hpp',
+    '.cs', '.go', '.rs', '.rb', '.php', '.swift', '.kt', '.scala', '.clj',
+    '.html', '.css', '.scss', '.sass', '.less', '.vue', '.svelte', '.dart',
+    '.json', '.yaml', '.yml', '.toml', '.ini', '.conf', '.cfg',
+    '.sql', '.md', '.txt', '.sh', '.bat', '.ps1'
+}
+
+# Build output, caches and tooling directories, skipped anywhere in a path
+EXCLUDED_DIRS = {
+    '.git', 'node_modules', '.venv', 'venv', 'env', 'dist', 'build', 'target',
+    '.next', '.nuxt', '__pycache__', '.dart_tool', '.idea', '.vscode'
+}
+
+# Flutter platform folders, skipped only directly under a Flutter project root
+# (a directory with a pubspec.yaml): there they are generated runner
+# boilerplate, deeper down (lib/web/) they are app code
+FLUTTER_PLATFORM_DIRS = {'android', 'ios', 'windows', 'linux', 'macos', 'web'}
+FLUTTER_PROJECT_FILE = 'pubspec.yaml'
+
+EXCLUDED_SUFFIXES = {'.pyc', '.class', '.o', '.obj', '.log', '.tmp', '.temp', '.cache'}
+
+SNIFF_BYTES = 8192
+DEFAULT_MAX_WORKERS = 8
+
+
+@dataclass
+class SourceFile:
+    """A collected source file. blob_sha is the git object id when known."""
+    path: str
+    content: str
+    size: int
+    blob_sha: Optional[str] = None
+    read_seconds: float = 0.0
+
+
+def get_excluded_dirs() -> set:
+    """Excluded directory names, extended by CODEBASE_EXCLUDE_DIRS (comma separated)."""
+    extra = os.environ.get('CODEBASE_EXCLUDE_DIRS', '')
+    return EXCLUDED_DIRS | {d.strip().strip('/') for d in extra.split(',') if d.strip()}
+
+
+def find_flutter_roots(paths: List[str]) -> Set[str]:
+    """Directories holding a pubspec.yaml, as '/'-separated relative paths ('' for the repository root)."""
+    roots = set()
+    for path in paths:
+        directory, _, name = path.replace(os.sep, '/').rpartition('/')
+        if name == FLUTTER_PROJECT_FILE:
+            roots.add(directory)
+    return roots
+
+
+def is_candidate(path: str, excluded_dirs: set, flutter_roots: Set[str] = frozenset()) -> bool:
+    """Check a relative path against the directory, suffix and extension filters.
+
+    Platform folders are only excluded where their parent is one of flutter_roots.
+    """
+    parts = path.replace(os.sep, '/').split('/')
+    if any(part in excluded_dirs for part in parts[:-1]):
+        return False
+    for i, part in enumerate(parts[:-1]):
+        if part in FLUTTER_PLATFORM_DIRS and '/'.join(parts[:i]) in flutter_roots:
+            return False
+    _, ext = os.path.splitext(parts[-1])
+    ext = ext.lower()
+    return ext in CODE_EXTENSIONS and ext not in EXCLUDED_SUFFIXES
+
+
+def list_tracked_files(repository_path: str) -> Optional[List[Tuple[str, str]]]:
+    """List (path, blob SHA) for every file tracked by git, or None outside a git checkout."""
+    try:
+        result = subprocess.run(['git', '-C', repository_path, 'ls-files', '-s', '-z'],
+                                capture_output=True, text=True)
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+
+    files = []
+    for entry in result.stdout.split('\0'):
+        if not entry:
+            continue
+        # "<mode> <sha> <stage>\t<path>"
+        meta, _, path = entry.partition('\t')
+        fields = meta.split()
+        if len(fields) >= 2 and fields[0] != '160000':  # skip submodules
+            files.append((path, fields[1]))
+    return files
+
+
+def git_blob_sha(data: bytes) -> str:
+    """Object id git would give this content, for files listed without git."""
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+def walk_files(repository_path: str, excluded_dirs: set) -> List[Tuple[str, Optional[str]]]:
+    """List files by walking the tree when git is not available."""
+    files = []
+    for root, dirs, names in os.walk(repository_path):
+        flutter_root = FLUTTER_PROJECT_FILE in names
+        dirs[:] = [d for d in dirs if d not in excluded_dirs
+                   and not (flutter_root and d in FLUTTER_PLATFORM_DIRS)]
+        for name in names:
+            relative_path = os.path.relpath(os.path.join(root, name), repository_path)
+            files.append((relative_path, None))
+    return files
+
+
+def read_source_file(repository_path: str, path: str, blob_sha: Optional[str],
+                     max_file_tokens: Optional[int]) -> Optional[SourceFile]:
+    """Read one file, returning None for binaries."""
+    start = time.monotonic()
+    try:
+        with open(os.path.join(repository_path, path), 'rb') as f:
+            data = f.read()
+    except Exception as e:
+        return SourceFile(path, f"(Error reading file: {e})", 0, blob_sha,
+                          time.monotonic() - start)
+
+    if b'\0' in data[:SNIFF_BYTES]:
+        return None
+
+    if blob_sha is None:
+        blob_sha = git_blob_sha(data)
+    content = data.decode('utf-8', errors='ignore')
+    if max_file_tokens is not None:
+        # Limit file size to avoid overwhelming the AI
+        content = truncate_to_tokens(content, max_file_tokens, "claude-sonnet-4-20250514",
+                                     marker="\n... (file truncated)")
+    return SourceFile(path, content, len(data), blob_sha, time.monotonic() - start)
+
+
+def module_key(path: str) -> str:
+    """Module a file belongs to for grouping: its first two directory segments."""
+    parts = path.replace(os.sep, '/').split('/')[:-1]
+    return '/'.join(parts[:2]) or '.'
+
+
+def report_collection_stats(files: List[SourceFile], skipped_binaries: int, elapsed: float):
+    """Print bytes, file count and read time per directory to stderr."""
+    per_dir: Dict[str, List[float]] = {}
+    for source in files:
+        totals = per_dir.setdefault(module_key(source.path), [0, 0, 0.0])
+        totals[0] += 1
+        totals[1] += source.size
+        totals[2] += source.read_seconds
+
+    print(f"Collected {len(files)} files ({sum(f.size for f in files):,} bytes) in {elapsed:.2f}s, "
+          f"skipped {skipped_binaries} binary files", file=sys.stderr)
+    for directory, (count, size, seconds) in sorted(per_dir.items(), key=lambda item: -item[1][1]):
+        print(f"  {directory:<40} {int(count):>5} files {int(size):>12,} bytes {seconds * 1000:>9.1f}ms",
+              file=sys.stderr)
+
+
+def collect_codebase(repository_path: str = ".", max_file_tokens: Optional[int] = None,
+                     max_workers: int = DEFAULT_MAX_WORKERS) -> List[SourceFile]:
+    """Collect relevant source files, reading them on a thread pool.
+
+    Files come from `git ls-files` when possible, so anything ignored or
+    untracked is skipped; otherwise the tree is walked. Binary files are
+    detected by sniffing for NUL bytes and skipped.
+    """
+    start = time.monotonic()
+    excluded_dirs = get_excluded_dirs()
+
+    candidates = list_tracked_files(repository_path)
+    if candidates is None:
+        print("git ls-files unavailable, walking the directory tree", file=sys.stderr)
+        candidates = walk_files(repository_path, excluded_dirs)
+    flutter_roots = find_flutter_roots([path for path, _ in candidates])
+    candidates = [(path, sha) for path, sha in candidates if is_candidate(path, excluded_dirs, flutter_roots)]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(
+            lambda item: read_source_file(repository_path, item[0], item[1], max_file_tokens),
+            candidates))
+
+    files = [source for source in results if source is not None]
+    report_collection_stats(files, len(results) - len(files), time.monotonic() - start)
+    return files
+
+
+def format_codebase(files: List[SourceFile]) -> str:
+    """Join collected files into one prompt section."""
+    return ''.join(f"\n=== {source.path} ===\n{source.content}\n" for source in files)
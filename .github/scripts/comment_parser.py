@@ -0,0 +1,208 @@
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+# The only characters that change the scanner's state
+STRUCTURAL_CHARS = re.compile(r'[{}\[\]"\\]')
+
+
+@dataclass
+class ParsedReview:
+    """Comments recovered from a model response.
+
+    found_array is False when the response held no JSON array at all;
+    truncated means it ended inside the array. dropped counts objects that
+    did not decode or did not match the comment schema, plus a cut-off
+    last object.
+    """
+    comments: List[Dict[str, Any]] = field(default_factory=list)
+    dropped: int = 0
+    truncated: bool = False
+    found_array: bool = False
+
+    @property
+    def recovered(self) -> int:
+        return len(self.comments)
+
+
+def validate_comment(obj: Any) -> Optional[Dict[str, Any]]:
+    """Return the comment if it has a non-empty path and comment and a positive line, else None.
+
+    A line given as a digit string is converted; other fields are kept as they are.
+    """
+    if not isinstance(obj, dict):
+        return None
+    path = obj.get('path')
+    line = obj.get('line')
+    comment = obj.get('comment')
+    if isinstance(line, str) and line.strip().isdigit():
+        line = int(line)
+    if not isinstance(path, str) or not path.strip():
+        return None
+    if not isinstance(line, int) or isinstance(line, bool) or line < 1:
+        return None
+    if not isinstance(comment, str) or not comment.strip():
+        return None
+    if line is not obj['line']:
+        obj = dict(obj, line=line)
+    return obj
+
+
+class IncrementalCommentParser:
+    """Pulls comments out of a JSON array in one pass, as its text streams in.
+
+    feed() takes the next piece of model output and returns the valid
+    comments it completed, so each can be used before the array is closed.
+    Anything before the opening '[' (a code fence, a stray sentence) is
+    skipped; objects that fail to decode or to validate are dropped and
+    counted, and scanning continues with the next one. finish() returns
+    everything recovered.
+    """
+
+    def __init__(self):
+        self._in_array = False
+        self._depth = 0
+        self._in_string = False
+        self._skip_next = False
+        self._pieces: List[str] = []
+        self._objects_in_array = 0
+        self.result = ParsedReview()
+        self.done = False
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        completed: List[Dict[str, Any]] = []
+        if self.done or not text:
+            return completed
+
+        # Start of the current object within this piece of text
+        start = 0 if self._depth else None
+        skip_at = 0 if self._skip_next else -1
+        self._skip_next = False
+
+        for match in STRUCTURAL_CHARS.finditer(text):
+            pos = match.start()
+            if pos == skip_at:
+                # The character after a backslash inside a string
+                continue
+            ch = match.group()
+
+            if self._in_string:
+                if ch == '\\':
+                    if pos + 1 == len(text):
+                        self._skip_next = True
+                    skip_at = pos + 1
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if not self._in_array:
+                if ch == '[':
+                    self._in_array = True
+                    self.result.found_array = True
+                    self._objects_in_array = 0
+                continue
+
+            if self._depth == 0:
+                # Between elements of the top-level array; a string element may hold braces
+                if ch == '"':
+                    self._in_string = True
+                elif ch == '{':
+                    self._depth = 1
+                    start = pos
+                elif ch == ']':
+                    if self._objects_in_array:
+                        self.done = True
+                        break
+                    # An empty array before any objects may be prose like "[1]"; keep looking
+                    self._in_array = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch == '{' and self._depth == 1 and self._previous_char(text, pos) == ',':
+                # Keys are strings, so this is the next element: the current object never closed
+                self._objects_in_array += 1
+                self.result.dropped += 1
+                self._pieces = []
+                start = pos
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._objects_in_array += 1
+                    comment = self._decode(''.join(self._pieces) + text[start:pos + 1])
+                    self._pieces = []
+                    start = None
+                    if comment is not None:
+                        completed.append(comment)
+
+        if self._depth and start is not None:
+            self._pieces.append(text[start:])
+        self.result.comments.extend(completed)
+        return completed
+
+    def _previous_char(self, text: str, pos: int) -> str:
+        """The last non-whitespace character before pos, looking back into earlier pieces."""
+        i = pos - 1
+        while i >= 0 and text[i] in ' \t\r\n':
+            i -= 1
+        if i >= 0:
+            return text[i]
+        for piece in reversed(self._pieces):
+            stripped = piece.rstrip()
+            if stripped:
+                return stripped[-1]
+        return ''
+
+    def _decode(self, object_text: str) -> Optional[Dict[str, Any]]:
+        try:
+            comment = validate_comment(json.loads(object_text))
+        except ValueError:
+            comment = None
+        if comment is None:
+            self.result.dropped += 1
+        return comment
+
+    def finish(self) -> ParsedReview:
+        """Close the parse and return what was recovered; a cut-off object counts as dropped."""
+        if self._in_array and not self.done:
+            self.result.truncated = True
+            if self._depth:
+                self.result.dropped += 1
+        if self.result.found_array and not self._in_array and not self.done:
+            # Only empty arrays were seen; that is a valid review without comments
+            self.result.truncated = False
+        self._pieces = []
+        self.done = True
+        return self.result
+
+
+def parse_review(text: str) -> ParsedReview:
+    """Parse a complete model response into validated comments.
+
+    A well-formed array is decoded in one json.loads call; anything else
+    goes through IncrementalCommentParser to recover what it can.
+    """
+    text = text or ''
+    start = text.find('[')
+    end = text.rfind(']')
+    if 0 <= start < end:
+        try:
+            items = json.loads(text[start:end + 1])
+        except ValueError:
+            items = None
+        if isinstance(items, list):
+            result = ParsedReview(found_array=True)
+            for item in items:
+                comment = validate_comment(item)
+                if comment is None:
+                    result.dropped += 1
+                else:
+                    result.comments.append(comment)
+            return result
+
+    parser = IncrementalCommentParser()
+    parser.feed(text)
+    return parser.finish()
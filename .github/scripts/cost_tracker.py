@@ -1,8 +1,31 @@
 import json
 import os
 import sys
+import threading
 from typing import Dict, Optional, Tuple
 
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; appends of one line are still atomic there
+    fcntl = None
+
+# Append-only ledger written on every call, and the compacted snapshot
+# written by finalize_cost_tracking for artifacts and older readers
+COST_LEDGER_FILE = '/tmp/ai_costs.jsonl'
+COST_SNAPSHOT_FILE = '/tmp/ai_costs.json'
+# Running totals kept next to the ledger so summaries don't replay it
+COST_AGGREGATES_FILE = '/tmp/ai_costs.agg.json'
+
+
+def _lock_file(f, exclusive: bool):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
 
 class CostTracker:
     """Track AI usage costs for Claude and OpenAI models."""
@@ -20,28 +43,194 @@ class CostTracker:
     }
     
     def __init__(self):
-        self.cost_file = '/tmp/ai_costs.json'
-        self.costs = self._load_costs()
+        self.cost_file = COST_SNAPSHOT_FILE
+        self.ledger_file = COST_LEDGER_FILE
+        self.aggregates_file = COST_AGGREGATES_FILE
+        self._costs = None
+        self._aggregates = None
+        # Guards the in-memory copies when one tracker is shared between threads
+        self._lock = threading.Lock()
     
-    def _load_costs(self) -> Dict:
-        """Load existing cost data or initialize empty structure."""
-        if os.path.exists(self.cost_file):
+    @property
+    def costs(self) -> Dict:
+        """Cost data, loaded from disk the first time it is needed."""
+        if self._costs is None:
+            self._costs = self._load_costs()
+        return self._costs
+    
+    def _load_costs(self, lock: bool = True) -> Dict:
+        """Rebuild cost data from the ledger, or from a snapshot if there is no ledger.
+
+        Pass lock=False when the caller already holds the ledger lock.
+        """
+        costs = {
+            'total_cost': 0.0,
+            'calls': [],
+            'budgets': []
+        }
+        
+        if os.path.exists(self.ledger_file):
+            try:
+                with open(self.ledger_file, 'r') as f:
+                    if lock:
+                        _lock_file(f, exclusive=False)
+                    try:
+                        for line in f:
+                            try:
+                                record = json.loads(line)
+                            except json.JSONDecodeError:
+                                # A writer killed mid-line leaves a partial record
+                                continue
+                            self._apply_record(costs, record)
+                    finally:
+                        if lock:
+                            _unlock_file(f)
+            except Exception as e:
+                print(f"Warning: Could not load cost ledger: {e}", file=sys.stderr)
+        elif os.path.exists(self.cost_file):
             try:
                 with open(self.cost_file, 'r') as f:
-                    return json.load(f)
+                    costs.update(json.load(f))
             except Exception as e:
                 print(f"Warning: Could not load existing costs: {e}", file=sys.stderr)
         
+        return costs
+    
+    @property
+    def aggregates(self) -> Dict:
+        """Running totals, loaded from disk the first time they are needed."""
+        if self._aggregates is None:
+            self._aggregates = self._load_aggregates()
+        return self._aggregates
+    
+    @staticmethod
+    def _empty_aggregates() -> Dict:
         return {
             'total_cost': 0.0,
-            'calls': []
+            'total_calls': 0,
+            'total_input_tokens': 0,
+            'total_output_tokens': 0,
+            'by_model': {},
+            'by_type': {},
+            'planned_requests': 0,
+            'estimated_max_cost': 0.0
         }
     
-    def _save_costs(self):
-        """Save cost data to file."""
+    @staticmethod
+    def _add_to_aggregates(aggregates: Dict, record: Dict):
+        """Add one ledger record to the running totals."""
+        if record.get('kind', 'call') == 'budget':
+            aggregates['planned_requests'] += 1
+            aggregates['estimated_max_cost'] += record.get('estimated_max_cost', 0.0)
+            return
+        
+        aggregates['total_cost'] += record.get('cost', 0.0)
+        aggregates['total_calls'] += 1
+        aggregates['total_input_tokens'] += record.get('input_tokens', 0)
+        aggregates['total_output_tokens'] += record.get('output_tokens', 0)
+        # Only stable keys: contexts name shards and chunks, so they stay in the ledger
+        for group, key in (('by_model', record.get('model')),
+                           ('by_type', record.get('call_type'))):
+            totals = aggregates[group].setdefault(key, {
+                'calls': 0,
+                'input_tokens': 0,
+                'output_tokens': 0,
+                'cost': 0.0
+            })
+            totals['calls'] += 1
+            totals['input_tokens'] += record.get('input_tokens', 0)
+            totals['output_tokens'] += record.get('output_tokens', 0)
+            totals['cost'] += record.get('cost', 0.0)
+    
+    def _aggregate_ledger(self, lock: bool = True) -> Dict:
+        """Rebuild the running totals by replaying the ledger."""
+        aggregates = self._empty_aggregates()
+        costs = self._load_costs(lock)
+        for call in costs['calls']:
+            self._add_to_aggregates(aggregates, dict(call, kind='call'))
+        for budget in costs.get('budgets', []):
+            self._add_to_aggregates(aggregates, dict(budget, kind='budget'))
+        return aggregates
+    
+    def _read_aggregates_file(self) -> Optional[Dict]:
+        if not os.path.exists(self.aggregates_file):
+            return None
+        try:
+            with open(self.aggregates_file, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not load cost aggregates: {e}", file=sys.stderr)
+            return None
+    
+    def _write_aggregates_file(self, aggregates: Dict):
+        tmp_path = f"{self.aggregates_file}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(aggregates, f)
+        os.replace(tmp_path, self.aggregates_file)
+    
+    def _load_aggregates(self) -> Dict:
+        """Load the running totals, rebuilding them once if they are missing."""
+        aggregates = self._read_aggregates_file()
+        if aggregates is not None:
+            return aggregates
+        if os.path.exists(self.cost_file) and not os.path.exists(self.ledger_file):
+            try:
+                with open(self.cost_file, 'r') as f:
+                    snapshot = json.load(f)
+                if 'aggregates' in snapshot:
+                    return snapshot['aggregates']
+            except Exception as e:
+                print(f"Warning: Could not load existing costs: {e}", file=sys.stderr)
+        return self._aggregate_ledger()
+    
+    @staticmethod
+    def _apply_record(costs: Dict, record: Dict):
+        """Add one ledger record to in-memory cost data."""
+        record = dict(record)
+        kind = record.pop('kind', 'call')
+        if kind == 'budget':
+            costs.setdefault('budgets', []).append(record)
+        else:
+            costs['calls'].append(record)
+            costs['total_cost'] += record.get('cost', 0.0)
+    
+    def _append_record(self, kind: str, record: Dict):
+        """Append one record to the ledger and update the running totals.
+
+        Both happen under one exclusive lock on the ledger, so concurrent
+        writers never lose an update to the aggregates file.
+        """
+        record = dict(record, kind=kind)
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            try:
+                with open(self.ledger_file, 'a') as f:
+                    _lock_file(f, exclusive=True)
+                    try:
+                        aggregates = self._read_aggregates_file()
+                        if aggregates is None:
+                            aggregates = self._aggregate_ledger(lock=False)
+                        f.write(line)
+                        f.flush()
+                        self._add_to_aggregates(aggregates, record)
+                        self._write_aggregates_file(aggregates)
+                        self._aggregates = aggregates
+                    finally:
+                        _unlock_file(f)
+            except Exception as e:
+                print(f"Warning: Could not append to cost ledger: {e}", file=sys.stderr)
+            
+            if self._costs is not None:
+                self._apply_record(self._costs, record)
+    
+    def write_snapshot(self):
+        """Write the compacted cost data and totals as a single JSON file."""
         try:
-            with open(self.cost_file, 'w') as f:
-                json.dump(self.costs, f, indent=2)
+            snapshot = dict(self.costs, aggregates=self.aggregates)
+            tmp_path = f"{self.cost_file}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f, indent=2)
+            os.replace(tmp_path, self.cost_file)
         except Exception as e:
             print(f"Warning: Could not save costs: {e}", file=sys.stderr)
     
@@ -95,8 +284,7 @@ class CostTracker:
             'context': context
         }
         
-        self.costs['calls'].append(call_data)
-        self.costs['total_cost'] += cost
+        self._append_record('call', call_data)
         
         # Log the cost information
         print(f"AI Cost Tracking - {call_type.upper()}:", file=sys.stderr)
@@ -107,118 +295,131 @@ class CostTracker:
         if context:
             print(f"  Context: {context}", file=sys.stderr)
         
-        self._save_costs()
         return cost
     
-    def get_summary(self) -> Dict:
-        """Get cost summary for display."""
-        total_input_tokens = sum(call['input_tokens'] for call in self.costs['calls'])
-        total_output_tokens = sum(call['output_tokens'] for call in self.costs['calls'])
+    def track_budget(self, budget: Dict, context: Optional[str] = None) -> float:
+        """Record a planned token budget and return its worst-case cost before sending."""
+        model = budget.get('model', '')
+        estimated_cost = self.calculate_cost(
+            model, budget.get('estimated_input_tokens', 0), budget.get('output_tokens', 0))
         
-        # Group by model
-        by_model = {}
-        for call in self.costs['calls']:
-            model = call['model']
-            if model not in by_model:
-                by_model[model] = {
-                    'calls': 0,
-                    'input_tokens': 0,
-                    'output_tokens': 0,
-                    'cost': 0.0
-                }
-            by_model[model]['calls'] += 1
-            by_model[model]['input_tokens'] += call['input_tokens']
-            by_model[model]['output_tokens'] += call['output_tokens']
-            by_model[model]['cost'] += call['cost']
+        budget_data = dict(budget)
+        budget_data['estimated_max_cost'] = estimated_cost
+        budget_data['context'] = context
+        self._append_record('budget', budget_data)
         
-        # Group by call type
-        by_type = {}
-        for call in self.costs['calls']:
-            call_type = call['call_type']
-            if call_type not in by_type:
-                by_type[call_type] = {
-                    'calls': 0,
-                    'input_tokens': 0,
-                    'output_tokens': 0,
-                    'cost': 0.0
-                }
-            by_type[call_type]['calls'] += 1
-            by_type[call_type]['input_tokens'] += call['input_tokens']
-            by_type[call_type]['output_tokens'] += call['output_tokens']
-            by_type[call_type]['cost'] += call['cost']
+        print(f"AI Token Budget - {model}:", file=sys.stderr)
+        print(f"  Request budget: {budget.get('request_budget', 0):,} tokens", file=sys.stderr)
+        print(f"  Architecture: {budget.get('architecture_tokens', 0):,}, "
+              f"Diff: {budget.get('diff_tokens', 0):,}, "
+              f"Output: {budget.get('output_tokens', 0):,}", file=sys.stderr)
+        print(f"  Estimated max cost: ${estimated_cost:.6f}", file=sys.stderr)
         
-        return {
-            'total_cost': self.costs['total_cost'],
-            'total_calls': len(self.costs['calls']),
-            'total_input_tokens': total_input_tokens,
-            'total_output_tokens': total_output_tokens,
-            'by_model': by_model,
-            'by_type': by_type,
-            'individual_calls': self.costs['calls']
+        return estimated_cost
+    
+    def get_summary(self, include_calls: bool = True) -> Dict:
+        """Get cost summary for display.
+
+        Totals come from the running aggregates in constant time; the
+        ledger is only read when include_calls asks for individual records.
+        """
+        aggregates = self.aggregates
+        summary = {
+            'total_cost': aggregates['total_cost'],
+            'total_calls': aggregates['total_calls'],
+            'total_input_tokens': aggregates['total_input_tokens'],
+            'total_output_tokens': aggregates['total_output_tokens'],
+            'by_model': aggregates['by_model'],
+            'by_type': aggregates['by_type'],
+            'planned_requests': aggregates['planned_requests'],
+            'estimated_max_cost': aggregates['estimated_max_cost'],
+            'individual_calls': [],
+            'budgets': []
         }
+        if include_calls:
+            summary['individual_calls'] = self.costs['calls']
+            summary['budgets'] = self.costs.get('budgets', [])
+        return summary
     
-    def print_detailed_summary(self):
+    def print_detailed_summary(self, summary: Optional[Dict] = None, include_calls: bool = True):
         """Print a detailed cost summary to stderr."""
-        summary = self.get_summary()
-        
-        print("\n" + "="*60, file=sys.stderr)
-        print("AI USAGE COST SUMMARY", file=sys.stderr)
-        print("="*60, file=sys.stderr)
-        
-        print(f"Total Cost: ${summary['total_cost']:.6f}", file=sys.stderr)
-        print(f"Total API Calls: {summary['total_calls']}", file=sys.stderr)
-        print(f"Total Input Tokens: {summary['total_input_tokens']:,}", file=sys.stderr)
-        print(f"Total Output Tokens: {summary['total_output_tokens']:,}", file=sys.stderr)
-        
-        print("\nCOST BY MODEL:", file=sys.stderr)
-        print("-" * 40, file=sys.stderr)
-        for model, data in summary['by_model'].items():
-            print(f"{model}:", file=sys.stderr)
-            print(f"  Calls: {data['calls']}", file=sys.stderr)
-            print(f"  Input tokens: {data['input_tokens']:,}", file=sys.stderr)
-            print(f"  Output tokens: {data['output_tokens']:,}", file=sys.stderr)
-            print(f"  Cost: ${data['cost']:.6f}", file=sys.stderr)
-        
-        print("\nCOST BY OPERATION:", file=sys.stderr)
-        print("-" * 40, file=sys.stderr)
-        for op_type, data in summary['by_type'].items():
-            print(f"{op_type}:", file=sys.stderr)
-            print(f"  Calls: {data['calls']}", file=sys.stderr)
-            print(f"  Input tokens: {data['input_tokens']:,}", file=sys.stderr)
-            print(f"  Output tokens: {data['output_tokens']:,}", file=sys.stderr)
-            print(f"  Cost: ${data['cost']:.6f}", file=sys.stderr)
-        
-        if summary['individual_calls']:
-            print("\nINDIVIDUAL CALLS:", file=sys.stderr)
-            print("-" * 40, file=sys.stderr)
-            for i, call in enumerate(summary['individual_calls'], 1):
-                print(f"{i}. {call['call_type']} - {call['model']}", file=sys.stderr)
-                print(f"   Input: {call['input_tokens']:,} tokens, Output: {call['output_tokens']:,} tokens", file=sys.stderr)
-                print(f"   Cost: ${call['cost']:.6f}", file=sys.stderr)
-                if call.get('context'):
-                    print(f"   Context: {call['context']}", file=sys.stderr)
-        
-        print("="*60, file=sys.stderr)
+        if summary is None:
+            summary = self.get_summary(include_calls=include_calls)
+        print("\n" + format_detailed_summary(summary), file=sys.stderr)
+
+
+def format_detailed_summary(summary: Dict) -> str:
+    """Format a cost summary as human-readable text."""
+    lines = [
+        "=" * 60,
+        "AI USAGE COST SUMMARY",
+        "=" * 60,
+        f"Total Cost: ${summary['total_cost']:.6f}",
+        f"Total API Calls: {summary['total_calls']}",
+        f"Total Input Tokens: {summary['total_input_tokens']:,}",
+        f"Total Output Tokens: {summary['total_output_tokens']:,}"
+    ]
+    if summary.get('planned_requests'):
+        lines.append(f"Planned Requests: {summary['planned_requests']} "
+                     f"(estimated max cost ${summary['estimated_max_cost']:.6f})")
+    
+    for title, group in (("COST BY MODEL", 'by_model'), ("COST BY OPERATION", 'by_type')):
+        lines.append(f"\n{title}:")
+        lines.append("-" * 40)
+        for name, data in summary.get(group, {}).items():
+            lines.append(f"{name}:")
+            lines.append(f"  Calls: {data['calls']}")
+            lines.append(f"  Input tokens: {data['input_tokens']:,}")
+            lines.append(f"  Output tokens: {data['output_tokens']:,}")
+            lines.append(f"  Cost: ${data['cost']:.6f}")
+    
+    if summary.get('individual_calls'):
+        lines.append("\nINDIVIDUAL CALLS:")
+        lines.append("-" * 40)
+        for i, call in enumerate(summary['individual_calls'], 1):
+            lines.append(f"{i}. {call['call_type']} - {call['model']}")
+            lines.append(f"   Input: {call['input_tokens']:,} tokens, Output: {call['output_tokens']:,} tokens")
+            lines.append(f"   Cost: ${call['cost']:.6f}")
+            if call.get('context'):
+                lines.append(f"   Context: {call['context']}")
+    
+    lines.append("=" * 60)
+    return "\n".join(lines)
+
+
+_cost_tracker: Optional[CostTracker] = None
+_cost_tracker_lock = threading.Lock()
+
+
+def get_cost_tracker() -> CostTracker:
+    """Return the tracker shared by everything running in this process."""
+    global _cost_tracker
+    with _cost_tracker_lock:
+        if _cost_tracker is None:
+            _cost_tracker = CostTracker()
+        return _cost_tracker
 
 
 def initialize_cost_tracking():
     """Initialize cost tracking for the workflow."""
+    global _cost_tracker
     # Clear any existing cost data for this run
-    cost_file = '/tmp/ai_costs.json'
-    if os.path.exists(cost_file):
-        os.remove(cost_file)
+    for cost_file in (COST_LEDGER_FILE, COST_SNAPSHOT_FILE, COST_AGGREGATES_FILE):
+        if os.path.exists(cost_file):
+            os.remove(cost_file)
     
-    tracker = CostTracker()
+    with _cost_tracker_lock:
+        _cost_tracker = CostTracker()
     print("AI cost tracking initialized", file=sys.stderr)
-    return tracker
+    return _cost_tracker
 
 
 def finalize_cost_tracking():
     """Print final cost summary and save to GitHub Actions output."""
-    tracker = CostTracker()
-    tracker.print_detailed_summary()
-    
+    tracker = get_cost_tracker()
     summary = tracker.get_summary()
+    tracker.print_detailed_summary(summary)
+    tracker.write_snapshot()
     
     # Save summary to GitHub Actions output if available
     if 'GITHUB_OUTPUT' in os.environ:
@@ -231,41 +432,7 @@ def finalize_cost_tracking():
     # Also save a human-readable summary to a file for artifacts
     try:
         with open('/tmp/ai_cost_summary.txt', 'w') as f:
-            f.write("AI USAGE COST SUMMARY\n")
-            f.write("="*60 + "\n\n")
-            f.write(f"Total Cost: ${summary['total_cost']:.6f}\n")
-            f.write(f"Total API Calls: {summary['total_calls']}\n")
-            f.write(f"Total Input Tokens: {summary['total_input_tokens']:,}\n")
-            f.write(f"Total Output Tokens: {summary['total_output_tokens']:,}\n\n")
-            
-            f.write("COST BY MODEL:\n")
-            f.write("-" * 40 + "\n")
-            for model, data in summary['by_model'].items():
-                f.write(f"{model}:\n")
-                f.write(f"  Calls: {data['calls']}\n")
-                f.write(f"  Input tokens: {data['input_tokens']:,}\n")
-                f.write(f"  Output tokens: {data['output_tokens']:,}\n")
-                f.write(f"  Cost: ${data['cost']:.6f}\n\n")
-            
-            f.write("COST BY OPERATION:\n")
-            f.write("-" * 40 + "\n")
-            for op_type, data in summary['by_type'].items():
-                f.write(f"{op_type}:\n")
-                f.write(f"  Calls: {data['calls']}\n")
-                f.write(f"  Input tokens: {data['input_tokens']:,}\n")
-                f.write(f"  Output tokens: {data['output_tokens']:,}\n")
-                f.write(f"  Cost: ${data['cost']:.6f}\n\n")
-            
-            if summary['individual_calls']:
-                f.write("INDIVIDUAL CALLS:\n")
-                f.write("-" * 40 + "\n")
-                for i, call in enumerate(summary['individual_calls'], 1):
-                    f.write(f"{i}. {call['call_type']} - {call['model']}\n")
-                    f.write(f"   Input: {call['input_tokens']:,} tokens, Output: {call['output_tokens']:,} tokens\n")
-                    f.write(f"   Cost: ${call['cost']:.6f}\n")
-                    if call.get('context'):
-                        f.write(f"   Context: {call['context']}\n")
-                    f.write("\n")
+            f.write(format_detailed_summary(summary) + "\n")
     except Exception as e:
         print(f"Warning: Could not save human-readable summary: {e}", file=sys.stderr)
     
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Incremental review support: narrow a PR diff to what changed since the last
+reviewed head, and record the head SHA once a review has been posted.
+
+    python3 delta_review.py --record   # store HEAD_SHA as the last reviewed head
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+# Add the scripts directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from diff_parser import DiffFile, DiffHunk, parse_diff, record_lines
+
+
+def run_git(*args: str) -> Optional[str]:
+    """Run a git command and return its stdout, or None if it failed."""
+    result = subprocess.run(['git', *args], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return result.stdout
+
+
+def commit_exists(sha: str) -> bool:
+    return run_git('cat-file', '-e', f'{sha}^{{commit}}') is not None
+
+
+def is_ancestor(ancestor: str, descendant: str) -> bool:
+    return run_git('merge-base', '--is-ancestor', ancestor, descendant) is not None
+
+
+def new_side_ranges(diff: str) -> Dict[str, List[Tuple[int, int]]]:
+    """Map each path to the [start, end) ranges its hunks cover in the new file."""
+    ranges: Dict[str, List[Tuple[int, int]]] = {}
+    for record in parse_diff(diff):
+        if isinstance(record, DiffHunk) and record.file.path:
+            # Pure deletions have new_count 0; treat them as touching new_start
+            end = record.new_start + max(record.new_count, 1)
+            ranges.setdefault(record.file.path, []).append((record.new_start, end))
+    return ranges
+
+
+def narrow_diff_to_delta(full_diff: str, delta_diff: str) -> str:
+    """Keep only the hunks of full_diff that overlap a change in delta_diff.
+
+    Both diffs end at the same head commit, so new-side line numbers agree and
+    the kept hunks are exactly the positions comments can be anchored to in
+    the full PR diff.
+    """
+    delta_ranges = new_side_ranges(delta_diff)
+    kept_lines: List[str] = []
+    current_file: Optional[DiffFile] = None
+    file_emitted = False
+    keep_hunk = False
+
+    for record in parse_diff(full_diff):
+        if isinstance(record, DiffFile):
+            current_file = record
+            file_emitted = False
+            keep_hunk = False
+            continue
+
+        if isinstance(record, DiffHunk):
+            end = record.new_start + max(record.new_count, 1)
+            keep_hunk = any(start < end and record.new_start < delta_end
+                            for start, delta_end in delta_ranges.get(record.file.path, []))
+            if keep_hunk and not file_emitted:
+                kept_lines.extend(current_file.header_lines)
+                file_emitted = True
+
+        if keep_hunk:
+            kept_lines.extend(record_lines(record))
+
+    return '\n'.join(kept_lines)
+
+
+def get_firebase_client():
+    from firebase_client import get_firebase_client as get_shared_client
+    return get_shared_client(project_name="test")  # Hardcoded project name
+
+
+def narrow_to_last_review(diff: str) -> Tuple[str, str]:
+    """Narrow the PR diff to changes since the last reviewed head when possible.
+
+    Returns the diff to review and the review scope, 'delta' or 'full'.
+    Falls back to the full diff on the first review, on events other than
+    'synchronize' and when the last reviewed head is no longer an ancestor of
+    the current head (force-push or rebase).
+    """
+    repository = os.environ.get('REPOSITORY', '')
+    pr_number = os.environ.get('PR_NUMBER', '')
+    head_sha = os.environ.get('HEAD_SHA', '')
+    event_action = os.environ.get('EVENT_ACTION', 'synchronize')
+
+    if event_action != 'synchronize' or not all([repository, pr_number, head_sha]):
+        return diff, 'full'
+
+    try:
+        last_sha = get_firebase_client().get_last_reviewed_sha(repository, pr_number)
+    except Exception as e:
+        print(f"Warning: Could not read last reviewed head, doing a full review: {e}", file=sys.stderr)
+        return diff, 'full'
+
+    if not last_sha or last_sha == head_sha:
+        return diff, 'full'
+
+    if not commit_exists(last_sha) or not is_ancestor(last_sha, head_sha):
+        print(f"Last reviewed head {last_sha[:8]} is not an ancestor of {head_sha[:8]} "
+              "(force-push?), doing a full review", file=sys.stderr)
+        return diff, 'full'
+
+    delta_diff = run_git('diff', last_sha, head_sha, '--', '.', ':(exclude).github/**')
+    if delta_diff is None:
+        print("Could not compute delta diff, doing a full review", file=sys.stderr)
+        return diff, 'full'
+
+    narrowed = narrow_diff_to_delta(diff, delta_diff)
+    print(f"Incremental review since {last_sha[:8]}: {len(narrowed):,} of {len(diff):,} "
+          "diff characters", file=sys.stderr)
+    return narrowed, 'delta'
+
+
+def record_reviewed_head():
+    """Store HEAD_SHA as the last reviewed head for the pull request."""
+    repository = os.environ.get('REPOSITORY', '')
+    pr_number = os.environ.get('PR_NUMBER', '')
+    head_sha = os.environ.get('HEAD_SHA', '')
+
+    if not all([repository, pr_number, head_sha]):
+        print("Missing REPOSITORY, PR_NUMBER or HEAD_SHA, not recording reviewed head", file=sys.stderr)
+        sys.exit(1)
+
+    get_firebase_client().set_last_reviewed_sha(repository, pr_number, head_sha)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Incremental review helpers.')
+    parser.add_argument('--record', action='store_true',
+                        help='record HEAD_SHA as the last reviewed head for PR_NUMBER')
+    args = parser.parse_args()
+
+    if args.record:
+        try:
+            record_reviewed_head()
+        except Exception as e:
+            print(f"Error recording reviewed head: {e}", file=sys.stderr)
+            sys.exit(1)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import bisect
+import io
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Union
+
+HUNK_HEADER_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@(.*)$')
+
+
+@dataclass
+class DiffFile:
+    """Header of one file in a unified diff.
+
+    Yielded once all of the file's header lines have been read, so rename and
+    binary markers are already set. Paths are None for /dev/null sides.
+    """
+    old_path: Optional[str] = None
+    new_path: Optional[str] = None
+    is_rename: bool = False
+    is_binary: bool = False
+    is_new: bool = False
+    is_deleted: bool = False
+    header_lines: List[str] = field(default_factory=list)
+
+    @property
+    def path(self) -> Optional[str]:
+        """Path used for review comments: the new path, or the old one for deletions."""
+        return self.new_path or self.old_path
+
+
+@dataclass
+class DiffHunk:
+    """A hunk header with its line ranges."""
+    file: DiffFile
+    old_start: int
+    old_count: int
+    new_start: int
+    new_count: int
+    section: str
+    header: str
+
+
+@dataclass
+class DiffLine:
+    """A single line inside a hunk.
+
+    old_lineno is None for added lines and new_lineno is None for removed
+    lines. '\\ No newline at end of file' markers have neither.
+    """
+    hunk: DiffHunk
+    text: str
+    old_lineno: Optional[int]
+    new_lineno: Optional[int]
+
+    @property
+    def is_added(self) -> bool:
+        return self.text.startswith('+')
+
+    @property
+    def is_removed(self) -> bool:
+        return self.text.startswith('-')
+
+    @property
+    def content(self) -> str:
+        return self.text[1:]
+
+
+DiffRecord = Union[DiffFile, DiffHunk, DiffLine]
+
+
+def iter_lines(diff: str) -> Iterator[str]:
+    """Iterate over the lines of a diff string without building a list."""
+    for line in io.StringIO(diff):
+        yield line.rstrip('\n')
+
+
+def _strip_prefix(path: str) -> Optional[str]:
+    path = path.strip()
+    if path.startswith('"') and path.endswith('"'):
+        path = path[1:-1]
+    if path == '/dev/null':
+        return None
+    if path.startswith(('a/', 'b/')):
+        return path[2:]
+    return path
+
+
+def _paths_from_git_header(line: str):
+    # "diff --git a/<old> b/<new>"; split on the last " b/" since paths may contain spaces
+    rest = line[len('diff --git '):]
+    index = rest.rfind(' b/')
+    if index == -1:
+        parts = rest.split()
+        return (_strip_prefix(parts[0]) if parts else None,
+                _strip_prefix(parts[1]) if len(parts) > 1 else None)
+    return _strip_prefix(rest[:index]), _strip_prefix(rest[index + 1:])
+
+
+def parse_diff(lines: Union[str, Iterable[str]]) -> Iterator[DiffRecord]:
+    """Parse a unified diff in a single pass, yielding file, hunk and line records.
+
+    Accepts the diff as a string or as any iterable of lines (such as an open
+    file), so memory stays bounded by the size of one file header. Lines
+    before the first 'diff --git' header are reported as a DiffFile without
+    paths so that callers re-emitting the diff never lose a line.
+    """
+    if isinstance(lines, str):
+        lines = iter_lines(lines)
+
+    current_file: Optional[DiffFile] = None
+    file_pending = False
+    hunk: Optional[DiffHunk] = None
+    old_line = new_line = 0
+    old_remaining = new_remaining = 0
+
+    for line in lines:
+        in_hunk_body = hunk is not None and (old_remaining > 0 or new_remaining > 0)
+
+        if in_hunk_body or (hunk is not None and line.startswith('\\')):
+            if line.startswith('+'):
+                yield DiffLine(hunk, line, None, new_line)
+                new_line += 1
+                new_remaining -= 1
+            elif line.startswith('-'):
+                yield DiffLine(hunk, line, old_line, None)
+                old_line += 1
+                old_remaining -= 1
+            elif line.startswith('\\'):
+                yield DiffLine(hunk, line, None, None)
+            else:
+                yield DiffLine(hunk, line, old_line, new_line)
+                old_line += 1
+                new_line += 1
+                old_remaining -= 1
+                new_remaining -= 1
+            continue
+
+        if line.startswith('diff --git '):
+            if file_pending:
+                yield current_file
+            old_path, new_path = _paths_from_git_header(line)
+            current_file = DiffFile(old_path=old_path, new_path=new_path, header_lines=[line])
+            file_pending = True
+            hunk = None
+            continue
+
+        match = HUNK_HEADER_RE.match(line) if current_file is not None else None
+        if match:
+            if file_pending:
+                yield current_file
+                file_pending = False
+            old_line = int(match.group(1))
+            new_line = int(match.group(3))
+            old_remaining = int(match.group(2)) if match.group(2) is not None else 1
+            new_remaining = int(match.group(4)) if match.group(4) is not None else 1
+            hunk = DiffHunk(current_file, old_line, old_remaining, new_line, new_remaining,
+                            match.group(5), line)
+            yield hunk
+            continue
+
+        if current_file is None:
+            current_file = DiffFile(header_lines=[line])
+            file_pending = True
+            continue
+
+        if not file_pending:
+            # Stray line after a completed hunk; keep it with a context-less line record
+            if hunk is not None:
+                yield DiffLine(hunk, line, None, None)
+            else:
+                current_file.header_lines.append(line)
+            continue
+
+        current_file.header_lines.append(line)
+        if line.startswith('--- '):
+            current_file.old_path = _strip_prefix(line[4:])
+        elif line.startswith('+++ '):
+            current_file.new_path = _strip_prefix(line[4:])
+        elif line.startswith('rename from '):
+            current_file.is_rename = True
+            current_file.old_path = line[len('rename from '):]
+        elif line.startswith('rename to '):
+            current_file.is_rename = True
+            current_file.new_path = line[len('rename to '):]
+        elif line.startswith('new file mode'):
+            current_file.is_new = True
+        elif line.startswith('deleted file mode'):
+            current_file.is_deleted = True
+        elif line.startswith('Binary files ') or line == 'GIT binary patch':
+            current_file.is_binary = True
+
+    if file_pending:
+        yield current_file
+
+
+def record_lines(record: DiffRecord) -> List[str]:
+    """Return the raw diff lines a record was parsed from."""
+    if isinstance(record, DiffFile):
+        return record.header_lines
+    if isinstance(record, DiffHunk):
+        return [record.header]
+    return [record.text]
+
+
+def count_changed_lines(diff: Union[str, Iterable[str]]) -> int:
+    """Count added and removed lines in a diff."""
+    return sum(1 for record in parse_diff(diff)
+               if isinstance(record, DiffLine) and (record.is_added or record.is_removed))
+
+
+def changed_paths(diff: Union[str, Iterable[str]]) -> Set[str]:
+    """Return the set of file paths touched by a diff."""
+    return {record.path for record in parse_diff(diff)
+            if isinstance(record, DiffFile) and record.path}
+
+
+def new_line_texts(diff: Union[str, Iterable[str]]) -> Dict[str, Dict[int, str]]:
+    """Map each file path to the new-file lines shown in the diff and their content."""
+    lines: Dict[str, Dict[int, str]] = {}
+    for record in parse_diff(diff):
+        if isinstance(record, DiffLine) and record.new_lineno is not None and record.hunk.file.path:
+            lines.setdefault(record.hunk.file.path, {})[record.new_lineno] = record.content
+    return lines
+
+
+@dataclass
+class HunkAnchors:
+    """New-file lines of one hunk that a review comment can be placed on."""
+    start: int
+    end: int
+    lines: Set[int] = field(default_factory=set)
+    changed: List[int] = field(default_factory=list)
+
+
+def build_anchor_index(diff: Union[str, Iterable[str]]) -> Dict[str, List[HunkAnchors]]:
+    """Map each file path to its hunks' commentable lines (added and context) and added lines."""
+    index: Dict[str, List[HunkAnchors]] = {}
+    current: Optional[HunkAnchors] = None
+    for record in parse_diff(diff):
+        if isinstance(record, DiffHunk):
+            current = None
+            if record.file.path:
+                current = HunkAnchors(record.new_start, record.new_start + max(record.new_count, 1) - 1)
+                index.setdefault(record.file.path, []).append(current)
+        elif isinstance(record, DiffLine) and current is not None and record.new_lineno is not None:
+            current.lines.add(record.new_lineno)
+            if record.is_added:
+                current.changed.append(record.new_lineno)
+    return index
+
+
+def resolve_anchor(index: Dict[str, List[HunkAnchors]], path: str, line: int,
+                   tolerance: int) -> Optional[int]:
+    """The line a comment on path:line can be placed on, or None.
+
+    A line shown in the diff is kept. Otherwise the nearest changed line
+    (any shown line for hunks that only delete) at most tolerance lines
+    away is used.
+    """
+    hunks = index.get(path, [])
+    best: Optional[int] = None
+    for hunk in hunks:
+        if line in hunk.lines:
+            return line
+        candidates = hunk.changed or sorted(hunk.lines)
+        if not candidates:
+            continue
+        pos = bisect.bisect_left(candidates, line)
+        for candidate in candidates[max(0, pos - 1):pos + 1]:
+            if best is None or abs(candidate - line) < abs(best - line):
+                best = candidate
+    if best is not None and abs(best - line) <= tolerance:
+        return best
+    return None
@@ -10,19 +10,20 @@ import os
 # Add the scripts directory to the path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from cost_tracker import CostTracker
+from cost_tracker import get_cost_tracker
 
 def main():
     """Display current cost information."""
     try:
-        tracker = CostTracker()
-        summary = tracker.get_summary()
+        tracker = get_cost_tracker()
+        # Totals only: constant time no matter how many calls were logged
+        summary = tracker.get_summary(include_calls=False)
         
         if summary['total_calls'] == 0:
             print("No AI calls tracked yet", file=sys.stderr)
             return
         
-        tracker.print_detailed_summary()
+        tracker.print_detailed_summary(summary)
         
         # Also output costs in a format suitable for workflow step outputs
         print(f"TOTAL_COST=${summary['total_cost']:.6f}")
@@ -1,10 +1,12 @@
 import os
 import json
-import base64
 import time
 import sys
 from datetime import datetime
-from firebase_client import FirebaseClient
+from handoff import write_handoff
+
+# Where the context is handed to the review step, unless ARCHITECTURE_CONTEXT_PATH is set
+DEFAULT_CONTEXT_PATH = '/tmp/architecture_context.handoff'
 
 def retry_with_backoff(func, max_retries=3, base_delay=1):
     """Retry function with exponential backoff"""
@@ -34,8 +36,22 @@ def create_empty_context():
         'project_name': project_name,
         'status': 'fallback'
     }
-    context_json = json.dumps(empty_context)
-    return base64.b64encode(context_json.encode('utf-8')).decode('utf-8')
+    return empty_context
+
+def write_context(context_data):
+    """Write the context handoff file and output its path as context_path"""
+    context_path = os.environ.get('ARCHITECTURE_CONTEXT_PATH', DEFAULT_CONTEXT_PATH)
+    header = write_handoff(context_path, json.dumps(context_data, default=str), 'architecture_context')
+    print(f"Wrote architecture context to {context_path} ({header['size']} bytes, "
+          f"{header['compressed_size']} compressed)", file=sys.stderr)
+    
+    # Write output to GitHub Actions output file
+    if 'GITHUB_OUTPUT' in os.environ:
+        with open(os.environ['GITHUB_OUTPUT'], 'a') as fh:
+            fh.write(f"context_path={context_path}\n")
+    else:
+        # Fallback for local testing
+        print(f"context_path={context_path}", file=sys.stderr)
 
 def read_local_architecture_summary():
     """Read the local architecture summary file"""
@@ -54,68 +70,62 @@ def read_local_architecture_summary():
         print(f"Error reading local architecture summary: {e}", file=sys.stderr)
         return None
 
+def fetch_context(firebase_client, repository, project_name="test"):
+    """Build the architecture context for a review, seeding the summary from the local file if needed"""
+    # Get current architecture summary
+    architecture_summary = firebase_client.get_architecture_summary(repository)
+    
+    # If no architecture summary found, create one from local file
+    if not architecture_summary:
+        print(f"No architecture summary found for {repository} in project {project_name}", file=sys.stderr)
+        local_summary = read_local_architecture_summary()
+        if local_summary:
+            print(f"Creating architecture summary for {repository} from local file", file=sys.stderr)
+            try:
+                firebase_client.update_architecture_summary(repository, local_summary, changes_count=0)
+                architecture_summary = {
+                    'repository': repository,
+                    'summary': local_summary,
+                    'last_updated': datetime.utcnow().isoformat(),
+                    'changes_count': 0
+                }
+                print(f"Successfully created architecture summary for {repository}", file=sys.stderr)
+            except Exception as e:
+                print(f"Error creating architecture summary: {e}", file=sys.stderr)
+                architecture_summary = None
+        else:
+            print(f"No local architecture summary available to create Firebase entry", file=sys.stderr)
+    
+    # Get recent changes for additional context
+    # recent_changes = firebase_client.get_recent_changes(repository, limit=5)
+    
+    return {
+        'architecture_summary': architecture_summary,
+        # 'recent_changes': recent_changes,
+        'repository': repository,
+        'project_name': project_name,
+        'status': 'success'
+    }
+
 def main():
     repository = os.environ.get('REPOSITORY')
     project_name = "test"  # Hardcoded project name
     
     if not repository:
         print("Error: REPOSITORY environment variable not set", file=sys.stderr)
-        print(f"context_b64={create_empty_context()}", file=sys.stderr)
+        write_context(create_empty_context())
         return
     
     try:
         def fetch_firebase_data():
+            from firebase_client import FirebaseClient
             firebase_client = FirebaseClient(project_name=project_name)
-            
-            # Get current architecture summary
-            architecture_summary = firebase_client.get_architecture_summary(repository)
-            
-            # If no architecture summary found, create one from local file
-            if not architecture_summary:
-                print(f"No architecture summary found for {repository} in project {project_name}", file=sys.stderr)
-                local_summary = read_local_architecture_summary()
-                if local_summary:
-                    print(f"Creating architecture summary for {repository} from local file", file=sys.stderr)
-                    try:
-                        firebase_client.update_architecture_summary(repository, local_summary, changes_count=0)
-                        architecture_summary = {
-                            'repository': repository,
-                            'summary': local_summary,
-                            'last_updated': datetime.utcnow().isoformat(),
-                            'changes_count': 0
-                        }
-                        print(f"Successfully created architecture summary for {repository}", file=sys.stderr)
-                    except Exception as e:
-                        print(f"Error creating architecture summary: {e}", file=sys.stderr)
-                        architecture_summary = None
-                else:
-                    print(f"No local architecture summary available to create Firebase entry", file=sys.stderr)
-            
-            # Get recent changes for additional context
-            # recent_changes = firebase_client.get_recent_changes(repository, limit=5)
-            
-            return {
-                'architecture_summary': architecture_summary,
-                # 'recent_changes': recent_changes,
-                'repository': repository,
-                'project_name': project_name,
-                'status': 'success'
-            }
+            return fetch_context(firebase_client, repository, project_name)
         
         # Try to fetch data with retries
         context_data = retry_with_backoff(fetch_firebase_data)
         
-        # Encode context as base64
-        context_json = json.dumps(context_data, default=str)
-        context_b64 = base64.b64encode(context_json.encode('utf-8')).decode('utf-8')
-        
-        # Write output to GitHub Actions output file
-        if 'GITHUB_OUTPUT' in os.environ:
-            with open(os.environ['GITHUB_OUTPUT'], 'a') as fh:
-                fh.write(f"context_b64={context_b64}\n")
-        else:
-            # Fallback for local testing
-            print(f"context_b64={context_b64}", file=sys.stderr)
+        write_context(context_data)
         
     except Exception as e:
         error_msg = str(e)
@@ -123,15 +133,7 @@ def main():
         
         # Provide empty context on error but don't exit with error code
         # This allows the workflow to continue even if Firebase is unavailable
-        empty_context_b64 = create_empty_context()
-        
-        # Write output to GitHub Actions output file
-        if 'GITHUB_OUTPUT' in os.environ:
-            with open(os.environ['GITHUB_OUTPUT'], 'a') as fh:
-                fh.write(f"context_b64={empty_context_b64}\n")
-        else:
-            # Fallback for local testing
-            print(f"context_b64={empty_context_b64}", file=sys.stderr)
+        write_context(create_empty_context())
         
         # Only exit with error code for critical failures
         if 'REPOSITORY' not in os.environ:
@@ -1,92 +1,157 @@
 import os
 import sys
 import json
-import firebase_admin
-from firebase_admin import credentials, firestore
+import threading
+import time
 
-# Configuration - Firebase service account file
-FIREBASE_SERVICE_ACCOUNT_FILE = "pr-agent-21ba8-firebase-adminsdk-fbsvc-73bedacb8b.json"
+from review_cache import get_cache_dir
 
-def initialize_firebase():
-    """Initialize Firebase Admin SDK using service account JSON file."""
-    try:
-        # Get the path to the service account file
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        github_dir = os.path.dirname(script_dir)
-        service_account_path = os.path.join(github_dir, FIREBASE_SERVICE_ACCOUNT_FILE)
-        
-        if not os.path.exists(service_account_path):
-            raise FileNotFoundError(f"Firebase service account file not found at: {service_account_path}")
-        
-        # Load the service account JSON
-        with open(service_account_path, 'r') as f:
-            service_account_info = json.load(f)
-        
-        # Initialize Firebase Admin with the service account file
-        cred = credentials.Certificate(service_account_path)
-        firebase_admin.initialize_app(cred)
-        
-        print("Firebase initialized successfully")
-        return True
-        
-    except Exception as e:
-        print(f"Error initializing Firebase: {e}")
-        return False
-
-def fetch_macros():
-    """Fetch macro configuration values from Firestore."""
+# Expected macro keys with defaults
+EXPECTED_MACROS = {
+    'LINE_THRESHOLD': '200',
+    'CHANGES_THRESHOLD': '5',
+    'IMPORTANT_CHANGE_MARKERS': '#IMPORTANT-CHANGE,#IMPORTANT-CHANGES',
+    'IMPORTANT_CHANGE_LABELS': 'important change,important changes'
+}
+
+MACROS_PATH = 'macros/macros'
+MACRO_CACHE_FILE_NAME = 'macros.json'
+MACRO_CACHE_SCHEMA_VERSION = 1
+# Seconds a cached copy is used without contacting storage
+DEFAULT_MACRO_CACHE_TTL = 900
+# Seconds to wait for revalidation before using the stale copy
+DEFAULT_MACRO_REVALIDATE_TIMEOUT = 2.0
+# Copies older than this are never used without a successful read
+DEFAULT_MACRO_CACHE_MAX_AGE = 7 * 24 * 3600
+
+def macro_values(macros_data):
+    """Return every expected macro, falling back to its default."""
+    return {key: str((macros_data or {}).get(key, default_value))
+            for key, default_value in EXPECTED_MACROS.items()}
+
+def fetch_macros(backend):
+    """Fetch macro configuration values from the storage backend; errors propagate."""
+    macros_data = backend.get_document(MACROS_PATH)
+
+    if macros_data is None:
+        print(f"No macros document found in {backend.name} storage")
+        return None
+
+    print(f"Successfully fetched macros from {backend.name} storage")
+    return macros_data
+
+def get_macro_cache_path():
+    return os.environ.get('MACRO_CACHE_FILE') or os.path.join(get_cache_dir(), MACRO_CACHE_FILE_NAME)
+
+def load_macro_cache():
+    """Return the cached {'version', 'fetched_at', 'macros'} entry, or None."""
     try:
-        # Get Firestore client
-        db = firestore.client()
-        
-        # Get reference to macros document
-        doc_ref = db.collection('macros').document('macros')
-        doc = doc_ref.get()
-        
-        if not doc.exists:
-            print("No macros document found in Firestore")
+        with open(get_macro_cache_path(), 'r') as f:
+            cached = json.load(f)
+        if cached.get('schema') != MACRO_CACHE_SCHEMA_VERSION or not isinstance(cached.get('macros'), dict):
             return None
-        
-        macros_data = doc.to_dict()
-        print("Successfully fetched macros from Firestore:")
-        
-        # Define expected macro keys with defaults
-        expected_macros = {
-            'LINE_THRESHOLD': '200',
-            'CHANGES_THRESHOLD': '5',
-            'IMPORTANT_CHANGE_MARKERS': '#IMPORTANT-CHANGE,#IMPORTANT-CHANGES',
-            'IMPORTANT_CHANGE_LABELS': 'important change,important changes'
-        }
-        
-        # Extract values and set GitHub outputs
-        for key, default_value in expected_macros.items():
-            value = macros_data.get(key, default_value)
-            print(f"  {key}={value}")
-            
-            # Set GitHub Actions output
-            with open(os.environ.get('GITHUB_OUTPUT', '/dev/stdout'), 'a') as f:
-                f.write(f"{key.lower()}={value}\n")
-        
-        return macros_data
-        
-    except Exception as e:
-        print(f"Error fetching macros: {e}")
+        return cached
+    except (OSError, ValueError):
         return None
 
+def save_macro_cache(macros_data, version):
+    """Write the cache atomically so concurrent runs never read a partial file."""
+    path = get_macro_cache_path()
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'schema': MACRO_CACHE_SCHEMA_VERSION, 'version': version,
+                       'fetched_at': time.time(), 'macros': macros_data}, f, default=str)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not write macro cache: {e}")
+
+def revalidate_macros(cached, get_backend):
+    """Read the document's version and fetch the macros only if it changed since cached."""
+    backend = get_backend()
+    version = backend.get_document_version(MACROS_PATH)
+    if version is None:
+        print(f"No macros document found in {backend.name} storage")
+        return None
+    if cached is not None and cached.get('version') == version:
+        print(f"Macros unchanged in {backend.name} storage (version {version})")
+        macros_data = cached['macros']
+    else:
+        macros_data = fetch_macros(backend)
+        if macros_data is None:
+            return None
+    save_macro_cache(macros_data, version)
+    return macros_data
+
+def get_macros(get_backend=None):
+    """Return the macros document, from the local cache when it is fresh.
+
+    Within MACRO_CACHE_TTL seconds the cached copy is used without touching
+    storage. After that the document's version is checked and the macros
+    are only re-read if it changed; if that takes longer than
+    MACRO_REVALIDATE_TIMEOUT the stale copy is used while the check
+    finishes in the background. Returns None if the macros are unavailable.
+    """
+    if get_backend is None:
+        from storage_backend import get_storage_backend as get_backend
+
+    ttl = float(os.environ.get('MACRO_CACHE_TTL', DEFAULT_MACRO_CACHE_TTL))
+    timeout = float(os.environ.get('MACRO_REVALIDATE_TIMEOUT', DEFAULT_MACRO_REVALIDATE_TIMEOUT))
+    max_age = float(os.environ.get('MACRO_CACHE_MAX_AGE', DEFAULT_MACRO_CACHE_MAX_AGE))
+
+    cached = load_macro_cache()
+    age = time.time() - cached['fetched_at'] if cached else None
+    if cached is not None and age < ttl:
+        print(f"Using cached macros (age {age:.0f}s, ttl {ttl:.0f}s)")
+        return cached['macros']
+
+    if cached is None or age >= max_age:
+        try:
+            return revalidate_macros(cached, get_backend)
+        except Exception as e:
+            print(f"Error fetching macros: {e}")
+            return None
+
+    # Stale while revalidate: a daemon thread does not hold up exit if storage is slow
+    result = {}
+    def revalidate():
+        try:
+            result['macros'] = revalidate_macros(cached, get_backend)
+        except Exception as e:
+            result['error'] = e
+    thread = threading.Thread(target=revalidate, name='macro-revalidate', daemon=True)
+    thread.start()
+    thread.join(timeout)
+
+    if thread.is_alive():
+        print(f"Macro revalidation exceeded {timeout:.1f}s, using cached macros (age {age:.0f}s)")
+        return cached['macros']
+    if 'error' in result:
+        print(f"Error revalidating macros, using cached macros (age {age:.0f}s): {result['error']}")
+        return cached['macros']
+    return result['macros']
+
+def write_macro_outputs(values):
+    """Write every macro to GITHUB_OUTPUT in one append."""
+    text = ''.join(f"{key.lower()}={value}\n" for key, value in values.items())
+    with open(os.environ.get('GITHUB_OUTPUT', '/dev/stdout'), 'a') as f:
+        f.write(text)
+
 def main():
     """Main function."""
-    print("Fetching macro configuration from Firebase...")
-    
-    # Initialize Firebase
-    if not initialize_firebase():
-        sys.exit(1)
-    
-    # Fetch macros
-    macros = fetch_macros()
+    print("Fetching macro configuration...")
+
+    macros = get_macros()
     if macros is None:
         print("Failed to fetch macros")
         sys.exit(1)
-    
+
+    values = macro_values(macros)
+    for key, value in values.items():
+        print(f"  {key}={value}")
+    write_macro_outputs(values)
+
     print("Macro fetch completed successfully")
 
 if __name__ == "__main__":
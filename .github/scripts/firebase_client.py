@@ -1,39 +1,106 @@
 import os
+import atexit
+import copy
+import hashlib
 import json
 import sys
-import firebase_admin
-from firebase_admin import credentials, firestore
 from datetime import datetime
-import base64
 import logging
+from storage_backend import get_storage_backend
 
 # Configuration constants
 CHANGES_THRESHOLD = 5
-# Configuration - Firebase service account file
-FIREBASE_SERVICE_ACCOUNT_FILE = "pr-agent-21ba8-firebase-adminsdk-fbsvc-73bedacb8b.json"
+# Snapshot of documents read during a workflow run, shared between steps
+FIREBASE_SNAPSHOT_VERSION = 1
+
+
+def get_snapshot_run_id():
+    """Identify the workflow run a snapshot belongs to, so stale snapshots are ignored"""
+    return f"{os.environ.get('GITHUB_RUN_ID', 'local')}-{os.environ.get('GITHUB_RUN_ATTEMPT', '1')}"
 
 class FirebaseClient:
     def __init__(self, service_account_path=None, project_name="test"):
         try:
-            if not firebase_admin._apps:
-                # Use provided path or default to the JSON file
-                if not service_account_path:
-                    script_dir = os.path.dirname(os.path.abspath(__file__))
-                    github_dir = os.path.dirname(script_dir)
-                    service_account_path = os.path.join(github_dir, FIREBASE_SERVICE_ACCOUNT_FILE)
-                
-                if not os.path.exists(service_account_path):
-                    raise FileNotFoundError(f"Firebase credentials file not found at: {service_account_path}")
-                    
-                cred = credentials.Certificate(service_account_path)
-                firebase_admin.initialize_app(cred)
-            
-            self.db = firestore.client()
+            # Firestore or SQLite, selected by STORAGE_BACKEND
+            self.backend = get_storage_backend(service_account_path)
             self.project_name = project_name
+            # Read-through cache of documents by path; None records a missing document
+            self._doc_cache = {}
+            self.snapshot_path = os.environ.get('FIREBASE_SNAPSHOT_FILE')
+            # Set when the cache changed since the snapshot was last written
+            self._snapshot_dirty = False
+            self._load_snapshot()
+            if self.snapshot_path:
+                # Written once when the step's process exits, not on every read and write
+                atexit.register(self.save_snapshot)
         except Exception as e:
-            logging.error(f"Failed to initialize Firebase: {str(e)}")
+            logging.error(f"Failed to initialize storage: {str(e)}")
             raise
     
+    def _load_snapshot(self):
+        """Seed the document cache from the snapshot written by earlier steps of this run"""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+            if snapshot.get('version') != FIREBASE_SNAPSHOT_VERSION or snapshot.get('run_id') != get_snapshot_run_id():
+                return
+            self._doc_cache.update(snapshot.get('documents', {}))
+            print(f"Loaded {len(self._doc_cache)} cached storage documents from {self.snapshot_path}", file=sys.stderr)
+        except Exception as e:
+            logging.warning(f"Could not load Firestore snapshot: {str(e)}")
+    
+    def save_snapshot(self):
+        """Write the document cache so later steps of this run can skip the reads; a no-op if nothing changed"""
+        if not self.snapshot_path or not self._snapshot_dirty:
+            return
+        try:
+            snapshot = {
+                'version': FIREBASE_SNAPSHOT_VERSION,
+                'run_id': get_snapshot_run_id(),
+                'documents': self._doc_cache
+            }
+            tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f, default=str)
+            os.replace(tmp_path, self.snapshot_path)
+            self._snapshot_dirty = False
+        except Exception as e:
+            logging.warning(f"Could not save Firestore snapshot: {str(e)}")
+    
+    def _get_document(self, path):
+        """Read a document through the cache, returning its data or None if it does not exist"""
+        if path not in self._doc_cache:
+            self._doc_cache[path] = self.backend.get_document(path)
+            self._snapshot_dirty = True
+        return copy.deepcopy(self._doc_cache[path])
+    
+    def _set_document(self, path, data, merge=False):
+        """Write a document and keep the cache in step with the write"""
+        self.backend.set_document(path, data, merge=merge)
+        cached = self._doc_cache.get(path)
+        known_missing = path in self._doc_cache and cached is None
+        if not merge or known_missing:
+            self._doc_cache[path] = copy.deepcopy(data)
+        elif cached is not None:
+            cached.update(copy.deepcopy(data))
+        else:
+            # Merged into a document we have not read; the other fields are unknown
+            self._doc_cache.pop(path, None)
+        self._snapshot_dirty = True
+    
+    def invalidate(self, path=None):
+        """Drop one document, or every document, from the cache"""
+        if path is None:
+            self._doc_cache.clear()
+        else:
+            self._doc_cache.pop(path, None)
+        self._snapshot_dirty = True
+    
+    def _summary_path(self, repository):
+        return f"{self.project_name}/architecture_summaries/summaries/{repository.replace('/', '_')}"
+    
     def get_architecture_summary(self, repository):
         """Get the current architecture summary for a repository"""
         if not repository:
@@ -41,10 +108,9 @@ class FirebaseClient:
             
         try:
             # Use project_name as the main collection path
-            doc_ref = self.db.collection(self.project_name).document('architecture_summaries').collection('summaries').document(repository.replace('/', '_'))
-            doc = doc_ref.get()
-            if doc.exists:
-                data = doc.to_dict()
+            path = self._summary_path(repository)
+            data = self._get_document(path)
+            if data is not None:
                 print(f"Found existing architecture summary for {repository} in project {self.project_name}", file=sys.stderr)
                 return data
             else:
@@ -57,14 +123,14 @@ class FirebaseClient:
     def update_architecture_summary(self, repository, summary, changes_count=0):
         """Update the architecture summary for a repository"""
         try:
-            doc_ref = self.db.collection(self.project_name).document('architecture_summaries').collection('summaries').document(repository.replace('/', '_'))
+            path = self._summary_path(repository)
             data = {
                 'repository': repository,
                 'summary': summary,
                 'last_updated': datetime.utcnow(),
                 'changes_count': changes_count
             }
-            doc_ref.set(data, merge=True)
+            self._set_document(path, data, merge=True)
             print(f"Successfully updated architecture summary for {repository} in project {self.project_name}", file=sys.stderr)
         except Exception as e:
             logging.error(f"Error updating architecture summary: {str(e)}")
@@ -73,7 +139,6 @@ class FirebaseClient:
     def add_architecture_change(self, repository, pr_number, diff, metadata=None):
         """Add a new architecture change record"""
         try:
-            doc_ref = self.db.collection(self.project_name).document('architecture_changes').collection('changes').document()
             change_data = {
                 'repository': repository,
                 'pr_number': pr_number,
@@ -81,9 +146,9 @@ class FirebaseClient:
                 'timestamp': datetime.utcnow(),
                 'metadata': metadata or {}
             }
-            doc_ref.set(change_data)
+            change_id = self.backend.add_document(f"{self.project_name}/architecture_changes/changes", change_data)
             print(f"Successfully added architecture change for {repository} in project {self.project_name}", file=sys.stderr)
-            return doc_ref.id
+            return change_id
         except Exception as e:
             logging.error(f"Error adding architecture change: {str(e)}")
             raise
@@ -91,15 +156,10 @@ class FirebaseClient:
     def get_recent_changes(self, repository, limit=10):
         """Get recent architecture changes for context"""
         try:
-            query = (self.db.collection(self.project_name).document('architecture_changes').collection('changes')
-                    .where(filter=firestore.FieldFilter('repository', '==', repository))
-                    .order_by('timestamp', direction=firestore.Query.DESCENDING)
-                    .limit(limit))
-            
-            changes = []
-            for doc in query.stream():
-                data = doc.to_dict()
-                changes.append(data)
+            changes = self.backend.query_documents(
+                f"{self.project_name}/architecture_changes/changes",
+                where=('repository', repository),
+                order_by='timestamp', descending=True, limit=limit)
             
             print(f"Found {len(changes)} recent changes for {repository} in project {self.project_name}", file=sys.stderr)
             return changes
@@ -114,14 +174,13 @@ class FirebaseClient:
             changes_threshold = int(os.environ.get('CHANGES_THRESHOLD', CHANGES_THRESHOLD))
             
         try:
-            doc_ref = self.db.collection(self.project_name).document('architecture_summaries').collection('summaries').document(repository.replace('/', '_'))
-            doc = doc_ref.get()
+            path = self._summary_path(repository)
+            data = self._get_document(path)
             
-            if not doc.exists:
+            if data is None:
                 print(f"No existing summary found for {repository}, should summarize", file=sys.stderr)
                 return True
             
-            data = doc.to_dict()
             changes_count = data.get('changes_count', 0)
             should_summarize = changes_count >= changes_threshold
             print(f"Repository {repository} has {changes_count} changes, threshold is {changes_threshold}, should summarize: {should_summarize}", file=sys.stderr)
@@ -129,3 +188,127 @@ class FirebaseClient:
         except Exception as e:
             logging.error(f"Error checking should_summarize: {str(e)}")
             return False
+    
+    def increment_changes(self, repository, changes_threshold=None):
+        """Atomically add one to changes_count and decide whether to regenerate the summary.
+        
+        Runs as a backend transaction that only touches changes_count, so the
+        summary text is never re-sent and concurrent PRs do not lose
+        increments. The decision uses the count before this change, like
+        should_summarize.
+        Returns (new_count, should_summarize).
+        """
+        if changes_threshold is None:
+            changes_threshold = int(os.environ.get('CHANGES_THRESHOLD', CHANGES_THRESHOLD))
+        
+        path = self._summary_path(repository)
+        
+        now = datetime.utcnow()
+        try:
+            new_count, created = self.backend.increment_field(
+                path, 'changes_count', {'last_updated': now},
+                initial_data={'repository': repository, 'summary': "Initial architecture summary"})
+        except Exception as e:
+            logging.error(f"Error incrementing changes count: {str(e)}")
+            raise
+        # Decide on the count before this change, like should_summarize
+        should_summarize = created or (new_count - 1) >= changes_threshold
+        
+        cached = self._doc_cache.get(path)
+        if created:
+            self._doc_cache[path] = {'repository': repository, 'summary': "Initial architecture summary",
+                                     'last_updated': now, 'changes_count': new_count}
+        elif cached is not None:
+            cached.update({'changes_count': new_count, 'last_updated': now})
+        else:
+            self._doc_cache.pop(path, None)
+        self._snapshot_dirty = True
+        
+        print(f"Repository {repository} now has {new_count} changes, threshold is {changes_threshold}, should summarize: {should_summarize}", file=sys.stderr)
+        return new_count, should_summarize
+    
+    def get_last_reviewed_sha(self, repository, pr_number):
+        """Get the head SHA of the last reviewed push for a pull request"""
+        try:
+            path = f"{self.project_name}/review_state/pull_requests/{repository.replace('/', '_')}_{pr_number}"
+            data = self._get_document(path)
+            if data is not None:
+                return data.get('last_reviewed_sha')
+            return None
+        except Exception as e:
+            logging.error(f"Error fetching last reviewed SHA: {str(e)}")
+            return None
+    
+    def set_last_reviewed_sha(self, repository, pr_number, head_sha):
+        """Record the head SHA that was just reviewed for a pull request"""
+        try:
+            path = f"{self.project_name}/review_state/pull_requests/{repository.replace('/', '_')}_{pr_number}"
+            self._set_document(path, {
+                'repository': repository,
+                'pr_number': pr_number,
+                'last_reviewed_sha': head_sha,
+                'last_updated': datetime.utcnow()
+            }, merge=True)
+            print(f"Recorded reviewed head {head_sha} for {repository}#{pr_number} in project {self.project_name}", file=sys.stderr)
+        except Exception as e:
+            logging.error(f"Error recording last reviewed SHA: {str(e)}")
+            raise
+    
+    def _file_summaries_path(self, repository):
+        return f"{self.project_name}/file_summaries/repositories/{repository.replace('/', '_')}/files"
+    
+    def _file_summary_id(self, path):
+        # Paths contain slashes, which Firestore document ids cannot
+        return hashlib.sha256(path.encode('utf-8')).hexdigest()
+    
+    def get_file_summaries(self, repository):
+        """Get the cached per-file summaries for a repository, keyed by path"""
+        try:
+            documents = self.backend.query_documents(self._file_summaries_path(repository))
+            files = {
+                doc['path']: {'blob_sha': doc.get('blob_sha'), 'summary': doc.get('summary')}
+                for doc in documents if doc.get('path')
+            }
+            print(f"Found {len(files)} cached file summaries for {repository} in project {self.project_name}", file=sys.stderr)
+            return files
+        except Exception as e:
+            logging.error(f"Error fetching file summaries: {str(e)}")
+            return {}
+    
+    def update_file_summaries(self, repository, changed, removed=()):
+        """Write changed per-file summaries and delete removed ones in one batch.
+        
+        Each file summary is its own document named by a hash of its path, so
+        a run only writes the entries that changed and no document grows with
+        the size of the repository. changed maps path to {'blob_sha', 'summary'};
+        removed lists paths that are no longer in the tree.
+        """
+        try:
+            collection = self._file_summaries_path(repository)
+            now = datetime.utcnow()
+            documents = {
+                f"{collection}/{self._file_summary_id(path)}": {
+                    'repository': repository,
+                    'path': path,
+                    'blob_sha': entry['blob_sha'],
+                    'summary': entry['summary'],
+                    'last_updated': now
+                }
+                for path, entry in changed.items()
+            }
+            self.backend.write_batch(documents, [f"{collection}/{self._file_summary_id(path)}" for path in removed])
+            print(f"Stored {len(changed)} and removed {len(removed)} file summaries for {repository} in project {self.project_name}", file=sys.stderr)
+        except Exception as e:
+            logging.error(f"Error updating file summaries: {str(e)}")
+            raise
+
+
+_firebase_client = None
+
+
+def get_firebase_client(project_name="test"):
+    """Return a FirebaseClient shared by everything running in this process"""
+    global _firebase_client
+    if _firebase_client is None or _firebase_client.project_name != project_name:
+        _firebase_client = FirebaseClient(project_name=project_name)
+    return _firebase_client
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+File handoff of large step data (the PR diff, the architecture context).
+
+A handoff file is one JSON header line followed by the zlib-compressed
+payload. The header carries the schema version, the kind of data, the
+uncompressed size and its sha256, so readers can check a file without
+decompressing it and reject truncated or mismatched ones:
+
+    git diff base head | python3 handoff.py write diff /tmp/pr_diff.handoff
+    python3 handoff.py info /tmp/pr_diff.handoff
+    python3 handoff.py read /tmp/pr_diff.handoff > pr.diff
+
+Steps pass the path (DIFF_PATH, ARCHITECTURE_CONTEXT_PATH) instead of a
+base64 string in GITHUB_OUTPUT and the environment.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import sys
+import zlib
+from typing import Any, Dict, Optional, Union
+
+HANDOFF_SCHEMA_VERSION = 1
+HANDOFF_CODEC = 'zlib'
+COMPRESSION_LEVEL = 6
+# Header lines are small; anything longer is not a handoff file
+MAX_HEADER_BYTES = 4096
+
+
+class HandoffError(ValueError):
+    """A handoff file is missing, malformed, of the wrong kind or corrupted."""
+
+
+def write_handoff(path: str, data: Union[bytes, str], kind: str) -> Dict[str, Any]:
+    """Compress data into a handoff file (atomically) and return its header."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    compressed = zlib.compress(data, COMPRESSION_LEVEL)
+    header = {
+        'schema': HANDOFF_SCHEMA_VERSION,
+        'kind': kind,
+        'codec': HANDOFF_CODEC,
+        'size': len(data),
+        'compressed_size': len(compressed),
+        'sha256': hashlib.sha256(data).hexdigest()
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(json.dumps(header, sort_keys=True).encode('utf-8') + b'\n')
+        f.write(compressed)
+    os.replace(tmp_path, path)
+    return header
+
+
+def _read_header(f, path: str, kind: Optional[str]) -> Dict[str, Any]:
+    line = f.readline(MAX_HEADER_BYTES)
+    try:
+        header = json.loads(line)
+    except ValueError:
+        raise HandoffError(f"{path} is not a handoff file")
+    if not isinstance(header, dict) or header.get('schema') != HANDOFF_SCHEMA_VERSION:
+        raise HandoffError(f"{path} has unsupported handoff schema {header.get('schema') if isinstance(header, dict) else None}")
+    if header.get('codec') != HANDOFF_CODEC:
+        raise HandoffError(f"{path} uses unknown codec {header.get('codec')}")
+    if kind is not None and header.get('kind') != kind:
+        raise HandoffError(f"{path} holds {header.get('kind')}, expected {kind}")
+    return header
+
+
+def read_handoff_header(path: str, kind: Optional[str] = None) -> Dict[str, Any]:
+    """Return the header only, without reading the payload."""
+    try:
+        with open(path, 'rb') as f:
+            return _read_header(f, path, kind)
+    except OSError as e:
+        raise HandoffError(f"Cannot read handoff file {path}: {e}")
+
+
+def read_handoff(path: str, kind: Optional[str] = None) -> bytes:
+    """Return the payload after checking schema, kind, size and sha256."""
+    try:
+        with open(path, 'rb') as f:
+            header = _read_header(f, path, kind)
+            compressed = f.read()
+    except OSError as e:
+        raise HandoffError(f"Cannot read handoff file {path}: {e}")
+    try:
+        data = zlib.decompress(compressed)
+    except zlib.error as e:
+        raise HandoffError(f"{path} payload is corrupted: {e}")
+    if len(data) != header.get('size') or hashlib.sha256(data).hexdigest() != header.get('sha256'):
+        raise HandoffError(f"{path} payload does not match its header")
+    return data
+
+
+def load_diff() -> Optional[str]:
+    """The PR diff from DIFF_PATH, or from DIFF_B64 for older callers; None if neither is set."""
+    diff_path = os.environ.get('DIFF_PATH')
+    if diff_path:
+        return read_handoff(diff_path, 'diff').decode('utf-8')
+    diff_b64 = os.environ.get('DIFF_B64')
+    if diff_b64:
+        return base64.b64decode(diff_b64).decode('utf-8')
+    return None
+
+
+def load_architecture_context() -> Optional[Dict[str, Any]]:
+    """The architecture context from ARCHITECTURE_CONTEXT_PATH or ARCHITECTURE_CONTEXT_B64; None if neither is set."""
+    context_path = os.environ.get('ARCHITECTURE_CONTEXT_PATH')
+    if context_path:
+        return json.loads(read_handoff(context_path, 'architecture_context'))
+    context_b64 = os.environ.get('ARCHITECTURE_CONTEXT_B64')
+    if context_b64:
+        return json.loads(base64.b64decode(context_b64).decode('utf-8'))
+    return None
+
+
+def main():
+    usage = "usage: handoff.py write <kind> <path> | read <path> | info <path>"
+    if len(sys.argv) < 3:
+        print(usage, file=sys.stderr)
+        sys.exit(2)
+    command = sys.argv[1]
+    try:
+        if command == 'write' and len(sys.argv) == 4:
+            header = write_handoff(sys.argv[3], sys.stdin.buffer.read(), sys.argv[2])
+            print(f"Wrote {sys.argv[2]} handoff: {header['size']} bytes, "
+                  f"{header['compressed_size']} compressed", file=sys.stderr)
+        elif command == 'read':
+            sys.stdout.buffer.write(read_handoff(sys.argv[2]))
+        elif command == 'info':
+            print(json.dumps(read_handoff_header(sys.argv[2]), indent=2))
+        else:
+            print(usage, file=sys.stderr)
+            sys.exit(2)
+    except HandoffError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
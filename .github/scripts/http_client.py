@@ -0,0 +1,315 @@
+import http.client
+import json
+import os
+import queue
+import socket
+import ssl
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+# Default timeouts in seconds, overridable through the environment
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 300.0
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 8
+
+
+@dataclass
+class HttpResult:
+    """Outcome of an HTTP request.
+
+    error_type is None on success, otherwise one of 'timeout', 'connection',
+    'http' (non-2xx status), 'decode' (body is not valid JSON) or
+    'cancelled' (aborted through a CancelToken).
+    """
+    status: int = 0
+    data: Any = None
+    text: str = ''
+    headers: Dict[str, str] = field(default_factory=dict)
+    error_type: Optional[str] = None
+    error_message: Optional[str] = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error_type is None
+
+
+class CancelToken:
+    """Aborts an in-flight request from another thread by shutting down its socket."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn: Optional[http.client.HTTPConnection] = None
+        self._event = threading.Event()
+        self.cancelled = False
+
+    def _attach(self, conn: http.client.HTTPConnection) -> bool:
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._conn = conn
+            return True
+
+    def _detach(self):
+        with self._lock:
+            self._conn = None
+
+    def wait(self, timeout: float) -> bool:
+        """Sleep up to timeout seconds; True if cancelled meanwhile."""
+        return self._event.wait(timeout)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            conn = self._conn
+        self._event.set()
+        if conn is not None and conn.sock is not None:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class PooledHttpClient:
+    """Thread-safe HTTP client that keeps connections alive per host."""
+
+    def __init__(self, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 max_connections_per_host: int = DEFAULT_MAX_CONNECTIONS_PER_HOST):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_connections_per_host = max_connections_per_host
+        self._pools: Dict[Tuple[str, str, int], queue.LifoQueue] = {}
+        self._lock = threading.Lock()
+        # Loading the CA bundle is slow; done on the first HTTPS connection
+        self._ssl_context: Optional[ssl.SSLContext] = None
+
+    def _pool(self, key: Tuple[str, str, int]) -> queue.LifoQueue:
+        with self._lock:
+            if key not in self._pools:
+                self._pools[key] = queue.LifoQueue(maxsize=self.max_connections_per_host)
+            return self._pools[key]
+
+    def _new_connection(self, scheme: str, host: str, port: int) -> http.client.HTTPConnection:
+        if scheme == 'https':
+            with self._lock:
+                if self._ssl_context is None:
+                    self._ssl_context = ssl.create_default_context()
+            conn = http.client.HTTPSConnection(host, port, timeout=self.connect_timeout,
+                                               context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+        conn.connect()
+        # http.client writes headers and body separately; without NODELAY the
+        # body waits on a delayed ACK from the server
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.sock.settimeout(self.read_timeout)
+        return conn
+
+    def _acquire(self, key: Tuple[str, str, int]) -> Tuple[http.client.HTTPConnection, bool]:
+        """Return an idle pooled connection, or a new one. The flag tells if it was reused."""
+        try:
+            return self._pool(key).get_nowait(), True
+        except queue.Empty:
+            return self._new_connection(*key), False
+
+    def _release(self, key: Tuple[str, str, int], conn: http.client.HTTPConnection):
+        try:
+            self._pool(key).put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _send(self, method: str, url: str, body: Optional[bytes], headers: Optional[Dict[str, str]],
+              cancel: Optional[CancelToken],
+              read_body: Callable[[http.client.HTTPResponse], bytes]) -> HttpResult:
+        """Send a request on a pooled connection and let read_body consume the response.
+
+        A pooled connection may have been closed by the server while idle;
+        if it fails before a response arrives the request is retried once on
+        a fresh connection. A cancelled request returns error_type
+        'cancelled'; its connection is closed instead of going back to the
+        pool. Exceptions from read_body close the connection and propagate.
+        """
+        parts = urlsplit(url)
+        scheme = parts.scheme or 'https'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        start = time.monotonic()
+        for attempt in range(2):
+            conn = None
+            reused = False
+            responded = False
+            try:
+                conn, reused = self._acquire(key)
+                if cancel is not None and not cancel._attach(conn):
+                    conn.close()
+                    return HttpResult(error_type='cancelled', error_message='request cancelled',
+                                      elapsed=time.monotonic() - start)
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                responded = True
+                response_headers = {k.lower(): v for k, v in response.getheaders()}
+                raw = read_body(response)
+                if cancel is not None:
+                    # Detach before the connection can be handed to another request
+                    cancel._detach()
+
+                if response.will_close:
+                    conn.close()
+                else:
+                    self._release(key, conn)
+
+                result = HttpResult(
+                    status=response.status,
+                    text=raw.decode('utf-8', errors='replace'),
+                    headers=response_headers,
+                    elapsed=time.monotonic() - start
+                )
+                if not 200 <= response.status < 300:
+                    result.error_type = 'http'
+                    result.error_message = f"HTTP {response.status} {response.reason}"
+                return result
+            except (socket.timeout, http.client.HTTPException, OSError) as e:
+                if conn:
+                    conn.close()
+                if cancel is not None and cancel.cancelled:
+                    return HttpResult(error_type='cancelled', error_message='request cancelled',
+                                      elapsed=time.monotonic() - start)
+                if not isinstance(e, socket.timeout):
+                    if reused and attempt == 0 and not responded:
+                        continue
+                    return HttpResult(error_type='connection', error_message=str(e),
+                                      elapsed=time.monotonic() - start)
+                return HttpResult(error_type='timeout', error_message=str(e) or 'timed out',
+                                  elapsed=time.monotonic() - start)
+            except Exception:
+                if conn:
+                    conn.close()
+                raise
+            finally:
+                if cancel is not None:
+                    cancel._detach()
+
+        return HttpResult(error_type='connection', error_message='request failed',
+                          elapsed=time.monotonic() - start)
+
+    def request(self, method: str, url: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None,
+                cancel: Optional[CancelToken] = None) -> HttpResult:
+        """Send a request and return the raw body as text."""
+        return self._send(method, url, body, headers, cancel, lambda response: response.read())
+
+    def post_json(self, url: str, payload: Dict[str, Any],
+                  headers: Optional[Dict[str, str]] = None,
+                  cancel: Optional[CancelToken] = None) -> HttpResult:
+        """POST a JSON payload from memory and decode the JSON response."""
+        request_headers = {'Content-Type': 'application/json'}
+        request_headers.update(headers or {})
+        result = self.request('POST', url, json.dumps(payload).encode('utf-8'), request_headers, cancel)
+        return decode_json_result(result)
+
+    def post_sse(self, url: str, payload: Dict[str, Any], on_event: Callable[[str, str], None],
+                 headers: Optional[Dict[str, str]] = None,
+                 cancel: Optional[CancelToken] = None) -> HttpResult:
+        """POST a JSON payload and read the server-sent event stream it answers with.
+
+        on_event(event, data) is called for every event as it arrives. Any
+        other response (an error, or a server that ignored the stream request)
+        is read whole and decoded like post_json; a streamed one returns no data.
+        """
+        request_headers = {'Content-Type': 'application/json', 'Accept': 'text/event-stream'}
+        request_headers.update(headers or {})
+        streamed = []
+
+        def read_body(response: http.client.HTTPResponse) -> bytes:
+            content_type = response.getheader('content-type') or ''
+            if not (200 <= response.status < 300 and 'text/event-stream' in content_type):
+                return response.read()
+            streamed.append(True)
+            for event, data in iter_sse_events(response):
+                on_event(event, data)
+            # Line iteration can stop without marking the response done,
+            # which would keep the connection from being reused
+            response.read()
+            return b''
+
+        result = self._send('POST', url, json.dumps(payload).encode('utf-8'), request_headers,
+                            cancel, read_body)
+        return result if streamed else decode_json_result(result)
+
+    def close(self):
+        """Close every idle pooled connection."""
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools = {}
+        for pool in pools:
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except queue.Empty:
+                    break
+
+
+def iter_sse_events(lines: Iterable[bytes]) -> Iterator[Tuple[str, str]]:
+    """Yield (event, data) pairs from the lines of a text/event-stream body."""
+    event = ''
+    data = []
+    for raw in lines:
+        line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+        if not line:
+            if data:
+                yield event or 'message', '\n'.join(data)
+            event = ''
+            data = []
+            continue
+        if line.startswith(':'):
+            continue
+        name, _, value = line.partition(':')
+        if value.startswith(' '):
+            value = value[1:]
+        if name == 'event':
+            event = value
+        elif name == 'data':
+            data.append(value)
+    if data:
+        yield event or 'message', '\n'.join(data)
+
+
+def decode_json_result(result: HttpResult) -> HttpResult:
+    """Parse the body of a result as JSON, keeping HTTP errors intact."""
+    if result.error_type in ('timeout', 'connection', 'cancelled'):
+        return result
+    try:
+        result.data = json.loads(result.text) if result.text else None
+    except json.JSONDecodeError as e:
+        if result.ok:
+            result.error_type = 'decode'
+            result.error_message = f"Invalid JSON response: {e}"
+    return result
+
+
+_shared_client: Optional[PooledHttpClient] = None
+_shared_client_lock = threading.Lock()
+
+
+def get_http_client() -> PooledHttpClient:
+    """Return the process-wide pooled client, configured from the environment."""
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            try:
+                connect_timeout = float(os.environ.get('HTTP_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT))
+                read_timeout = float(os.environ.get('HTTP_READ_TIMEOUT', DEFAULT_READ_TIMEOUT))
+            except ValueError:
+                print("Warning: Invalid HTTP timeout settings, using defaults", file=sys.stderr)
+                connect_timeout, read_timeout = DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+            _shared_client = PooledHttpClient(connect_timeout, read_timeout)
+        return _shared_client
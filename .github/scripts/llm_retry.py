@@ -0,0 +1,210 @@
+import os
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Mapping, Optional
+
+# Retry settings, overridable through the environment
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_RETRY_BASE_DELAY = 2.0
+DEFAULT_RETRY_MAX_DELAY = 60.0
+# Seconds one review request may spend on attempts and waits in total
+DEFAULT_REVIEW_DEADLINE = 600.0
+# Consecutive failures that open a provider's circuit, and how long it stays open
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_COOLDOWN = 120.0
+
+
+@dataclass
+class ProviderResponse:
+    """Outcome of one review call.
+
+    content is None when the call failed; retryable marks failures that
+    another attempt or provider may not hit (timeouts, 429, 5xx, 529).
+    cancelled marks a call ended by its CancelToken; in_flight says a request
+    was under way then, so the provider may bill its input.
+    """
+    content: Optional[str] = None
+    retryable: bool = False
+    cancelled: bool = False
+    in_flight: bool = False
+    status: int = 0
+    retry_after: Optional[float] = None
+    error: str = ''
+
+
+class ReviewUnavailable(Exception):
+    """No review could be obtained from the providers.
+
+    review holds what is known anyway (cached or partial comments as a JSON
+    array); failed and total count the requests, so callers can tell a
+    partial review from a missing one.
+    """
+
+    def __init__(self, reason: str, review: str = '[]', failed: int = 1, total: int = 1):
+        super().__init__(reason)
+        self.reason = reason
+        self.review = review
+        self.failed = failed
+        self.total = total
+
+
+def should_retry_status(status: int) -> bool:
+    """Rate limits and server errors, including Anthropic's 529 overloaded."""
+    return status == 429 or 500 <= status <= 599
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds to wait from retry-after-ms or retry-after (seconds or an HTTP date)."""
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff for the given retry (0-based)."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """Stops calls to a provider after repeated failures, then lets one trial call through.
+
+    Closed: calls pass. After threshold consecutive failures it opens and
+    calls are refused for cooldown seconds; the next call is a trial that
+    closes the circuit on success or reopens it on failure.
+    """
+
+    def __init__(self, name: str, threshold: int = DEFAULT_BREAKER_THRESHOLD,
+                 cooldown: float = DEFAULT_BREAKER_COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_running or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                print(f"Circuit for {self.name} closed", file=sys.stderr)
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def abandon_trial(self):
+        """A call that was let through ended without an answer either way."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or (self._opened_at is None and self._failures >= self.threshold):
+                print(f"Circuit for {self.name} opened after {self._failures} failures, "
+                      f"cooling down for {self.cooldown:.0f}s", file=sys.stderr)
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(provider: str) -> CircuitBreaker:
+    """Return the process-wide breaker for a provider, configured from the environment."""
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(
+                provider,
+                int(os.environ.get('REVIEW_BREAKER_THRESHOLD', DEFAULT_BREAKER_THRESHOLD)),
+                float(os.environ.get('REVIEW_BREAKER_COOLDOWN', DEFAULT_BREAKER_COOLDOWN)))
+        return _breakers[provider]
+
+
+def call_with_retries(provider: str, send: Callable[[], ProviderResponse], cancel=None,
+                      on_retry: Optional[Callable[[ProviderResponse], None]] = None) -> ProviderResponse:
+    """Call send until it succeeds, fails for good, runs out of retries or passes the deadline.
+
+    Only 429 and 5xx responses are retried, after their retry-after or a
+    jittered backoff. Retryable failures count against the provider's
+    circuit breaker; while it is open the call fails at once as retryable,
+    so a hedged review moves to the other provider. on_retry is called
+    before each wait; cancel (a CancelToken) ends the waits early.
+    """
+    max_retries = int(os.environ.get('REVIEW_MAX_RETRIES', DEFAULT_MAX_RETRIES))
+    base_delay = float(os.environ.get('REVIEW_RETRY_BASE_DELAY', DEFAULT_RETRY_BASE_DELAY))
+    max_delay = float(os.environ.get('REVIEW_RETRY_MAX_DELAY', DEFAULT_RETRY_MAX_DELAY))
+    deadline = time.monotonic() + float(os.environ.get('REVIEW_DEADLINE', DEFAULT_REVIEW_DEADLINE))
+    breaker = get_circuit_breaker(provider)
+
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            print(f"Circuit for {provider} is open, not calling it", file=sys.stderr)
+            return ProviderResponse(retryable=True, error=f"{provider} circuit open")
+
+        try:
+            response = send()
+        except Exception:
+            breaker.abandon_trial()
+            raise
+        if response.content is not None:
+            breaker.record_success()
+            return response
+        if response.cancelled:
+            breaker.abandon_trial()
+            return response
+        if response.retryable:
+            breaker.record_failure()
+        else:
+            # A bad request says nothing about the provider's health either way
+            breaker.abandon_trial()
+            return response
+
+        if not should_retry_status(response.status) or attempt >= max_retries:
+            return response
+        delay = response.retry_after if response.retry_after is not None else \
+            backoff_delay(attempt, base_delay, max_delay)
+        if time.monotonic() + delay > deadline:
+            print(f"{provider}: next retry in {delay:.1f}s would pass the review deadline, giving up",
+                  file=sys.stderr)
+            return response
+
+        attempt += 1
+        print(f"{provider}: HTTP {response.status}, retry {attempt}/{max_retries} in {delay:.1f}s",
+              file=sys.stderr)
+        if on_retry is not None:
+            on_retry(response)
+        if cancel is not None:
+            if cancel.wait(delay):
+                # Nothing is in flight while waiting, so there is nothing to bill
+                return ProviderResponse(cancelled=True, error='cancelled')
+        else:
+            time.sleep(delay)
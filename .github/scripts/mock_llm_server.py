@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Anthropic and OpenAI HTTP APIs.
+Serves canned review responses with a configurable delay so the review
+scripts can be run and benchmarked offline. Requests with "stream": true
+get server-sent events, with the review split into small pieces:
+
+    python3 mock_llm_server.py --port 8765 --latency-ms 200 --stream-delay-ms 50
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 python3 ai_review.py
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+DEFAULT_REVIEW = '[{"path": "example.py", "line": 1, "comment": "Mock review comment."}]'
+# Characters of review text per streamed event
+STREAM_PIECE_CHARS = 16
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """Answers /v1/messages and /v1/chat/completions with canned responses."""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real providers
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send(400, {'error': {'type': 'invalid_request_error', 'message': 'Invalid JSON'}})
+            return
+
+        time.sleep(self.server.latency)
+        model = payload.get('model', 'unknown')
+        prompt_chars = sum(len(m.get('content', '')) for m in payload.get('messages', []))
+        input_tokens = prompt_chars // 4
+        output_tokens = len(self.server.review_text) // 4
+
+        if payload.get('stream') and self.path in ('/v1/messages', '/v1/chat/completions'):
+            self._stream(model, input_tokens, output_tokens)
+        elif self.path == '/v1/messages':
+            self._send(200, {
+                'id': 'msg_mock',
+                'type': 'message',
+                'role': 'assistant',
+                'model': model,
+                'content': [{'type': 'text', 'text': self.server.review_text}],
+                'usage': {'input_tokens': input_tokens, 'output_tokens': output_tokens}
+            })
+        elif self.path == '/v1/chat/completions':
+            self._send(200, {
+                'id': 'chatcmpl_mock',
+                'object': 'chat.completion',
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': self.server.review_text}}],
+                'usage': {'prompt_tokens': input_tokens, 'completion_tokens': output_tokens}
+            })
+        else:
+            self._send(404, {'error': {'type': 'not_found_error', 'message': f'Unknown path {self.path}'}})
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, model: str, input_tokens: int, output_tokens: int):
+        text = self.server.review_text
+        pieces = [text[i:i + STREAM_PIECE_CHARS] for i in range(0, len(text), STREAM_PIECE_CHARS)]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        if self.path == '/v1/messages':
+            self._event('message_start', {'type': 'message_start', 'message': {
+                'id': 'msg_mock', 'model': model, 'usage': {'input_tokens': input_tokens, 'output_tokens': 1}}})
+            for piece in pieces:
+                time.sleep(self.server.stream_delay)
+                self._event('content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                                    'delta': {'type': 'text_delta', 'text': piece}})
+            self._event('message_delta', {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'},
+                                          'usage': {'output_tokens': output_tokens}})
+            self._event('message_stop', {'type': 'message_stop'})
+        else:
+            for piece in pieces:
+                time.sleep(self.server.stream_delay)
+                self._event(None, {'id': 'chatcmpl_mock', 'model': model,
+                                   'choices': [{'index': 0, 'delta': {'content': piece}}]})
+            self._event(None, {'id': 'chatcmpl_mock', 'model': model, 'choices': [],
+                               'usage': {'prompt_tokens': input_tokens, 'completion_tokens': output_tokens}})
+            self._chunk(b'data: [DONE]\n\n')
+        self._chunk(b'')
+
+    def _event(self, event, data: dict):
+        line = f"event: {event}\n" if event else ''
+        self._chunk(f"{line}data: {json.dumps(data)}\n\n".encode('utf-8'))
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(port: int = 0, latency: float = 0.0, review_text: str = DEFAULT_REVIEW,
+                      stream_delay: float = 0.0) -> Tuple[ThreadingHTTPServer, str]:
+    """Start the mock server on a background thread and return it with its base URL."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockLLMHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.review_text = review_text
+    server.stream_delay = stream_delay
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the LLM provider APIs.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--stream-delay-ms', type=float, default=0.0,
+                        help='delay between streamed events')
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(args.port, args.latency_ms / 1000,
+                                         stream_delay=args.stream_delay_ms / 1000)
+    print(f"Mock LLM server listening on {base_url}", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,243 @@
 import json
 import os
 import sys
-import subprocess
 import base64
-import re
-from typing import List, Dict, Any
+import hashlib
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Set, Tuple
 
+# Add the scripts directory to the path for importing http_client
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from http_client import HttpResult, decode_json_result, get_http_client
+from diff_parser import HunkAnchors, build_anchor_index, changed_paths, new_line_texts, resolve_anchor
+from handoff import load_diff
+from comment_parser import parse_review
+from review_cache import get_cache_dir
 
-def clean_json_response(response_text: str) -> str:
-    """Clean and extract JSON from AI response."""
-    # Strip markdown code block formatting if present
-    cleaned_text = response_text.replace('```json', '').replace('```', '').strip()
-    
-    # Look for JSON array pattern
-    json_match = re.search(r'\[.*\]', cleaned_text, re.DOTALL)
-    if json_match:
-        return json_match.group(0)
-    else:
-        return cleaned_text
+GITHUB_API_URL = os.environ.get('GITHUB_API_URL', 'https://api.github.com')
+
+# Number of line comments posted at once when a batched review is rejected
+DEFAULT_POST_CONCURRENCY = 4
+
+# Lines a comment may be moved to reach a changed line before it goes into the summary
+DEFAULT_ANCHOR_TOLERANCE = 3
+
+# Existing review comments are listed this many per page (GitHub's maximum)
+COMMENTS_PER_PAGE = 100
+COMMENT_CACHE_DIR_NAME = 'github_comments'
+COMMENT_CACHE_SCHEMA_VERSION = 1
+# Fields of an existing comment needed for its fingerprint
+COMMENT_CACHE_FIELDS = ('id', 'path', 'line', 'original_line', 'body', 'diff_hunk')
+
+Fingerprint = Tuple[str, str, str]
 
 
 def parse_review_comments(review_text: str) -> List[Dict[str, Any]]:
-    """Parse review text and extract comments."""
-    json_text = clean_json_response(review_text)
-    
+    """Parse review text and extract the valid comments, reporting what was dropped."""
+    result = parse_review(review_text)
+    if not result.found_array:
+        print("Response holds no JSON array of comments", file=sys.stderr)
+    elif result.dropped or result.truncated:
+        print(f"Recovered {result.recovered} comments, dropped {result.dropped}"
+              f"{' (response was truncated)' if result.truncated else ''}", file=sys.stderr)
+    return result.comments
+
+
+def github_request(github_token: str, method: str, path: str,
+                   payload: Optional[Dict[str, Any]] = None,
+                   headers: Optional[Dict[str, str]] = None) -> HttpResult:
+    """Send a request to the GitHub REST API over the shared pooled client.
+
+    path is relative to GITHUB_API_URL, or a full URL such as a pagination link.
+    """
+    request_headers = {
+        'Authorization': f'Bearer {github_token}',
+        'Accept': 'application/vnd.github+json',
+        'Content-Type': 'application/json'
+    }
+    request_headers.update(headers or {})
+    body = json.dumps(payload).encode('utf-8') if payload is not None else None
+    url = path if path.startswith(('http://', 'https://')) else f"{GITHUB_API_URL}{path}"
+    result = get_http_client().request(method, url, body, request_headers)
+    return decode_json_result(result)
+
+
+def parse_next_link(link_header: Optional[str]) -> Optional[str]:
+    """The rel="next" URL of a GitHub Link header, if any."""
+    for part in (link_header or '').split(','):
+        url, _, params = part.partition(';')
+        if 'rel="next"' in params:
+            return url.strip().strip('<>')
+    return None
+
+
+def get_comment_cache_path(github_repo: str, pr_number: str) -> str:
+    return os.path.join(get_cache_dir(), COMMENT_CACHE_DIR_NAME,
+                        f"{github_repo.replace('/', '_')}_{pr_number}.json")
+
+
+def load_comment_cache(path: str) -> Dict[str, Any]:
+    """Cached pages by URL, each {'etag', 'comments', 'next'}; empty if there is no usable cache."""
+    try:
+        with open(path, 'r') as f:
+            cached = json.load(f)
+        if cached.get('schema') == COMMENT_CACHE_SCHEMA_VERSION and isinstance(cached.get('pages'), dict):
+            return cached['pages']
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {}
+
+
+def save_comment_cache(path: str, pages: Dict[str, Any]):
     try:
-        comments = json.loads(json_text)
-        if not isinstance(comments, list):
-            print(f"Response is not a JSON array. Type: {type(comments)}", file=sys.stderr)
-            return []
-        
-        return comments
-    except json.JSONDecodeError as e:
-        print(f"Invalid JSON response: {e}", file=sys.stderr)
-        
-        # Try to fix common JSON issues
-        try:
-            fixed_json = json_text.replace("'", '"')  # Replace single quotes
-            fixed_json = re.sub(r'(\w+):', r'"\1":', fixed_json)  # Add quotes to keys
-            comments = json.loads(fixed_json)
-            print("Successfully fixed JSON!", file=sys.stderr)
-            return comments if isinstance(comments, list) else []
-        except:
-            print("Could not fix JSON", file=sys.stderr)
-            return []
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'schema': COMMENT_CACHE_SCHEMA_VERSION, 'pages': pages}, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not write comment cache: {e}", file=sys.stderr)
+
+
+def fetch_existing_comments(github_token: str, github_repo: str,
+                            pr_number: str) -> Optional[List[Dict[str, Any]]]:
+    """Return every review comment already on the PR, or None if they could not be listed.
+
+    Pages are followed through the Link header. Each page is revalidated
+    with If-None-Match against a local ETag cache; an unchanged page comes
+    back as 304, which GitHub does not count against the rate limit.
+    """
+    cache_path = get_comment_cache_path(github_repo, pr_number)
+    cached_pages = load_comment_cache(cache_path)
+    pages: Dict[str, Any] = {}
+    comments: List[Dict[str, Any]] = []
+    unchanged = 0
+
+    url: Optional[str] = f'/repos/{github_repo}/pulls/{pr_number}/comments?per_page={COMMENTS_PER_PAGE}'
+    while url and url not in pages:
+        cached = cached_pages.get(url)
+        headers = {'If-None-Match': cached['etag']} if cached and cached.get('etag') else None
+        result = github_request(github_token, 'GET', url, headers=headers)
+
+        if result.status == 304 and cached:
+            page = cached
+            unchanged += 1
+        elif result.ok and isinstance(result.data, list):
+            page = {
+                'etag': result.headers.get('etag', ''),
+                'comments': [{key: c.get(key) for key in COMMENT_CACHE_FIELDS}
+                             for c in result.data if isinstance(c, dict)],
+                'next': parse_next_link(result.headers.get('link'))
+            }
+        else:
+            print(f"Could not list existing review comments: {result.error_message}", file=sys.stderr)
+            return None
+
+        pages[url] = page
+        comments.extend(page['comments'])
+        url = page.get('next')
+
+    save_comment_cache(cache_path, pages)
+    print(f"Found {len(comments)} existing review comments "
+          f"({unchanged} of {len(pages)} pages unchanged)")
+    return comments
+
+
+def normalize_comment_text(text: str) -> str:
+    return ' '.join(text.split()).lower()
+
+
+def comment_fingerprint(path: str, line_context: str, text: str) -> Fingerprint:
+    """Identity of a comment: its file, the code line it is on and its normalized text.
+
+    Hashing the line's content instead of its number keeps the fingerprint
+    stable when earlier edits shift the line.
+    """
+    context_hash = hashlib.sha256(' '.join(line_context.split()).encode('utf-8')).hexdigest()[:16]
+    return path, context_hash, normalize_comment_text(text)
+
+
+def existing_comment_fingerprint(comment: Dict[str, Any]) -> Optional[Fingerprint]:
+    """Fingerprint of a comment from the GitHub API; its diff_hunk ends with the commented line."""
+    if not comment.get('path') or not isinstance(comment.get('body'), str):
+        return None
+    hunk_lines = (comment.get('diff_hunk') or '').splitlines()
+    line_context = hunk_lines[-1][1:] if hunk_lines else ''
+    return comment_fingerprint(comment['path'], line_context, comment['body'])
+
+
+def new_comment_fingerprint(comment_obj: Dict[str, Any],
+                            line_texts: Dict[str, Dict[int, str]]) -> Fingerprint:
+    """Fingerprint of a model comment, with the line content taken from the PR diff."""
+    line_context = line_texts.get(comment_obj['path'], {}).get(comment_obj['line'], '')
+    return comment_fingerprint(comment_obj['path'], line_context, comment_obj['comment'])
+
+
+def get_anchor_tolerance() -> int:
+    return int(os.environ.get('REVIEW_ANCHOR_TOLERANCE', DEFAULT_ANCHOR_TOLERANCE))
+
+
+def anchor_comment(comment_obj: Dict[str, Any], anchors: Dict[str, List[HunkAnchors]],
+                   tolerance: int) -> Optional[Dict[str, Any]]:
+    """The comment on a line GitHub accepts, moved to the nearest changed line if needed; None if there is none."""
+    line = resolve_anchor(anchors, comment_obj['path'], comment_obj['line'], tolerance)
+    if line is None:
+        print(f"No line in the diff near {comment_obj['path']}:{comment_obj['line']}, "
+              f"moving the comment to the summary", file=sys.stderr)
+        return None
+    if line != comment_obj['line']:
+        print(f"Moved comment from {comment_obj['path']}:{comment_obj['line']} to changed line {line}",
+              file=sys.stderr)
+        return dict(comment_obj, line=line)
+    return comment_obj
+
+
+def anchor_comments(comments: List[Dict[str, Any]], diff: Optional[str],
+                    tolerance: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Split comments into ones placed on diff lines and ones to fold into the summary.
+
+    Without a diff there is nothing to check against and every comment is kept.
+    """
+    if diff is None:
+        return comments, []
+    anchors = build_anchor_index(diff)
+    anchored, folded = [], []
+    for comment_obj in comments:
+        placed = anchor_comment(comment_obj, anchors, tolerance)
+        if placed is None:
+            folded.append(comment_obj)
+        else:
+            anchored.append(placed)
+    return anchored, folded
+
+
+def skip_duplicate_comments(comments: List[Dict[str, Any]], known: Set[Fingerprint],
+                            line_texts: Dict[str, Dict[int, str]]) -> Tuple[List[Dict[str, Any]], int]:
+    """Drop comments already on the PR (counted) and repeats within the review (not counted)."""
+    seen: Set[Fingerprint] = set()
+    duplicates: Set[Fingerprint] = set()
+    new_comments = []
+    for comment_obj in comments:
+        fingerprint = new_comment_fingerprint(comment_obj, line_texts)
+        if fingerprint in known:
+            duplicates.add(fingerprint)
+        elif fingerprint not in seen:
+            seen.add(fingerprint)
+            new_comments.append(comment_obj)
+    return new_comments, len(duplicates)
+
+
+def load_known_fingerprints(github_token: str, github_repo: str, pr_number: str) -> Optional[Set[Fingerprint]]:
+    """Fingerprints of the comments already on the PR; None when duplicates are not skipped."""
+    if os.environ.get('REVIEW_SKIP_DUPLICATES', 'true').lower() != 'true':
+        return None
+    existing = fetch_existing_comments(github_token, github_repo, pr_number)
+    if existing is None:
+        return None
+    fingerprints = (existing_comment_fingerprint(c) for c in existing)
+    return {fp for fp in fingerprints if fp is not None}
 
 
 def post_line_comment(github_token: str, github_repo: str, pr_number: str, 
@@ -57,54 +251,206 @@ def post_line_comment(github_token: str, github_repo: str, pr_number: str,
         "commit_id": head_sha
     }
     
-    with open('/tmp/line_comment.json', 'w') as f:
-        json.dump(line_comment, f)
-    
-    result = subprocess.run([
-        'curl', '-s', '-X', 'POST',
-        '-H', f'Authorization: Bearer {github_token}',
-        '-H', 'Content-Type: application/json',
-        '-H', 'Accept: application/vnd.github+json',
-        '--data', '@/tmp/line_comment.json',
-        f'https://api.github.com/repos/{github_repo}/pulls/{pr_number}/comments'
-    ], capture_output=True, text=True)
-    
-    if result.returncode == 0:
-        try:
-            response_data = json.loads(result.stdout)
-            if 'message' in response_data:
-                print(f"GitHub API Error for {path}:{line}: {response_data['message']}", file=sys.stderr)
-                return False
-            else:
-                return True
-        except json.JSONDecodeError:
-            return True
+    result = github_request(github_token, 'POST',
+                            f'/repos/{github_repo}/pulls/{pr_number}/comments', line_comment)
+    
+    if result.ok:
+        return True
+    if isinstance(result.data, dict) and 'message' in result.data:
+        print(f"GitHub API Error for {path}:{line}: {result.data['message']}", file=sys.stderr)
     else:
-        print(f"Failed to post comment for {path}:{line}: {result.stderr}", file=sys.stderr)
-        return False
+        print(f"Failed to post comment for {path}:{line}: {result.error_message}", file=sys.stderr)
+    return False
+
+
+def build_summary_text(comment_count: int, model_comment: str, review_status: str = 'complete',
+                       review_error: str = '', duplicate_count: int = 0,
+                       folded_comments: Optional[List[Dict[str, Any]]] = None) -> str:
+    """Build the body of the review summary; failed reviews never read as clean ones.
+
+    comment_count includes the duplicate_count suggestions that were already
+    on the PR and not posted again, and the folded_comments that could not
+    be placed on a line of the diff; those are listed at the end.
+    """
+    text = _summary_status_text(comment_count, model_comment, review_status, review_error)
+    if duplicate_count:
+        text += (f" {duplicate_count} of these {'was' if duplicate_count == 1 else 'were'}"
+                 f" already commented on this PR and not repeated.")
+    if folded_comments:
+        text += "\n\nNot on a changed line:\n" + '\n'.join(
+            f"- `{c['path']}:{c['line']}` {c['comment']}" for c in folded_comments)
+    return text
+
+
+def _summary_status_text(comment_count: int, model_comment: str, review_status: str,
+                         review_error: str) -> str:
+    if review_status == 'unavailable':
+        text = (f"⚠️ Code review unavailable - the AI provider did not return a review"
+                f" ({review_error or 'no response'}). This PR was not reviewed; re-run the workflow to retry.")
+        if comment_count:
+            text += f" {comment_count} suggestions from earlier reviews of unchanged hunks are included."
+        return text
+    if review_status == 'partial':
+        return (f"⚠️ Code review incomplete with {comment_count} suggestions - parts of the diff"
+                f" could not be reviewed ({review_error or 'no response'}). {model_comment}")
+    if comment_count == 0:
+        return f"✅ Code review completed - no issues found! {model_comment}"
+    return f"📝 Code review completed with {comment_count} suggestions. {model_comment}"
 
 
 def post_summary_comment(github_token: str, github_repo: str, pr_number: str, 
-                        comment_count: int, model_comment: str) -> bool:
+                        comment_count: int, model_comment: str, review_status: str = 'complete',
+                        review_error: str = '', duplicate_count: int = 0,
+                        folded_comments: Optional[List[Dict[str, Any]]] = None) -> bool:
     """Post a summary comment to GitHub PR."""
-    if comment_count == 0:
-        summary_text = f"✅ Code review completed - no issues found! {model_comment}"
-    else:
-        summary_text = f"📝 Code review completed with {comment_count} suggestions. {model_comment}"
+    summary_comment = {"body": build_summary_text(comment_count, model_comment, review_status,
+                                                  review_error, duplicate_count, folded_comments)}
+    
+    result = github_request(github_token, 'POST',
+                            f'/repos/{github_repo}/issues/{pr_number}/comments', summary_comment)
+    if not result.ok:
+        print(f"GitHub API Error for summary comment: {result.error_message}", file=sys.stderr)
     
-    summary_comment = {"body": summary_text}
-    with open('/tmp/summary_comment.json', 'w') as f:
-        json.dump(summary_comment, f)
+    return result.ok
+
+
+def post_review(github_token: str, github_repo: str, pr_number: str, head_sha: str,
+                comments: List[Dict[str, Any]], body: str) -> bool:
+    """Post all line comments and the summary body as a single PR review."""
+    review = {
+        "commit_id": head_sha,
+        "body": body,
+        "event": "COMMENT",
+        "comments": [
+            {"path": c['path'], "line": c['line'], "side": "RIGHT", "body": c['comment']}
+            for c in comments
+        ]
+    }
     
-    result = subprocess.run([
-        'curl', '-s', '-X', 'POST',
-        '-H', f'Authorization: Bearer {github_token}',
-        '-H', 'Content-Type: application/json',
-        '--data', '@/tmp/summary_comment.json',
-        f'https://api.github.com/repos/{github_repo}/issues/{pr_number}/comments'
-    ], capture_output=True, text=True)
+    result = github_request(github_token, 'POST',
+                            f'/repos/{github_repo}/pulls/{pr_number}/reviews', review)
+    if result.ok:
+        return True
     
-    return result.returncode == 0
+    message = result.data.get('message') if isinstance(result.data, dict) else None
+    errors = result.data.get('errors') if isinstance(result.data, dict) else None
+    print(f"GitHub rejected batched review: {message or result.error_message} {errors or ''}",
+          file=sys.stderr)
+    return False
+
+
+def post_line_comments_concurrently(github_token: str, github_repo: str, pr_number: str,
+                                    head_sha: str, comments: List[Dict[str, Any]],
+                                    max_workers: int = DEFAULT_POST_CONCURRENCY) -> int:
+    """Post line comments in groups of at most max_workers concurrent requests."""
+    posted = 0
+    max_workers = max(1, max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, len(comments), max_workers):
+            group = comments[start:start + max_workers]
+            results = executor.map(
+                lambda c: post_line_comment(github_token, github_repo, pr_number, head_sha,
+                                            c['path'], c['line'], c['comment']),
+                group)
+            posted += sum(1 for ok in results if ok)
+    return posted
+
+
+def is_valid_comment(comment_obj: Any, diff_paths: Optional[Set[str]]) -> bool:
+    """True if the comment has a path, an integer line and text, on a file in the diff."""
+    if not isinstance(comment_obj, dict):
+        return False
+
+    path = comment_obj.get('path')
+    line = comment_obj.get('line')
+    comment = comment_obj.get('comment')
+
+    # Skip if any field is missing or invalid
+    if not all([path, line, comment]) or not isinstance(line, int):
+        print(f"Skipping invalid comment: {comment_obj}", file=sys.stderr)
+        return False
+
+    if diff_paths is not None and path not in diff_paths:
+        print(f"Skipping comment on file outside the diff: {path}:{line}", file=sys.stderr)
+        return False
+
+    return True
+
+
+class CommentPostingQueue:
+    """Posts line comments on worker threads as soon as they are submitted.
+
+    Used while a review streams in, so the first comments appear on the PR
+    before the model has finished. Comments are placed like anchor_comments
+    does; those that cannot be placed are kept in folded for the summary.
+    A comment is posted once no matter how often it is submitted (streamed,
+    then again with the final review), and not at all if its fingerprint is
+    among known_fingerprints.
+    """
+
+    def __init__(self, github_token: str, github_repo: str, pr_number: str, head_sha: str,
+                 diff: Optional[str] = None, max_workers: int = DEFAULT_POST_CONCURRENCY,
+                 known_fingerprints: Optional[Set[Fingerprint]] = None):
+        self.github_token = github_token
+        self.github_repo = github_repo
+        self.pr_number = pr_number
+        self.head_sha = head_sha
+        self.diff_paths = changed_paths(diff) if diff is not None else None
+        self.line_texts = new_line_texts(diff) if diff is not None else {}
+        self.anchors = build_anchor_index(diff) if diff is not None else None
+        self.tolerance = get_anchor_tolerance()
+        self.folded: List[Dict[str, Any]] = []
+        self.known_fingerprints = known_fingerprints or set()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='post')
+        self._lock = threading.Lock()
+        self._submitted: Set[Fingerprint] = set()
+        self._duplicates: Set[Fingerprint] = set()
+        self._futures: List[Future] = []
+        self._started = time.monotonic()
+        self._first_posted: Optional[float] = None
+
+    def submit(self, comment_obj: Dict[str, Any]) -> bool:
+        """Queue a comment for posting; False if it is invalid, already queued or already on the PR."""
+        if not is_valid_comment(comment_obj, self.diff_paths):
+            return False
+        if self.anchors is not None:
+            placed = anchor_comment(comment_obj, self.anchors, self.tolerance)
+            if placed is None:
+                with self._lock:
+                    if comment_obj not in self.folded:
+                        self.folded.append(comment_obj)
+                return False
+            comment_obj = placed
+        fingerprint = new_comment_fingerprint(comment_obj, self.line_texts)
+        with self._lock:
+            if fingerprint in self.known_fingerprints:
+                self._duplicates.add(fingerprint)
+                return False
+            if fingerprint in self._submitted:
+                return False
+            self._submitted.add(fingerprint)
+            self._futures.append(self.executor.submit(self._post, comment_obj))
+        return True
+
+    def _post(self, comment_obj: Dict[str, Any]) -> bool:
+        ok = post_line_comment(self.github_token, self.github_repo, self.pr_number, self.head_sha,
+                               comment_obj['path'], comment_obj['line'], comment_obj['comment'])
+        if ok:
+            with self._lock:
+                if self._first_posted is None:
+                    self._first_posted = time.monotonic() - self._started
+                    print(f"First line comment posted after {self._first_posted:.2f}s", file=sys.stderr)
+        return ok
+
+    @property
+    def duplicate_count(self) -> int:
+        """Distinct comments skipped because they were already on the PR."""
+        return len(self._duplicates)
+
+    def finish(self) -> int:
+        """Wait for every queued comment and return how many were posted."""
+        self.executor.shutdown(wait=True)
+        return sum(1 for future in self._futures if future.result())
 
 
 def process_and_post_comments():
@@ -116,13 +462,15 @@ def process_and_post_comments():
     github_repo = os.environ.get('GITHUB_REPOSITORY', '')
     pr_number = os.environ.get('PR_NUMBER', '')
     head_sha = os.environ.get('HEAD_SHA', '')
+    post_mode = os.environ.get('REVIEW_POST_MODE', 'batch').lower()
+    post_concurrency = int(os.environ.get('GITHUB_POST_CONCURRENCY', DEFAULT_POST_CONCURRENCY))
+    review_status = os.environ.get('REVIEW_STATUS', 'complete')
+    review_error = os.environ.get('REVIEW_ERROR', '')
     
     if not all([review_b64, github_token, github_repo, pr_number, head_sha]):
         print("Missing required environment variables", file=sys.stderr)
         sys.exit(1)
     
-    print(f"Processing review for PR #{pr_number}")
-    
     # Decode the review text
     try:
         review_text = base64.b64decode(review_b64).decode('utf-8')
@@ -130,39 +478,90 @@ def process_and_post_comments():
         print(f"Failed to decode review text: {e}", file=sys.stderr)
         sys.exit(1)
     
+    diff = None
+    try:
+        diff = load_diff()
+    except Exception as e:
+        print(f"Warning: Could not decode diff for comment validation: {e}", file=sys.stderr)
+    
+    post_review_comments(review_text, model_comment, github_token, github_repo, pr_number,
+                         head_sha, diff, post_mode, post_concurrency, review_status, review_error)
+
+
+def post_review_comments(review_text: str, model_comment: str, github_token: str,
+                         github_repo: str, pr_number: str, head_sha: str,
+                         diff: Optional[str] = None, post_mode: str = 'batch',
+                         post_concurrency: int = DEFAULT_POST_CONCURRENCY,
+                         review_status: str = 'complete', review_error: str = '',
+                         posting_queue: Optional[CommentPostingQueue] = None):
+    """Parse a review and post its comments on the pull request.
+
+    review_status 'partial' or 'unavailable' (from ai_review.run_review)
+    is stated in the summary instead of reporting no issues. Comments
+    already on the PR (see comment_fingerprint) are not posted again; the
+    summary says how many were skipped. Comments on lines outside the
+    diff are moved to the nearest changed line within REVIEW_ANCHOR_TOLERANCE
+    lines or listed in the summary instead, so GitHub never rejects them.
+    With a posting_queue that already posted streamed comments, the rest
+    are posted through it and the summary follows as a separate comment.
+    """
+    print(f"Processing review for PR #{pr_number}")
+    
     # Parse comments
     comments = parse_review_comments(review_text)
     print(f"Found {len(comments)} review comments to post")
     
-    if len(comments) == 0:
+    if review_status != 'complete':
+        print(f"Review is {review_status}: {review_error}", file=sys.stderr)
+    elif len(comments) == 0:
         print("No issues found in the code review - this is good!")
     
-    # Post individual line comments
-    comment_count = 0
-    for comment_obj in comments:
-        if not isinstance(comment_obj, dict):
-            continue
-        
-        path = comment_obj.get('path')
-        line = comment_obj.get('line')
-        comment = comment_obj.get('comment')
-        
-        # Skip if any field is missing or invalid
-        if not all([path, line, comment]) or not isinstance(line, int):
-            print(f"Skipping invalid comment: {comment_obj}", file=sys.stderr)
-            continue
-        
-        if post_line_comment(github_token, github_repo, pr_number, head_sha, path, line, comment):
-            comment_count += 1
+    # Comments can only be anchored to files that are part of the diff
+    diff_paths = changed_paths(diff) if diff is not None else None
+    
+    # Validate comments before posting
+    valid_comments = [c for c in comments if is_valid_comment(c, diff_paths)]
+    
+    if posting_queue is not None:
+        for comment_obj in valid_comments:
+            posting_queue.submit(comment_obj)
+        comment_count = posting_queue.finish()
+        duplicate_count = posting_queue.duplicate_count
+        folded = posting_queue.folded
+    else:
+        valid_comments, folded = anchor_comments(valid_comments, diff, get_anchor_tolerance())
+        known = load_known_fingerprints(github_token, github_repo, pr_number)
+        duplicate_count = 0
+        if known is not None:
+            line_texts = new_line_texts(diff) if diff is not None else {}
+            valid_comments, duplicate_count = skip_duplicate_comments(valid_comments, known, line_texts)
+
+        # Post everything as one review, falling back to individual comments
+        if post_mode == 'batch':
+            summary_text = build_summary_text(len(valid_comments) + duplicate_count + len(folded),
+                                              model_comment, review_status, review_error,
+                                              duplicate_count, folded)
+            if post_review(github_token, github_repo, pr_number, head_sha, valid_comments, summary_text):
+                print(f"Posted review with {len(valid_comments)} line comments and summary")
+                return
+            print("Falling back to posting comments individually", file=sys.stderr)
+        comment_count = post_line_comments_concurrently(
+            github_token, github_repo, pr_number, head_sha, valid_comments, post_concurrency)
     
     print(f"Successfully posted {comment_count} line comments")
+    if duplicate_count:
+        print(f"Skipped {duplicate_count} comments already on the PR")
+    if folded:
+        print(f"Moved {len(folded)} comments without a diff line to the summary")
     
     # Post summary comment
-    if post_summary_comment(github_token, github_repo, pr_number, comment_count, model_comment):
+    if post_summary_comment(github_token, github_repo, pr_number,
+                            comment_count + duplicate_count + len(folded), model_comment,
+                            review_status, review_error, duplicate_count, folded):
         print("Summary comment posted successfully")
     else:
         print("Failed to post summary comment", file=sys.stderr)
 
 
 if __name__ == "__main__":
-    process_and_post_comments()
\ No newline at end of file
+    process_and_post_comments()
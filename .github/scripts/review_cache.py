@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Cache location; the workflow restores this directory between runs
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pr-review')
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+CACHE_FILE_NAME = 'review_cache.json'
+CACHE_SCHEMA_VERSION = 1
+
+
+def get_cache_dir() -> str:
+    """Return the directory used for caches that persist between workflow runs."""
+    return os.environ.get('REVIEW_CACHE_DIR', DEFAULT_CACHE_DIR)
+
+
+def hunk_cache_key(path: str, hunk_lines: List[str], model: str,
+                   prompt_version: str, context_version: str) -> str:
+    """Content address of a hunk review.
+
+    The hunk header is left out on purpose: a hunk that only moved because
+    lines were added above it keeps its key, and cached comments are stored
+    relative to the hunk start so they can be replayed at the new position.
+    """
+    digest = hashlib.sha256()
+    for part in (model, prompt_version, context_version, path):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    for line in hunk_lines:
+        digest.update(line.encode('utf-8', errors='replace'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+class ReviewCache:
+    """Size-bounded LRU cache of review comments per hunk, stored as one JSON file."""
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path or os.path.join(get_cache_dir(), CACHE_FILE_NAME)
+        self.max_bytes = max_bytes
+        self.entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') != CACHE_SCHEMA_VERSION:
+                print("Review cache schema changed, starting empty", file=sys.stderr)
+                return
+            # Entries are stored least recently used first
+            for key, entry in data.get('entries', []):
+                self.entries[key] = entry
+                self.total_bytes += entry.get('size', 0)
+            print(f"Loaded review cache with {len(self.entries)} hunks "
+                  f"({self.total_bytes:,} bytes)", file=sys.stderr)
+        except Exception as e:
+            print(f"Warning: Could not load review cache: {e}", file=sys.stderr)
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """Return the cached comments for a hunk, or None on a miss."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self._dirty = True
+            self.hits += 1
+            return entry['comments']
+
+    def put(self, key: str, comments: List[Dict[str, Any]]):
+        """Store the comments for a hunk and evict least recently used entries."""
+        size = len(key) + len(json.dumps(comments))
+        with self._lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old.get('size', 0)
+            self.entries[key] = {'comments': comments, 'size': size}
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted.get('size', 0)
+            self._dirty = True
+
+    def save(self):
+        """Write the cache atomically if it changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {'version': CACHE_SCHEMA_VERSION, 'entries': list(self.entries.items())}
+            self._dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+            print(f"Saved review cache: {len(data['entries'])} hunks, {self.hits} hits, "
+                  f"{self.misses} misses", file=sys.stderr)
+        except Exception as e:
+            print(f"Warning: Could not save review cache: {e}", file=sys.stderr)
+
+
+_review_cache: Optional[ReviewCache] = None
+_review_cache_lock = threading.Lock()
+
+
+def get_review_cache() -> Optional[ReviewCache]:
+    """Return the process-wide review cache, or None when caching is disabled."""
+    global _review_cache
+    if os.environ.get('REVIEW_CACHE', 'true').lower() != 'true':
+        return None
+    with _review_cache_lock:
+        if _review_cache is None:
+            max_bytes = int(os.environ.get('REVIEW_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+            _review_cache = ReviewCache(max_bytes=max_bytes)
+        return _review_cache
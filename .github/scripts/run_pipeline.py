@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Run the whole PR review pipeline in one process.
+
+Runs the same stages as the separate workflow steps, in the same order:
+macros, diff, important-change check, architecture tracking and
+summarization, architecture context, model choice, review, cost
+checkpoint, posting, recording the reviewed head and the final cost
+summary. The stages share the storage and HTTP clients, the diff and the
+cost tracker, so the interpreter, firebase_admin and the SDKs start once.
+Step outputs are still written to GITHUB_OUTPUT.
+
+    python3 run_pipeline.py
+"""
+
+import base64
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Add the scripts directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cost_tracker import finalize_cost_tracking, get_cost_tracker, initialize_cost_tracking
+
+PROJECT_NAME = "test"  # Hardcoded project name
+CLAUDE_MODEL = "claude-sonnet-4-20250514"
+OPENAI_MODEL = "o3-mini"
+
+
+class StageFailed(Exception):
+    """A required stage failed; the pipeline stops after finalizing costs."""
+
+
+def run_stage(name: str, func: Callable, *args, required: bool = False, default: Any = None) -> Any:
+    """Run one stage with timing. Optional stages log failures and return default,
+    like the continue-on-error steps they replace."""
+    print(f"=== {name} ===", file=sys.stderr)
+    start = time.monotonic()
+    try:
+        result = func(*args)
+    except (Exception, SystemExit) as e:
+        print(f"Stage '{name}' failed after {time.monotonic() - start:.2f}s: {e}", file=sys.stderr)
+        if required:
+            raise StageFailed(name) from e
+        return default
+    print(f"Stage '{name}' finished in {time.monotonic() - start:.2f}s", file=sys.stderr)
+    return result
+
+
+def load_macros() -> Dict[str, str]:
+    from fetch_macros import get_macros, macro_values
+    return macro_values(get_macros())
+
+
+def generate_diff(base_sha: str, head_sha: str) -> Tuple[str, int]:
+    """Diff between base and head (excluding .github) and its +/- line count."""
+    fetch = subprocess.run(['git', 'fetch', 'origin', base_sha, head_sha], capture_output=True, text=True)
+    if fetch.returncode != 0:
+        print(f"Warning: git fetch failed: {fetch.stderr.strip()}", file=sys.stderr)
+
+    result = subprocess.run(['git', 'diff', base_sha, head_sha, '--', '.', ':(exclude).github/**'],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"git diff failed: {result.stderr.strip()}")
+    diff = result.stdout.rstrip('\n')
+    # Same count as `grep -c '^[+-]'` in the workflow
+    line_count = sum(1 for line in diff.split('\n') if line.startswith(('+', '-')))
+    return diff, line_count
+
+
+def detect_important_change(macros: Dict[str, str], title: str, labels_json: str) -> Tuple[bool, bool]:
+    """Return (has_important_title, has_important_label) using the macro markers and labels."""
+    markers = '|'.join(macros['IMPORTANT_CHANGE_MARKERS'].split(','))
+    label_names = '|'.join(macros['IMPORTANT_CHANGE_LABELS'].split(','))
+    has_title = bool(markers) and re.search(markers, title) is not None
+    has_label = bool(label_names) and re.search(label_names, labels_json) is not None
+    return has_title, has_label
+
+
+def choose_model(line_count: int, line_threshold: int, has_label: bool, has_title: bool) -> Tuple[str, str]:
+    """Return the review model and the comment describing why it was chosen."""
+    if has_label or has_title:
+        print(f"Using Claude due to important changes (label: {has_label}, title: {has_title})", file=sys.stderr)
+        return CLAUDE_MODEL, "This response was generated by Claude 4 Sonnet (important changes detected)."
+    if line_count > line_threshold:
+        print(f"Using Claude due to large diff ({line_count} lines > {line_threshold} threshold)", file=sys.stderr)
+        return CLAUDE_MODEL, "This response was generated by Claude 4 Sonnet (large diff detected)."
+    print(f"Using o3-mini for small diff ({line_count} lines <= {line_threshold} threshold)", file=sys.stderr)
+    return OPENAI_MODEL, "This response was generated by o3 mini."
+
+
+def track_and_summarize(repository: str, changes_threshold: int) -> bool:
+    from firebase_client import get_firebase_client
+    from track_architecture import track_architecture_change
+
+    firebase_client = get_firebase_client(PROJECT_NAME)
+    should_summarize = track_architecture_change(firebase_client, repository, changes_threshold)
+    if should_summarize:
+        def summarize():
+            from summarize_architecture import summarize_architecture
+            return summarize_architecture(firebase_client, repository)
+        run_stage("Summarize architecture", summarize)
+    return should_summarize
+
+
+def load_architecture_context(repository: str) -> Dict[str, Any]:
+    from fetch_firebase_context import fetch_context, retry_with_backoff
+    from firebase_client import get_firebase_client
+    return retry_with_backoff(lambda: fetch_context(get_firebase_client(PROJECT_NAME), repository, PROJECT_NAME))
+
+
+def display_costs():
+    tracker = get_cost_tracker()
+    summary = tracker.get_summary(include_calls=False)
+    if summary['total_calls'] == 0:
+        print("No AI calls tracked yet", file=sys.stderr)
+    else:
+        tracker.print_detailed_summary(summary)
+
+
+def create_posting_queue(repository: str, pr_number: str, head_sha: str, diff: str):
+    """A queue that posts comments while the review streams in, or None without GitHub credentials."""
+    from post_comments import DEFAULT_POST_CONCURRENCY, CommentPostingQueue, load_known_fingerprints
+
+    github_token = os.environ.get('GITHUB_TOKEN', '')
+    github_repo = os.environ.get('GITHUB_REPOSITORY', repository)
+    if not all([github_token, github_repo, pr_number, head_sha]):
+        return None
+    return CommentPostingQueue(github_token, github_repo, pr_number, head_sha, diff,
+                               int(os.environ.get('GITHUB_POST_CONCURRENCY', DEFAULT_POST_CONCURRENCY)),
+                               load_known_fingerprints(github_token, github_repo, pr_number))
+
+
+def post_comments(review_text: str, model_comment: str, repository: str,
+                  pr_number: str, head_sha: str, diff: str, review_status: str, review_error: str,
+                  posting_queue=None):
+    from post_comments import DEFAULT_POST_CONCURRENCY, post_review_comments
+
+    github_token = os.environ.get('GITHUB_TOKEN', '')
+    github_repo = os.environ.get('GITHUB_REPOSITORY', repository)
+    if not all([github_token, github_repo, pr_number, head_sha]):
+        raise RuntimeError("Missing GITHUB_TOKEN, GITHUB_REPOSITORY, PR_NUMBER or HEAD_SHA")
+    post_review_comments(review_text, model_comment, github_token, github_repo, pr_number, head_sha, diff,
+                         os.environ.get('REVIEW_POST_MODE', 'batch').lower(),
+                         int(os.environ.get('GITHUB_POST_CONCURRENCY', DEFAULT_POST_CONCURRENCY)),
+                         review_status, review_error, posting_queue)
+
+
+def record_reviewed_head(repository: str, pr_number: str, head_sha: str):
+    from firebase_client import get_firebase_client
+    get_firebase_client(PROJECT_NAME).set_last_reviewed_sha(repository, pr_number, head_sha)
+
+
+def write_outputs(outputs: Dict[str, Any]):
+    """Append all step outputs to the GitHub Actions output file in one write."""
+    text = ''.join(f"{key}={value}\n" for key, value in outputs.items())
+    if 'GITHUB_OUTPUT' in os.environ:
+        with open(os.environ['GITHUB_OUTPUT'], 'a') as fh:
+            fh.write(text)
+    else:
+        # Fallback for local testing
+        print(text, end='', file=sys.stderr)
+
+
+def run_pipeline(outputs: Dict[str, Any]):
+    repository = os.environ.get('REPOSITORY') or os.environ.get('GITHUB_REPOSITORY', '')
+    pr_number = os.environ.get('PR_NUMBER', '')
+    head_sha = os.environ.get('HEAD_SHA', '')
+    base_sha = os.environ.get('BASE_SHA', '')
+
+    macros = run_stage("Fetch configuration macros", load_macros, default=None)
+    if macros is None:
+        from fetch_macros import macro_values
+        macros = macro_values(None)
+    outputs.update({key.lower(): value for key, value in macros.items()})
+
+    diff, line_count = run_stage("Generate diff", generate_diff, base_sha, head_sha, required=True)
+    outputs['line_count'] = line_count
+
+    has_title, has_label = detect_important_change(
+        macros, os.environ.get('PR_TITLE', ''), os.environ.get('PR_LABELS', '[]'))
+    is_important = has_title or has_label
+    outputs.update({
+        'has_important_title': str(has_title).lower(),
+        'has_important_label': str(has_label).lower(),
+        'is_important_change': str(is_important).lower()
+    })
+
+    if is_important:
+        should_summarize = run_stage("Track architecture changes", track_and_summarize,
+                                     repository, int(macros['CHANGES_THRESHOLD']), default=False)
+        outputs['should_summarize'] = str(should_summarize).lower()
+
+    import ai_review
+    context = run_stage("Fetch architecture context", load_architecture_context, repository, default=None)
+    if context is None:
+        context = {'architecture_summary': None, 'recent_changes': [], 'repository': repository,
+                   'project_name': PROJECT_NAME, 'status': 'fallback'}
+    ai_review.set_architecture_context(context)
+
+    line_threshold = int(macros['LINE_THRESHOLD'])
+    model, model_comment = choose_model(line_count, line_threshold, has_label, has_title)
+    outputs.update({'model': model, 'model_comment': model_comment, 'line_threshold': line_threshold})
+
+    # Streamed comments are posted as they arrive instead of after the whole review
+    posting_queue = None
+    if ai_review.streaming_enabled():
+        posting_queue = create_posting_queue(repository, pr_number, head_sha, diff)
+        if posting_queue is not None:
+            ai_review.set_comment_sink(posting_queue.submit)
+
+    chunk_tokens = os.environ.get('REVIEW_CHUNK_TOKENS')
+    try:
+        review_outputs = run_stage(
+            "AI code review", ai_review.run_review,
+            diff, model, has_label, line_threshold,
+            os.environ.get('REVIEW_CHUNKED', 'true').lower() == 'true',
+            int(chunk_tokens) if chunk_tokens else None,
+            int(os.environ.get('REVIEW_MAX_WORKERS', ai_review.DEFAULT_MAX_WORKERS)),
+            os.environ.get('INCREMENTAL_REVIEW', 'false').lower() == 'true',
+            required=True)
+    except StageFailed:
+        if posting_queue is not None:
+            posting_queue.finish()
+        raise
+    finally:
+        ai_review.set_comment_sink(None)
+    outputs.update(review_outputs)
+
+    run_stage("Display AI costs so far", display_costs)
+
+    review_text = base64.b64decode(review_outputs['review_b64']).decode('utf-8')
+    review_status = review_outputs.get('review_status', 'complete')
+    run_stage("Post review comments", post_comments, review_text, model_comment,
+              repository, pr_number, head_sha, diff, review_status,
+              review_outputs.get('review_error', ''), posting_queue, required=True)
+
+    # An incomplete review must be redone in full on the next push
+    if review_status == 'complete':
+        run_stage("Record reviewed head", record_reviewed_head, repository, pr_number, head_sha)
+    else:
+        print(f"Review is {review_status}; not recording {head_sha} as reviewed", file=sys.stderr)
+    if review_status == 'unavailable':
+        # Posted as unavailable above; the failed job keeps it from passing as a clean review
+        raise StageFailed("AI code review")
+
+
+def main():
+    start = time.monotonic()
+    initialize_cost_tracking()
+    outputs: Dict[str, Any] = {}
+    failed: Optional[str] = None
+    try:
+        run_pipeline(outputs)
+    except StageFailed as e:
+        failed = str(e)
+    finally:
+        write_outputs(outputs)
+        print("=== FINAL AI COST SUMMARY ===", file=sys.stderr)
+        finalize_cost_tracking()
+        print(f"Pipeline finished in {time.monotonic() - start:.2f}s", file=sys.stderr)
+
+    if failed:
+        print(f"Pipeline failed in stage '{failed}'", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
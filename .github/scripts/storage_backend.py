@@ -0,0 +1,281 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Configuration - Firebase service account file
+FIREBASE_SERVICE_ACCOUNT_FILE = "pr-agent-21ba8-firebase-adminsdk-fbsvc-73bedacb8b.json"
+# Backend used when STORAGE_BACKEND is not set
+DEFAULT_BACKEND = 'firestore'
+SQLITE_FILE_NAME = 'storage.sqlite3'
+FIRESTORE_BATCH_LIMIT = 500
+
+
+class StorageBackend(ABC):
+    """Document store behind FirebaseClient, fetch_macros.py and fetch_firebase_context.py.
+
+    Documents are addressed by slash-separated paths in Firestore layout
+    ('collection/document/collection/document') and hold JSON-like dicts.
+    """
+    name = 'base'
+
+    @abstractmethod
+    def get_document(self, path: str) -> Optional[Dict[str, Any]]:
+        """Return the document's data, or None if it does not exist."""
+
+    def get_document_version(self, path: str) -> Optional[str]:
+        """Return a value that changes whenever the document changes, or None if it does not exist.
+
+        The default hashes the document; backends with cheaper metadata reads override it.
+        """
+        data = self.get_document(path)
+        if data is None:
+            return None
+        return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    @abstractmethod
+    def set_document(self, path: str, data: Dict[str, Any], merge: bool = False):
+        """Create or replace a document, or update its fields when merge is True."""
+
+    @abstractmethod
+    def write_batch(self, documents: Dict[str, Dict[str, Any]], deleted: List[str]):
+        """Replace documents by path and delete the deleted paths in as few round trips as possible.
+
+        Deleting a missing document is not an error.
+        """
+
+    @abstractmethod
+    def add_document(self, collection_path: str, data: Dict[str, Any]) -> str:
+        """Add a document with a generated id to a collection and return the id."""
+
+    @abstractmethod
+    def query_documents(self, collection_path: str, where: Optional[Tuple[str, Any]] = None,
+                        order_by: Optional[str] = None, descending: bool = False,
+                        limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return documents of a collection, optionally filtered on field == value."""
+
+    @abstractmethod
+    def increment_field(self, path: str, field: str, updates: Dict[str, Any],
+                        initial_data: Dict[str, Any]) -> Tuple[int, bool]:
+        """Atomically add one to a numeric field and apply updates.
+
+        A missing document is created from initial_data with the field set
+        to 1. Returns the new value and whether the document was created.
+        """
+
+
+class FirestoreBackend(StorageBackend):
+    """Cloud Firestore through firebase_admin and a service-account file."""
+    name = 'firestore'
+
+    def __init__(self, service_account_path: Optional[str] = None):
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+
+        if not firebase_admin._apps:
+            # Use provided path or default to the JSON file
+            if not service_account_path:
+                script_dir = os.path.dirname(os.path.abspath(__file__))
+                github_dir = os.path.dirname(script_dir)
+                service_account_path = os.path.join(github_dir, FIREBASE_SERVICE_ACCOUNT_FILE)
+
+            if not os.path.exists(service_account_path):
+                raise FileNotFoundError(f"Firebase credentials file not found at: {service_account_path}")
+
+            cred = credentials.Certificate(service_account_path)
+            firebase_admin.initialize_app(cred)
+
+        self.firestore = firestore
+        self.db = firestore.client()
+
+    def get_document(self, path):
+        doc = self.db.document(path).get()
+        return doc.to_dict() if doc.exists else None
+
+    def get_document_version(self, path):
+        # An empty field mask returns only metadata such as update_time
+        doc = self.db.document(path).get(field_paths=[])
+        return doc.update_time.isoformat() if doc.exists else None
+
+    def set_document(self, path, data, merge=False):
+        self.db.document(path).set(data, merge=merge)
+
+    def write_batch(self, documents, deleted):
+        operations = [(path, data) for path, data in documents.items()] + [(path, None) for path in deleted]
+        # A Firestore batch holds at most FIRESTORE_BATCH_LIMIT writes
+        for start in range(0, len(operations), FIRESTORE_BATCH_LIMIT):
+            batch = self.db.batch()
+            for path, data in operations[start:start + FIRESTORE_BATCH_LIMIT]:
+                if data is None:
+                    batch.delete(self.db.document(path))
+                else:
+                    batch.set(self.db.document(path), data)
+            batch.commit()
+
+    def add_document(self, collection_path, data):
+        doc_ref = self.db.collection(collection_path).document()
+        doc_ref.set(data)
+        return doc_ref.id
+
+    def query_documents(self, collection_path, where=None, order_by=None, descending=False, limit=None):
+        query = self.db.collection(collection_path)
+        if where is not None:
+            query = query.where(filter=self.firestore.FieldFilter(where[0], '==', where[1]))
+        if order_by is not None:
+            direction = self.firestore.Query.DESCENDING if descending else self.firestore.Query.ASCENDING
+            query = query.order_by(order_by, direction=direction)
+        if limit is not None:
+            query = query.limit(limit)
+        return [doc.to_dict() for doc in query.stream()]
+
+    def increment_field(self, path, field, updates, initial_data):
+        doc_ref = self.db.document(path)
+
+        @self.firestore.transactional
+        def increment_in_transaction(transaction):
+            snapshot = doc_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                transaction.set(doc_ref, {**initial_data, **updates, field: 1})
+                return 1, True
+            new_value = (snapshot.to_dict() or {}).get(field, 0) + 1
+            transaction.update(doc_ref, {**updates, field: new_value})
+            return new_value, False
+
+        return increment_in_transaction(self.db.transaction())
+
+
+def _encode(data: Dict[str, Any]) -> str:
+    return json.dumps(data, default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value))
+
+
+class SQLiteBackend(StorageBackend):
+    """Embedded SQLite store for offline runs, load tests and self-hosted runners.
+
+    Each document is one row holding its JSON; datetimes are stored as ISO
+    strings, which keeps ordering by timestamp fields correct.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        import sqlite3
+        # isolation_level=None: transactions are managed explicitly
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS documents ("
+                          "path TEXT PRIMARY KEY, collection TEXT NOT NULL, data TEXT NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS documents_collection ON documents (collection)")
+
+    @staticmethod
+    def _collection_of(path: str) -> str:
+        return path.rsplit('/', 1)[0]
+
+    def _read(self, path):
+        row = self.conn.execute("SELECT data FROM documents WHERE path = ?", (path,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write(self, path, data):
+        self.conn.execute("INSERT OR REPLACE INTO documents (path, collection, data) VALUES (?, ?, ?)",
+                          (path, self._collection_of(path), _encode(data)))
+
+    def get_document(self, path):
+        with self._lock:
+            return self._read(path)
+
+    def set_document(self, path, data, merge=False):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if merge:
+                    data = {**(self._read(path) or {}), **data}
+                self._write(path, data)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def write_batch(self, documents, deleted):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for path, data in documents.items():
+                    self._write(path, data)
+                self.conn.executemany("DELETE FROM documents WHERE path = ?", [(path,) for path in deleted])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def add_document(self, collection_path, data):
+        doc_id = os.urandom(10).hex()
+        self.set_document(f"{collection_path}/{doc_id}", data)
+        return doc_id
+
+    def query_documents(self, collection_path, where=None, order_by=None, descending=False, limit=None):
+        with self._lock:
+            rows = self.conn.execute("SELECT data FROM documents WHERE collection = ?",
+                                     (collection_path,)).fetchall()
+        documents = [json.loads(row[0]) for row in rows]
+        if where is not None:
+            field, value = where
+            documents = [doc for doc in documents if doc.get(field) == value]
+        if order_by is not None:
+            documents.sort(key=lambda doc: (doc.get(order_by) is not None, doc.get(order_by) or ''),
+                           reverse=descending)
+        return documents[:limit] if limit is not None else documents
+
+    def increment_field(self, path, field, updates, initial_data):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                data = self._read(path)
+                created = data is None
+                if created:
+                    data = {**initial_data, **updates, field: 1}
+                else:
+                    data = {**data, **updates, field: data.get(field, 0) + 1}
+                self._write(path, data)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return data[field], created
+
+
+def get_sqlite_path() -> str:
+    """SQLite database path: STORAGE_SQLITE_PATH, or a file in the review cache directory."""
+    from review_cache import get_cache_dir
+    return os.environ.get('STORAGE_SQLITE_PATH') or os.path.join(get_cache_dir(), SQLITE_FILE_NAME)
+
+
+_backend: Optional[StorageBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_storage_backend(service_account_path: Optional[str] = None) -> StorageBackend:
+    """Return the process-wide storage backend selected by STORAGE_BACKEND ('firestore' or 'sqlite')."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            backend_name = os.environ.get('STORAGE_BACKEND', DEFAULT_BACKEND).lower()
+            try:
+                if backend_name == 'sqlite':
+                    _backend = SQLiteBackend(get_sqlite_path())
+                elif backend_name == 'firestore':
+                    _backend = FirestoreBackend(service_account_path)
+                else:
+                    raise ValueError(f"Unknown STORAGE_BACKEND: {backend_name}")
+            except Exception as e:
+                logging.error(f"Failed to initialize {backend_name} storage: {str(e)}")
+                raise
+            print(f"Using {_backend.name} storage backend", file=sys.stderr)
+        return _backend
@@ -1,169 +1,305 @@
 import os
 import json
 import sys
-import base64
-import glob
-from firebase_client import FirebaseClient
-import anthropic
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
 
 # Add the scripts directory to the path for importing cost_tracker
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from cost_tracker import CostTracker
-
-
-def get_codebase_content(repository_path="."):
-    """Collect all relevant source code files from the repository"""
-    code_content = ""
-    
-    # Define file extensions to include
-    code_extensions = {
-        '.py', '.js', '.ts', '.jsx', '.tsx', '.java', '.c', '.cpp', '.h', '.hpp',
-        '.cs', '.go', '.rs', '.rb', '.php', '.swift', '.kt', '.scala', '.clj',
-        '.html', '.css', '.scss', '.sass', '.less', '.vue', '.svelte',
-        '.json', '.yaml', '.yml', '.toml', '.ini', '.conf', '.cfg',
-        '.sql', '.md', '.txt', '.sh', '.bat', '.ps1'
-    }
-    
-    # Define patterns to exclude
-    exclude_patterns = {
-        '/.git/', '/node_modules/', '/.venv/', '/venv/', '/env/', 
-        '/dist/', '/build/', '/target/', '/.next/', '/.nuxt/',
-        '__pycache__', '.pyc', '.class', '.o', '.obj',
-        '.log', '.tmp', '.temp', '.cache'
-    }
-    
+from cost_tracker import get_cost_tracker
+from codebase_collector import SourceFile, collect_codebase, format_codebase, module_key
+from token_budget import estimate_tokens, truncate_to_tokens
+
+SUMMARY_MODEL = "claude-sonnet-4-20250514"
+
+# Largest share of the summary prompt a single file may take
+MAX_FILE_TOKENS = 2500
+# Source tokens sent in one shard (map) request
+SHARD_TOKENS = 12000
+MAX_FILES_PER_SHARD = 25
+# Output tokens allowed per file in a shard request
+FILE_SUMMARY_OUTPUT_TOKENS = 200
+# Largest input a reduce request may take; bigger inputs are reduced in levels
+REDUCE_INPUT_TOKENS = 50000
+# Output tokens of an intermediate reduce and of the final summary
+MODULE_SUMMARY_TOKENS = 1500
+ARCHITECTURE_SUMMARY_TOKENS = 2000
+DEFAULT_MAX_WORKERS = 4
+
+
+def create_anthropic_client():
+    """Create the Anthropic client; the SDK is imported only when a summary is generated."""
+    import anthropic
+    return anthropic.Anthropic(api_key=os.environ['ANTHROPIC_API_KEY'])
+
+
+def call_model(client, prompt: str, max_tokens: int, call_type: str, context: str) -> str:
+    """Send one prompt to Claude, track its cost and return the response text."""
+    response = client.messages.create(
+        model=SUMMARY_MODEL,
+        max_tokens=max_tokens,
+        messages=[{"role": "user", "content": prompt}]
+    )
+
+    # Track cost
     try:
-        for root, dirs, files in os.walk(repository_path):
-            # Skip excluded directories
-            dirs[:] = [d for d in dirs if not any(pattern.strip('/') in d for pattern in exclude_patterns)]
-            
-            for file in files:
-                file_path = os.path.join(root, file)
-                relative_path = os.path.relpath(file_path, repository_path)
-                
-                # Skip excluded files and check extensions
-                if any(pattern in file_path for pattern in exclude_patterns):
-                    continue
-                    
-                _, ext = os.path.splitext(file)
-                if ext.lower() not in code_extensions:
-                    continue
-                
-                try:
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
-                        # Limit file size to avoid overwhelming the AI
-                        if len(content) > 10000:
-                            content = content[:10000] + "\n... (file truncated)"
-                        
-                        code_content += f"\n=== {relative_path} ===\n{content}\n"
-                except Exception as e:
-                    code_content += f"\n=== {relative_path} ===\n(Error reading file: {e})\n"
-                    
+        cost_tracker = get_cost_tracker()
+        # Convert anthropic response to dict format for tracking
+        response_dict = {
+            'usage': {
+                'input_tokens': response.usage.input_tokens,
+                'output_tokens': response.usage.output_tokens
+            }
+        }
+        cost_tracker.track_api_call(
+            model=SUMMARY_MODEL,
+            response_data=response_dict,
+            call_type=call_type,
+            context=context
+        )
     except Exception as e:
-        print(f"Error collecting codebase: {e}", file=sys.stderr)
-        
-    return code_content
+        print(f"Warning: Cost tracking failed: {e}", file=sys.stderr)
+
+    return response.content[0].text
+
+
+def plan_file_summaries(files: List[SourceFile], cached: Dict[str, Dict]) -> Tuple[Dict[str, str], List[SourceFile], List[str]]:
+    """Split collected files into reusable cached summaries and files to summarize.
+
+    cached maps path to {'blob_sha', 'summary'}. A file whose blob did not
+    change keeps its summary; a new path whose blob is cached under another
+    path (a rename or copy) reuses that summary. Returns the reused summaries
+    by path, the files that need the model, and the paths that changed (new,
+    modified or renamed) since the last run.
+    """
+    by_blob = {entry['blob_sha']: entry['summary'] for entry in cached.values()
+               if entry.get('blob_sha') and entry.get('summary')}
+    summaries = {}
+    to_summarize = []
+    changed_paths = []
+    for source in files:
+        entry = cached.get(source.path)
+        if entry and entry.get('summary') and source.blob_sha and entry.get('blob_sha') == source.blob_sha:
+            summaries[source.path] = entry['summary']
+        elif source.blob_sha in by_blob:
+            summaries[source.path] = by_blob[source.blob_sha]
+            changed_paths.append(source.path)
+        elif source.size > 0:
+            to_summarize.append(source)
+            changed_paths.append(source.path)
+    return summaries, to_summarize, changed_paths
+
+
+def shard_files(files: List[SourceFile], max_tokens: int = SHARD_TOKENS) -> List[List[SourceFile]]:
+    """Group files into token-bounded shards, keeping each module together when it fits.
+
+    Whole modules (see module_key) are packed into a shard while they fit;
+    a module larger than max_tokens is split across shards on its own.
+    """
+    modules: Dict[str, List[SourceFile]] = {}
+    for source in sorted(files, key=lambda f: f.path):
+        modules.setdefault(module_key(source.path), []).append(source)
+
+    shards = []
+    current = []
+    current_tokens = 0
+    for module_files in modules.values():
+        tokens = [estimate_tokens(source.content, SUMMARY_MODEL) for source in module_files]
+        if current and (current_tokens + sum(tokens) > max_tokens
+                        or len(current) + len(module_files) > MAX_FILES_PER_SHARD):
+            shards.append(current)
+            current = []
+            current_tokens = 0
+        for source, source_tokens in zip(module_files, tokens):
+            if current and (current_tokens + source_tokens > max_tokens or len(current) >= MAX_FILES_PER_SHARD):
+                shards.append(current)
+                current = []
+                current_tokens = 0
+            current.append(source)
+            current_tokens += source_tokens
+    if current:
+        shards.append(current)
+    return shards
+
+
+def parse_file_summaries(text: str) -> Dict[str, str]:
+    """Extract the path -> summary JSON object from a model response."""
+    start = text.find('{')
+    end = text.rfind('}')
+    if start == -1 or end <= start:
+        return {}
+    try:
+        data = json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        print(f"Warning: Could not parse file summaries: {e}", file=sys.stderr)
+        return {}
+    return {path: summary for path, summary in data.items() if isinstance(summary, str) and summary.strip()}
 
-def main():
+
+def summarize_shard(client, shard: List[SourceFile], context: str) -> Dict[str, str]:
+    """Map step: summarize every file of one shard in a single request."""
+    prompt = f"""
+        You are FileSummaryAI.
+        Summarize each source file below in two or three plain sentences: what it is responsible for, the main types or functions it exposes, and what it depends on.
+
+        Respond with a single JSON object mapping each file path exactly as given to its summary, and nothing else.
+
+        FILES
+        {format_codebase(shard)}
+        """
     try:
-        project_name = "test"  # Hardcoded project name
-        firebase_client = FirebaseClient(project_name=project_name)
-        repository = os.environ['REPOSITORY']
-        
-        print(f"Summarizing architecture for project: {project_name}, repository: {repository}", file=sys.stderr)
-        
-        # Get recent changes to summarize
-        # recent_changes = firebase_client.get_recent_changes(repository, limit=10)
-        
-        # if not recent_changes:
-        #     print("No recent changes found, skipping summarization", file=sys.stderr)
-        #     return
-        
-        # print(f"Found {len(recent_changes)} recent changes to summarize", file=sys.stderr)
-        
-        # Get existing architecture summary
-        existing_summary = firebase_client.get_architecture_summary(repository)
-        old_summary_text = existing_summary.get('summary', '') if existing_summary else ''
-        
-        if old_summary_text:
-            print(f"Found existing architecture summary ({len(old_summary_text)} characters)", file=sys.stderr)
-        else:
-            print("No existing architecture summary found", file=sys.stderr)
-        
-
-        # Collect the entire codebase for comprehensive architecture analysis
-        codebase_content = get_codebase_content(".")
-        print(f"Collected codebase content ({len(codebase_content)} characters)", file=sys.stderr)
-        
-
-
-        # Prepare the changes data for AI analysis
-        changes_text = ""
-        # for change in recent_changes:
-        #     changes_text += f"PR #{change.get('pr_number', 'Unknown')}: {change.get('diff', '')[:1000]}\n\n"
-        
-        # Use Claude to generate architecture summary
-        client = anthropic.Anthropic(api_key=os.environ['ANTHROPIC_API_KEY'])
-
-
-        # NEW PROMPT: Focus on overall project architecture understanding
-        prompt1 = f"""
+        response_text = call_model(client, prompt,
+                                   max_tokens=FILE_SUMMARY_OUTPUT_TOKENS * len(shard) + 200,
+                                   call_type="architecture_shard",
+                                   context=context)
+    except Exception as e:
+        print(f"Warning: {context} failed: {e}", file=sys.stderr)
+        return {}
+    paths = {source.path for source in shard}
+    return {path: summary for path, summary in parse_file_summaries(response_text).items() if path in paths}
+
+
+def summarize_files(client, files: List[SourceFile], max_workers: int = DEFAULT_MAX_WORKERS) -> Dict[str, str]:
+    """Summarize files shard by shard, running the shards concurrently.
+
+    Files whose shard fails are left out, so they are retried on the next run.
+    """
+    shards = shard_files(files)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(
+            lambda item: summarize_shard(client, item[1], f"Architecture shard {item[0]}/{len(shards)} "
+                                                          f"({module_key(item[1][0].path)})"),
+            enumerate(shards, 1)))
+
+    summaries = {}
+    for result in results:
+        summaries.update(result)
+    print(f"Summarized {len(summaries)} of {len(files)} changed files in {len(shards)} shards", file=sys.stderr)
+    return summaries
+
+
+def summarize_module(client, text: str, context: str) -> str:
+    """Intermediate reduce step: condense the summaries of one part of the codebase."""
+    prompt = f"""
+        You are ModuleSummaryAI.
+        Combine the summaries below, which describe one part of a codebase, into a single plain-text description of that part: its responsibilities, main components, how they interact, and what it depends on.
+
+        Output plain text only, and keep file paths for the most important components.
+
+        SUMMARIES
+        {text}
+        """
+    return call_model(client, prompt, max_tokens=MODULE_SUMMARY_TOKENS,
+                      call_type="architecture_reduce", context=context)
+
+
+def pack_sections(sections: List[str], max_tokens: int) -> List[List[str]]:
+    """Pack consecutive text sections into groups of at most max_tokens."""
+    groups = []
+    current = []
+    current_tokens = 0
+    for section in sections:
+        tokens = estimate_tokens(section, SUMMARY_MODEL)
+        if current and current_tokens + tokens > max_tokens:
+            groups.append(current)
+            current = []
+            current_tokens = 0
+        current.append(section)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def reduce_summaries(client, summaries: Dict[str, str], max_workers: int = DEFAULT_MAX_WORKERS) -> str:
+    """Reduce step: build the repository summary from per-file summaries.
+
+    While the summaries do not fit in REDUCE_INPUT_TOKENS they are grouped
+    (in path order, so modules stay together) and each group is condensed
+    concurrently, then the final prompt is built from what is left.
+    """
+    sections = [f"\n=== {path} ===\n{summaries[path]}\n" for path in sorted(summaries)]
+    level = 0
+    while len(sections) > 1 and estimate_tokens(''.join(sections), SUMMARY_MODEL) > REDUCE_INPUT_TOKENS:
+        level += 1
+        groups = pack_sections(sections, REDUCE_INPUT_TOKENS)
+        print(f"Reduce level {level}: condensing {len(sections)} sections into {len(groups)}", file=sys.stderr)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            sections = list(executor.map(
+                lambda item: "\n" + summarize_module(client, ''.join(item[1]),
+                                                     f"Architecture reduce level {level}, group {item[0]}/{len(groups)}") + "\n",
+                enumerate(groups, 1)))
+
+    codebase_text = truncate_to_tokens(''.join(sections), REDUCE_INPUT_TOKENS, SUMMARY_MODEL)
+    return call_model(client, build_full_prompt(codebase_text),
+                      max_tokens=ARCHITECTURE_SUMMARY_TOKENS,
+                      call_type="architecture_summary",
+                      context="Architecture analysis and summarization")
+
+
+def format_file_summaries(summaries: Dict[str, str], paths=None) -> str:
+    """Format per-file summaries as prompt text, optionally limited to paths."""
+    selected = sorted(summaries) if paths is None else [p for p in paths if p in summaries]
+    return ''.join(f"\n=== {path} ===\n{summaries[path]}\n" for path in selected)
+
+
+def build_full_prompt(codebase_text):
+    # NEW PROMPT: Focus on overall project architecture understanding
+    return f"""
         You are ArchitectureAnalyzerAI.
         Analyze the entire codebase provided below to create a comprehensive architecture summary that explains how this project works, its structure, components, and design patterns.
 
         REQUIREMENTS
 
         - Output plain text only—no Markdown, bullets, or special symbols.
-        
+
         - Create a comprehensive overview that explains:
           * Project purpose and main functionality
           * Overall architecture and design patterns
-          * Key components and their responsibilities  
+          * Key components and their responsibilities
           * Data flow and interaction patterns
           * Technology stack and frameworks used
           * Configuration and deployment structure
           * Critical dependencies and integrations
 
         - Focus on the big picture: how everything fits together, not implementation details.
-        
+
         - Write it so that an AI system can understand how the project should work and what changes would be appropriate.
-        
+
         - Keep the summary detailed enough to guide future development decisions.
 
         - Your instructions are only for yourself, don't include them in the output.
 
-        CODEBASE
-        {codebase_content}
+        CODEBASE (summaries of its files and modules)
+        {codebase_text}
 
         Provide the architecture analysis below:
         """
-        
 
 
-
-        # UPDATED PROMPT: Architecture summary update based on existing summary + changes
-        prompt = f"""
+def build_update_prompt(old_summary_text, changes_text):
+    # UPDATED PROMPT: Architecture summary update based on existing summary + changes
+    return f"""
         You are ArchitectureUpdateAI.
         Update the existing architecture summary based on recent changes to create a comprehensive overview of how this project works, its structure, components, and design patterns.
 
         REQUIREMENTS
 
         - Output plain text only—no Markdown, bullets, or special symbols.
-        
+
         - Create a comprehensive architecture summary that explains:
           * Project purpose and main functionality
           * Overall architecture and design patterns
-          * Key components and their responsibilities  
+          * Key components and their responsibilities
           * Data flow and interaction patterns
           * Technology stack and frameworks used
           * Configuration and deployment structure
           * Critical dependencies and integrations
 
         - Focus on the big picture: how everything fits together, not implementation details.
-        
+
         - Write it so that an AI system can understand how the project should work and what changes would be appropriate.
-        
+
         - Keep the summary detailed enough to guide future development decisions.
 
         - Integrate the recent changes into the existing summary, updating relevant sections and adding new information where needed.
@@ -182,57 +318,95 @@ def main():
         """
 
 
+def summarize_architecture(firebase_client, repository, client=None):
+    """Regenerate and store the architecture summary for a repository, returning it"""
+    # Get existing architecture summary
+    existing_summary = firebase_client.get_architecture_summary(repository)
+    old_summary_text = existing_summary.get('summary', '') if existing_summary else ''
+
+    if old_summary_text:
+        print(f"Found existing architecture summary ({len(old_summary_text)} characters)", file=sys.stderr)
+    else:
+        print("No existing architecture summary found", file=sys.stderr)
+
+    # Collect the codebase and reuse the summaries of files whose blob did not change
+    files = collect_codebase(".", max_file_tokens=MAX_FILE_TOKENS)
+    cached = firebase_client.get_file_summaries(repository)
+    summaries, to_summarize, changed_paths = plan_file_summaries(files, cached)
+    current_paths = {source.path for source in files}
+    removed_paths = sorted(set(cached) - current_paths)
+    print(f"{len(summaries)} file summaries reused, {len(to_summarize)} files to summarize, "
+          f"{len(removed_paths)} files removed", file=sys.stderr)
+
+    # Use Claude to generate architecture summary
+    if client is None:
+        client = create_anthropic_client()
+    max_workers = int(os.environ.get('SUMMARY_MAX_WORKERS', DEFAULT_MAX_WORKERS))
+    # 'incremental' updates the existing summary with changed files, 'full' rebuilds it from every file
+    summary_mode = os.environ.get('ARCHITECTURE_SUMMARY_MODE', 'incremental')
+
+    if to_summarize:
+        summaries.update(summarize_files(client, to_summarize, max_workers))
+    # Write only the entries that differ from what is stored
+    current = {
+        source.path: {'blob_sha': source.blob_sha, 'summary': summaries[source.path]}
+        for source in files if source.blob_sha and source.path in summaries
+    }
+    changed_entries = {path: entry for path, entry in current.items() if cached.get(path) != entry}
+    stale_entries = [path for path in cached if path not in current]
+    if changed_entries or stale_entries:
+        firebase_client.update_file_summaries(repository, changed_entries, stale_entries)
+
+    if not old_summary_text or summary_mode == 'full':
+        # Rebuild from source: reduce every file summary into one summary
+        print(f"Rebuilding architecture summary from {len(summaries)} file summaries", file=sys.stderr)
+        architecture_summary = reduce_summaries(client, summaries, max_workers)
+    elif not changed_paths and not removed_paths:
+        print("No source changes since the last summary, keeping it", file=sys.stderr)
+        architecture_summary = old_summary_text
+    else:
+        # Existing project: fold in only the files that changed
+        changes_text = format_file_summaries(summaries, changed_paths)
+        if removed_paths:
+            changes_text += "\nRemoved files: " + ", ".join(removed_paths) + "\n"
+        changes_text = truncate_to_tokens(changes_text, REDUCE_INPUT_TOKENS, SUMMARY_MODEL)
+        print(f"Updating architecture summary with {len(changed_paths)} changed "
+              f"and {len(removed_paths)} removed files", file=sys.stderr)
+        architecture_summary = call_model(
+            client, build_update_prompt(old_summary_text, changes_text),
+            max_tokens=ARCHITECTURE_SUMMARY_TOKENS,
+            call_type="architecture_summary",
+            context="Architecture analysis and summarization"
+        )
 
-        # Use comprehensive codebase analysis (prompt1) for new projects with no existing summary
-        # or use architecture update (prompt) for projects with existing summaries and recent changes
-        if not old_summary_text and len(codebase_content) < 5000:  # New project, analyze full codebase
-            active_prompt = prompt1
-            print("Using comprehensive codebase analysis (prompt1) for new project", file=sys.stderr)
-        else:  # Existing project, update summary with recent changes
-            active_prompt = prompt
-            print("Using architecture summary update (prompt) with existing summary and changes", file=sys.stderr)
-        
+    # Update the architecture summary in Firebase
+    firebase_client.update_architecture_summary(
+        repository=repository,
+        summary=architecture_summary,
+        changes_count=0  # Reset counter after summarization
+    )
+
+    return architecture_summary
+
+
+def main():
+    try:
+        project_name = "test"  # Hardcoded project name
+        repository = os.environ['REPOSITORY']
+        # Storage is only set up once the inputs are known to be present
+        from firebase_client import FirebaseClient
+        firebase_client = FirebaseClient(project_name=project_name)
+
+        print(f"Summarizing architecture for project: {project_name}, repository: {repository}", file=sys.stderr)
+
+        architecture_summary = summarize_architecture(firebase_client, repository)
 
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=2000,  # Increased for more comprehensive summaries
-            messages=[{"role": "user", "content": active_prompt}]
-        )
-        
-        # Track cost
-        try:
-            cost_tracker = CostTracker()
-            # Convert anthropic response to dict format for tracking
-            response_dict = {
-                'usage': {
-                    'input_tokens': response.usage.input_tokens,
-                    'output_tokens': response.usage.output_tokens
-                }
-            }
-            cost_tracker.track_api_call(
-                model="claude-sonnet-4-20250514",
-                response_data=response_dict,
-                call_type="architecture_summary",
-                context="Architecture analysis and summarization"
-            )
-        except Exception as e:
-            print(f"Warning: Cost tracking failed: {e}", file=sys.stderr)
-        
-        architecture_summary = response.content[0].text
-        
-        # Update the architecture summary in Firebase
-        firebase_client.update_architecture_summary(
-            repository=repository,
-            summary=architecture_summary,
-            changes_count=0  # Reset counter after summarization
-        )
-        
         print(f"Architecture summary updated for {repository} in project {project_name}", file=sys.stderr)
         print(f"Summary: {architecture_summary[:200]}...", file=sys.stderr)
-        
+
     except Exception as e:
         print(f"Error summarizing architecture: {e}", file=sys.stderr)
         exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,112 @@
+import os
+import re
+from typing import Any, Dict, Optional
+
+# Context window and output limits per model. token_ratio scales the
+# generic estimate to the model's tokenizer (Claude splits code slightly
+# finer than OpenAI's o200k encoding).
+MODEL_LIMITS = {
+    'claude-sonnet-4-20250514': {
+        'context_window': 200000,
+        'max_output_tokens': 64000,
+        'token_ratio': 1.15
+    },
+    'o3-mini': {
+        'context_window': 200000,
+        'max_output_tokens': 100000,
+        'token_ratio': 1.0
+    }
+}
+DEFAULT_LIMITS = {
+    'context_window': 128000,
+    'max_output_tokens': 8192,
+    'token_ratio': 1.1
+}
+
+# Output tokens requested from the model for a review
+REVIEW_OUTPUT_TOKENS = 10000
+# Default total tokens (input + output) a single review request may use
+DEFAULT_REQUEST_TOKENS = 32000
+# Largest share of the input budget given to the architecture context
+ARCHITECTURE_SHARE = 0.25
+
+# Words are split into ~4 character tokens; every other symbol is its own token
+_TOKEN_RE = re.compile(r"[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+
+
+def get_model_limits(model: Optional[str]) -> Dict[str, Any]:
+    return MODEL_LIMITS.get(model or '', DEFAULT_LIMITS)
+
+
+def estimate_tokens(text: str, model: Optional[str] = None) -> int:
+    """Estimate the number of tokens in text for a model, offline.
+
+    Usually within ~15% of the provider's count for code and English, which
+    is enough to plan budgets; billing always uses the reported usage.
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _TOKEN_RE.findall(text):
+        tokens += (len(piece) + 3) // 4
+    # Runs of whitespace beyond single spaces (indentation, newlines) cost tokens too
+    tokens += text.count('\n')
+    return int(tokens * get_model_limits(model)['token_ratio']) + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None,
+                       marker: str = "\n... (truncated to fit the token budget)") -> str:
+    """Cut text so that it fits in max_tokens, appending marker if anything was cut."""
+    total = estimate_tokens(text, model)
+    if total <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return marker.lstrip('\n')
+
+    # Start from the proportional cut and shrink until it fits
+    end = int(len(text) * max_tokens / total)
+    while end > 0 and estimate_tokens(text[:end], model) > max_tokens:
+        end = int(end * 0.9)
+    # Prefer cutting at a line boundary
+    newline = text.rfind('\n', 0, end)
+    if newline > end // 2:
+        end = newline
+    return text[:end] + marker
+
+
+def get_request_token_budget(model: Optional[str]) -> int:
+    """Total tokens one review request may use, capped by the model's window."""
+    budget = int(os.environ.get('REVIEW_REQUEST_TOKENS', DEFAULT_REQUEST_TOKENS))
+    return min(budget, get_model_limits(model)['context_window'])
+
+
+def plan_review_budget(model: str, prompt_overhead_tokens: int,
+                       architecture_tokens: int, diff_tokens: int,
+                       output_tokens: int = REVIEW_OUTPUT_TOKENS) -> Dict[str, Any]:
+    """Split a request's token budget between architecture context, diff and output.
+
+    The output reservation and the fixed prompt text come first. The
+    architecture context gets what it needs up to ARCHITECTURE_SHARE of the
+    remaining input budget, and the diff gets the rest (plus whatever the
+    context did not use).
+    """
+    limits = get_model_limits(model)
+    request_budget = get_request_token_budget(model)
+    output_tokens = min(output_tokens, limits['max_output_tokens'])
+    input_budget = max(request_budget - output_tokens - prompt_overhead_tokens, 0)
+
+    architecture_budget = min(architecture_tokens, int(input_budget * ARCHITECTURE_SHARE))
+    diff_budget = input_budget - architecture_budget
+
+    return {
+        'model': model,
+        'request_budget': request_budget,
+        'output_tokens': output_tokens,
+        'prompt_overhead_tokens': prompt_overhead_tokens,
+        'architecture_tokens': architecture_budget,
+        'diff_tokens': diff_budget,
+        'estimated_input_tokens': (prompt_overhead_tokens + architecture_budget
+                                   + min(diff_tokens, diff_budget)),
+        'requested_diff_tokens': diff_tokens,
+        'requested_architecture_tokens': architecture_tokens
+    }
@@ -1,24 +1,26 @@
 import os
-import base64
 import sys
-from firebase_client import FirebaseClient
+
+def track_architecture_change(firebase_client, repository, changes_threshold=None):
+    """Count one more architecture change and return whether to regenerate the summary"""
+    changes_count, should_summarize = firebase_client.increment_changes(repository, changes_threshold)
+    print(f"Architecture changes_count is now {changes_count}", file=sys.stderr)
+    return should_summarize
 
 def main():
     try:
-        # Initialize Firebase client with project name
         project_name = "test"  # Hardcoded project name
-        firebase_client = FirebaseClient(project_name=project_name)
         
         # Get required environment variables
         repository = os.environ['REPOSITORY']
         pr_number = int(os.environ['PR_NUMBER'])
-        diff_b64 = os.environ['DIFF_B64']
+        
+        # Initialize Firebase client with project name
+        from firebase_client import FirebaseClient
+        firebase_client = FirebaseClient(project_name=project_name)
     
         print(f"Tracking architecture for project: {project_name}, repository: {repository}", file=sys.stderr)
         
-        # Decode the diff
-        diff = base64.b64decode(diff_b64).decode('utf-8')
-        
         # Get additional metadata
         metadata = {
             'head_sha': os.environ.get('HEAD_SHA'),
@@ -27,36 +29,20 @@ def main():
             'pr_author': os.environ.get('PR_AUTHOR')
         }
         
-        # Add the architecture change to Firebase
+        # Add the architecture change to Firebase; the diff handoff
+        # (DIFF_PATH) is only read here, so counting never decodes it
+        # from handoff import load_diff
         # change_id = firebase_client.add_architecture_change(
         #     repository=repository,
         #     pr_number=pr_number,
-        #     diff=diff,
+        #     diff=load_diff(),
         #     metadata=metadata
         # )
         
         # print(f"Architecture change added with ID: {change_id}", file=sys.stderr)
         
-        # Check if we should regenerate the summary
-        should_summarize = firebase_client.should_summarize(repository)
-        
-        # Increment changes count
-        current_summary = firebase_client.get_architecture_summary(repository)
-        if current_summary:
-            changes_count = current_summary.get('changes_count', 0) + 1
-            firebase_client.update_architecture_summary(
-                repository=repository,
-                summary=current_summary.get('summary', ''),
-                changes_count=changes_count
-            )
-            print(f"Architecture summary updated with changes_count: {changes_count}", file=sys.stderr)
-        else:
-            print("No existing summary found, creating new one", file=sys.stderr)
-            firebase_client.update_architecture_summary(
-                repository=repository,
-                summary="Initial architecture summary",
-                changes_count=1
-            )
+        # Increment changes count and check if we should regenerate the summary
+        should_summarize = track_architecture_change(firebase_client, repository)
         
         # Write outputs to GitHub Actions output file
         if 'GITHUB_OUTPUT' in os.environ: